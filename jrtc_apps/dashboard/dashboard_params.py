@@ -21,3 +21,74 @@ include_rlc = True
 include_mac = True
 include_fapi = True
 include_xran = False
+
+# Mapping of FAPI cell_id to PCI.
+# This is used to find the UE of the per-UE FAPI stats, as FAPI reports the cell_id and rnti only.
+# If a cell_id is not in this mapping, the UE is found using the rnti only, which only works for a single cell.
+fapi_cell_id_to_pci = {}
+
+# Sharding of the UE contexts by source (jrtc device id), each shard with its own lock.
+# With 1 shard, a single UeContextsMap is used.
+# The DU, CU-CP and CU-UP of a split gNB must be in the same shard, e.g. {du_device_id: 0, cucp_device_id: 0, ...}.
+# Sources not listed are placed by a hash of the device id.
+ue_contexts_num_shards = 1
+ue_contexts_shard_by_src = {}
+
+# Eviction of the UE contexts whose delete event was lost.
+# UE contexts without activity for ue_contexts_idle_timeout_secs are deleted, and above
+# ue_contexts_max contexts, the least recently active ones are deleted.  None disables either eviction.
+# The activity of a UE is any ue_contexts event changing its context, or a MAC/RLC/PDCP/FAPI report of it.
+ue_contexts_idle_timeout_secs = 3600
+ue_contexts_max = 100000
+
+# Tombstones of the deleted UE contexts.
+# If set, the MAC, RLC, PDCP and FAPI reports still find a UE for ue_contexts_tombstone_secs after
+# its delete events, as the reports covering its last period arrive after them.
+ue_contexts_tombstone_secs = None
+
+# Snapshot of the UE contexts, for a warm restart of the dashboard.
+# If a path is set, the UE contexts are restored from it at startup, and saved to it
+# every ue_contexts_snapshot_period_secs and when the app exits.
+# The snapshot (and the journal) use the marshal format, so they are only read by the Python version
+# which wrote them: after a Python upgrade, or from a corrupted file, the dashboard starts with no UE contexts.
+ue_contexts_snapshot_path = None
+ue_contexts_snapshot_period_secs = 60
+
+# Journal of the UE context events since the last snapshot, for crash recovery.
+# At startup, the journal is replayed on the snapshot.  Only used with ue_contexts_snapshot_path,
+# as each snapshot restarts the journal.
+ue_contexts_journal_path = None
+
+# UE context deltas.
+# If True, the outputs carry the ueid of the UE context with a null ue_ctx, and the UE contexts are sent
+# once per tick in a UECTX_CHANGES message, with the fields changed since the previous tick.
+ue_contexts_deltas = False
+
+# Cell summaries of the UE contexts.
+# If set, a UECTX_CELL_SUMMARY message is sent every ue_contexts_cell_summary_period_secs, with the number
+# of UEs of each cell (nci), of UEs with E1 bearers and of UEs with AMF info.  Requires numpy.
+ue_contexts_cell_summary_period_secs = None
+
+# Trace of the UE context hooks, for the post-mortem of a UE whose mapping looks wrong.
+# If ue_contexts_trace_size is set, the last ue_contexts_trace_size hook calls, and the last
+# ue_contexts_trace_ue_size changes of each UE context, are recorded.
+# The trace is dumped in a UECTX_TRACE message on a JSON message to the JSON UDP port:
+#     {"context_type": "uectx-trace", "event": "dump"}                  the hook calls
+#     {"context_type": "uectx-trace", "event": "dump", "ueid": <ueid>}  the changes of a UE context
+# The events "start" and "stop" start and stop the trace.
+ue_contexts_trace_size = None
+ue_contexts_trace_ue_size = 32
+
+# UE contexts shared with the other jrtc apps.
+# If a path is set, the UE contexts are written to a shared memory table at that path (e.g. "/dev/shm/jrtc_ue_contexts"),
+# which the other apps read with ue_contexts_shm.UeContextsShmReader, instead of building their own UeContextsMap.
+# The table holds up to ue_contexts_shm_capacity UE contexts.
+ue_contexts_shm_path = None
+ue_contexts_shm_capacity = 100000
+
+# Per-UE KPI history.
+# If set, the last ue_kpi_history_size values of the per-UE KPIs of the MAC, RLC, PDCP and FAPI reports
+# (e.g. succ_rate, avg_sinr, l1_mcs_avg) are kept for each UE, and summarized on a "uectx-kpi" request.
+# The history of a UE is dropped with its UE context, or with its tombstone (see ue_contexts_tombstone_secs),
+# so the reports of its last period are kept.  Requires numpy.
+ue_kpi_history_size = None
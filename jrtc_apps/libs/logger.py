@@ -7,6 +7,7 @@
 
 import datetime as dt
 import json
+import threading
 
 
 #########################################################################################
@@ -25,6 +26,8 @@ class Logger:
         self.remote_logger = remote_logger
         # initialisation
         self.sn = 0
+        # log_msg() is called from several threads, this serializes the sn and the remote logger
+        self.lock = threading.Lock()
 
     ############################################
     def log_msg(self, log, rlog, structure_type, msg, timestamp=None):
@@ -46,26 +49,30 @@ class Logger:
                 "hostname": self.hostname,
                 "stream_id": self.stream_id,
                 "stream_type": self.stream_type,
-                "stream_sn": int(self.sn),
                 "stream_payload_structure": structure_type,
                 "stream_payload_time": timestamp,
                 "stream_payload_msg": msg,
             }
 
-            # check if this is valid JSON
-            try:
-                j = json.dumps(j)
-            except Exception as e:
-                print(f"Logger():log_msg: Problem dumping to JSON: {j}, Error {e}")
-                return
+            with self.lock:
+                # set under the lock, so each message gets its own sequence number
+                j["stream_sn"] = int(self.sn)
 
-            self.remote_logger.process_msg(j)
+                # check if this is valid JSON
+                try:
+                    j = json.dumps(j)
+                except Exception as e:
+                    print(f"Logger():log_msg: Problem dumping to JSON: {j}, Error {e}")
+                    return
 
-            self.sn += 1 
+                self.remote_logger.process_msg(j)
+
+                self.sn += 1 
 
    ############################################
     def process_timeout(self):
         if self.remote_logger is not None:
-            self.remote_logger.process_timeout()
+            with self.lock:
+                self.remote_logger.process_timeout()
 
 # }
@@ -0,0 +1,111 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+#
+# Dispatch of the messages of the streams of a jrtc app to their handlers.
+#
+# The app registers its streams in the order of its JrtcStreamCfg_t, so the stream_idx passed to
+# the app handler indexes the list of StreamHandler: the handler of a message is found by one list
+# lookup, whatever the number of streams, instead of comparing stream_idx with each stream in turn.
+# A StreamHandler holds the ctypes pointer type of the messages of the stream, the decoder which
+# turns the data of a message into the ctypes structure, and the handler called with it.
+#
+
+import ctypes
+from dataclasses import dataclass
+from typing import Any, Callable, List
+
+
+##########################################################################
+def decode_contents(data, ptr_type) -> Any:
+    # the ctypes structure the data points to, as the codelets send them
+    return ctypes.cast(data, ptr_type).contents
+
+
+##########################################################################
+@dataclass(frozen=True, slots=True)
+class StreamHandler:
+    name: str
+    ptr_type: Any
+    decoder: Callable
+    handler: Callable
+
+
+##########################################################################
+class StreamRegistry:
+    """
+    The handlers of the streams of an app, indexed by stream_idx.
+    """
+
+    ####################################################################
+    def __init__(self):
+        self.handlers: List[StreamHandler] = []
+
+    ####################################################################
+    def register(self, name: str, struct_type, handler: Callable, decoder: Callable = decode_contents) -> int:
+        """
+        Add the handler of the next stream of the app.
+        :param struct_type: the ctypes structure of the messages of the stream.
+        :param handler: called as handler(*args, message) by dispatch().
+        :param decoder: called as decoder(data, ctypes.POINTER(struct_type)) to get the message.
+        :return: the stream_idx of the stream.
+        """
+        self.handlers.append(StreamHandler(name, ctypes.POINTER(struct_type), decoder, handler))
+        return len(self.handlers) - 1
+
+    ####################################################################
+    def get(self, stream_idx: int) -> StreamHandler:
+        if stream_idx < 0 or stream_idx >= len(self.handlers):
+            return None
+        return self.handlers[stream_idx]
+
+    ####################################################################
+    def get_name(self, stream_idx: int) -> str:
+        h = self.get(stream_idx)
+        return None if h is None else h.name
+
+    ####################################################################
+    def dispatch(self, stream_idx: int, data, *args) -> bool:
+        """
+        Decode the data of a message of stream_idx, and call its handler with args and the message.
+        :return: False for an unknown stream_idx.
+        """
+        handlers = self.handlers
+        if stream_idx < 0 or stream_idx >= len(handlers):
+            return False
+        h = handlers[stream_idx]
+        h.handler(*args, h.decoder(data, h.ptr_type))
+        return True
+
+    ####################################################################
+    def __len__(self) -> int:
+        return len(self.handlers)
+
+
+##########################################################################
+if __name__ == "__main__":
+
+    class struct__a(ctypes.Structure):
+        _fields_ = [("timestamp", ctypes.c_uint64), ("x", ctypes.c_uint32)]
+
+    class struct__b(ctypes.Structure):
+        _fields_ = [("timestamp", ctypes.c_uint64), ("y", ctypes.c_int32), ("z", ctypes.c_int32)]
+
+    print("\n\n------ Test: stream dispatch ---------")
+    got = []
+    r = StreamRegistry()
+    assert r.register("A", struct__a, lambda state, msg: got.append((state, "A", msg.x))) == 0
+    assert r.register("B", struct__b, lambda state, msg: got.append((state, "B", msg.y + msg.z))) == 1
+    # a decoder of its own, e.g. for a message holding a copy of the data
+    assert r.register("B_COPY", struct__b, lambda state, msg: got.append((state, "B_COPY", msg.z)),
+                      decoder=lambda data, ptr_type: ptr_type._type_.from_buffer_copy(ctypes.cast(data, ptr_type).contents)) == 2
+    assert len(r) == 3 and r.get_name(1) == "B" and r.get(3) is None and r.get(-1) is None
+
+    a = struct__a(1, 7)
+    b = struct__b(2, 3, 4)
+    assert r.dispatch(0, ctypes.cast(ctypes.pointer(a), ctypes.c_void_p), "s")
+    assert r.dispatch(1, ctypes.cast(ctypes.pointer(b), ctypes.c_void_p), "s")
+    assert r.dispatch(2, ctypes.cast(ctypes.pointer(b), ctypes.c_void_p), "s")
+    assert not r.dispatch(3, ctypes.cast(ctypes.pointer(b), ctypes.c_void_p), "s")
+    assert got == [("s", "A", 7), ("s", "B", 7), ("s", "B_COPY", 4)]
+
+    print("\n\n------ All tests passed ---------")
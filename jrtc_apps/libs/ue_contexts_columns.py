@@ -0,0 +1,270 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+#
+# Columnar view of the UE contexts of a UeContextsMap, for aggregate queries such as
+# the number of UEs per PCI, TAC or NCI, or the number of UEs with AMF info.
+#
+# Each UE context has a row in NumPy arrays: plmn, pci, crnti, tac, nci and a bit field
+# of flags.  The rows are kept up to date from the change notifications of the map
+# (UeContextsMap.subscribe()), and the rows of the deleted contexts are reused (ue_rows.UeRows).
+# A notification only marks the UE context as dirty, and the dirty rows are written
+# in one go by the next query, so the hooks do not pay for the NumPy writes.
+# A missing value (e.g. the nci of a UE only known to the CU-CP) is stored as -1.
+# Requires NumPy, see ue_rows.available.
+#
+
+import threading
+from typing import Dict, List, Sequence
+
+from ue_rows import UeRows, np, available, NONE
+from ue_contexts_map import UeContext, UeContextChange, UeContextChangeKind
+
+# flags of a UE context
+FLAG_DU = 0x01              # has a du_index
+FLAG_CUCP = 0x02            # has a cucp_index
+FLAG_CUUP = 0x04            # has a cuup_index
+FLAG_E1_BEARERS = 0x08      # holds E1 bearers
+FLAG_TMSI = 0x10            # has a tmsi
+FLAG_NGAP_IDS = 0x20        # has NGAP ids
+FLAG_AMF_INFO = 0x40        # is associated with an AMF context
+
+FLAG_NAMES = {
+    FLAG_DU: "du",
+    FLAG_CUCP: "cucp",
+    FLAG_CUUP: "cuup",
+    FLAG_E1_BEARERS: "e1_bearers",
+    FLAG_TMSI: "tmsi",
+    FLAG_NGAP_IDS: "ngap_ids",
+    FLAG_AMF_INFO: "amf_info",
+}
+
+COLUMNS = ("plmn", "pci", "crnti", "tac", "nci")
+
+
+##########################################################################
+def ue_flags(ue: UeContext) -> int:
+    flags = 0
+    if ue.du_index is not None:
+        flags |= FLAG_DU
+    if ue.cucp_index is not None:
+        flags |= FLAG_CUCP
+    if ue.cuup_index is not None:
+        flags |= FLAG_CUUP
+    if len(ue.e1_bearers) > 0:
+        flags |= FLAG_E1_BEARERS
+    if ue.tmsi is not None:
+        flags |= FLAG_TMSI
+    if ue.ngap_ids is not None:
+        flags |= FLAG_NGAP_IDS
+    if ue.core_amf_info is not None:
+        flags |= FLAG_AMF_INFO
+    return flags
+
+
+##########################################################################
+class UeContextColumns:
+    """
+    Columnar mirror of the UE contexts of a UeContextsMap or ShardedUeContextsMap.
+    The rows are changed, and read by the queries, under the lock of the UeContextColumns,
+    see ShardedUeContextsMap.subscribe().
+    """
+
+    ####################################################################
+    def __init__(self, m, capacity: int = 1024):
+        if np is None:
+            raise ImportError("UeContextColumns requires numpy")
+        self.m = m
+        self.lock = threading.Lock()
+        self.rows = UeRows(capacity, self.grow)
+        self.plmn = np.full(capacity, NONE, dtype=np.int64)
+        self.pci = np.full(capacity, NONE, dtype=np.int32)
+        self.crnti = np.full(capacity, NONE, dtype=np.int32)
+        self.tac = np.full(capacity, NONE, dtype=np.int64)
+        self.nci = np.full(capacity, NONE, dtype=np.int64)
+        self.flags = np.zeros(capacity, dtype=np.uint8)
+        self.dirty = set()      # ue_ids of the contexts created or changed since the last query
+        m.subscribe(self.on_change)
+
+    ####################################################################
+    def close(self) -> None:
+        self.m.unsubscribe(self.on_change)
+
+    ####################################################################
+    def grow(self, capacity: int) -> None:
+        for name in COLUMNS:
+            setattr(self, name, np.concatenate((getattr(self, name), np.full(capacity, NONE, dtype=getattr(self, name).dtype))))
+        self.flags = np.concatenate((self.flags, np.zeros(capacity, dtype=np.uint8)))
+
+    ####################################################################
+    def on_change(self, change: UeContextChange) -> None:
+        with self.lock:
+            if change.kind != UeContextChangeKind.DELETED:
+                self.dirty.add(change.ue_id)
+                return
+            self.dirty.discard(change.ue_id)
+            row = self.rows.free(change.ue_id)
+            if row is not None:
+                self.flags[row] = 0
+
+    ####################################################################
+    def write_dirty_rows(self) -> None:
+        # called with the lock held.  The whole row of a dirty context is rewritten, which costs
+        # about as much as looking at the fields of its changes.
+        if len(self.dirty) == 0:
+            return
+        rows = []
+        values = {name: [] for name in COLUMNS + ("flags",)}
+        for ue_id in self.dirty:
+            ue = self.m.getue_by_id(ue_id)
+            if ue is None:
+                continue
+            rows.append(self.rows.alloc(ue_id))
+            r = ue.ran_unique_ue_id
+            values["plmn"].append(NONE if r is None or r.plmn is None else r.plmn)
+            values["pci"].append(NONE if r is None or r.pci is None else r.pci)
+            values["crnti"].append(NONE if r is None or r.crnti is None else r.crnti)
+            values["tac"].append(NONE if ue.tac is None else ue.tac)
+            values["nci"].append(NONE if ue.nci is None else ue.nci)
+            values["flags"].append(ue_flags(ue))
+        self.dirty.clear()
+        for name, v in values.items():
+            getattr(self, name)[rows] = v
+
+    ####################################################################
+    def get_num_ues(self) -> int:
+        with self.lock:
+            self.write_dirty_rows()
+            return len(self.rows)
+
+    ####################################################################
+    def used(self, flags: int = 0):
+        # mask of the used rows, with all of the flags set.  Called with the lock held.
+        n = self.rows.num_rows
+        mask = self.rows.used()
+        if flags != 0:
+            mask &= (self.flags[:n] & flags) == flags
+        return mask
+
+    ####################################################################
+    def count_by(self, column: str, flags: int = 0) -> Dict[int, int]:
+        """
+        Count the UEs by the values of a column, e.g. count_by("pci").
+        :param column: one of COLUMNS.
+        :param flags: only count the UEs with all of these flags set, e.g. FLAG_AMF_INFO.
+        :return: value -> number of UEs, with the UEs missing the value counted under None.
+        """
+        if column not in COLUMNS:
+            raise ValueError(f"Unknown column {column}")
+        with self.lock:
+            self.write_dirty_rows()
+            values = getattr(self, column)[:self.rows.num_rows][self.used(flags)]
+            keys, counts = np.unique(values, return_counts=True)
+        return {(None if k == NONE else int(k)): int(c) for k, c in zip(keys, counts)}
+
+    ####################################################################
+    def count_flags(self) -> Dict[str, int]:
+        """
+        :return: flag name -> number of UEs with the flag set.
+        """
+        with self.lock:
+            self.write_dirty_rows()
+            flags = self.flags[:self.rows.num_rows][self.used()]
+            return {name: int(np.count_nonzero(flags & flag)) for flag, name in FLAG_NAMES.items()}
+
+    ####################################################################
+    def group_counts(self, column: str, flags: Sequence[int] = ()) -> Dict[int, List[int]]:
+        """
+        Count the UEs by the values of a column, and among them the UEs with each of flags.
+        :return: value -> [number of UEs, number of UEs with flags[0], ...], the UEs missing
+                 the value counted under None.
+        """
+        if column not in COLUMNS:
+            raise ValueError(f"Unknown column {column}")
+        with self.lock:
+            self.write_dirty_rows()
+            mask = self.used()
+            values = getattr(self, column)[:self.rows.num_rows][mask]
+            ue_flags = self.flags[:self.rows.num_rows][mask]
+            keys, inverse = np.unique(values, return_inverse=True)
+            counts = [np.bincount(inverse, minlength=len(keys))]
+            for flag in flags:
+                counts.append(np.bincount(inverse, weights=(ue_flags & flag) != 0, minlength=len(keys)))
+        return {(None if k == NONE else int(k)): [int(c[i]) for c in counts] for i, k in enumerate(keys)}
+
+    ####################################################################
+    def cell_summary(self) -> List[Dict]:
+        """
+        :return: one record per cell (nci), with its numbers of UEs, of UEs with E1 bearers and
+                 of UEs with AMF info.
+        """
+        counts = self.group_counts("nci", (FLAG_E1_BEARERS, FLAG_AMF_INFO))
+        return [{"nci": nci, "num_ues": c[0], "num_e1_bearers": c[1], "num_amf_info": c[2]}
+                for nci, c in counts.items()]
+
+
+##########################################################################
+if __name__ == "__main__":
+
+    import sys
+    import datetime as dt
+    from ue_contexts_map import UeContextsMap, ShardedUeContextsMap
+
+    if not available:
+        print("numpy is not installed")
+        sys.exit(0)
+
+    now = dt.datetime.now(dt.UTC)
+
+    print("\n\n------ Test: UE context columns ---------")
+    s = UeContextsMap(dbg=False)
+    c = UeContextColumns(s, capacity=2)
+    for n in range(6):
+        s.hook_du_ue_ctx_creation("du0", n, 101, 400 + n % 2, 1000 + n, 12, 201 + n % 2, now=now)
+    assert c.get_num_ues() == 6 and c.rows.capacity() == 8
+    assert c.count_by("pci") == {400: 3, 401: 3}
+    assert c.count_by("nci") == {201: 3, 202: 3}
+    assert c.count_by("tac") == {12: 6}
+    assert c.count_flags()["du"] == 6 and c.count_flags()["cucp"] == 0
+
+    # the CU-CP creates a context without nci and tac
+    s.hook_cucp_uemgr_ue_add("cucp0", 0, 101, 400, 1000, now=now)
+    s.hook_cucp_uemgr_ue_add("cucp0", 9, 101, 402, 1009, now=now)
+    assert c.get_num_ues() == 7
+    assert c.count_by("nci") == {None: 1, 201: 3, 202: 3}
+    assert c.count_by("pci", FLAG_CUCP) == {400: 1, 402: 1}
+    assert c.count_by("pci", FLAG_DU | FLAG_CUCP) == {400: 1}
+
+    s.hook_e1_cucp_bearer_context_setup("cucp0", 0, 10, now=now)
+    assert c.cell_summary() == [
+        {"nci": None, "num_ues": 1, "num_e1_bearers": 0, "num_amf_info": 0},
+        {"nci": 201, "num_ues": 3, "num_e1_bearers": 1, "num_amf_info": 0},
+        {"nci": 202, "num_ues": 3, "num_e1_bearers": 0, "num_amf_info": 0}]
+
+    # the rows of the deleted contexts are reused
+    s.hook_du_ue_ctx_deletion("du0", 1, now=now)
+    s.hook_du_ue_ctx_deletion("du0", 3, now=now)
+    assert c.get_num_ues() == 5 and len(c.rows.free_rows) == 2
+    assert c.count_by("pci") == {400: 3, 401: 1, 402: 1}
+    s.hook_du_ue_ctx_creation("du0", 10, 101, 401, 1010, 12, 202, now=now)
+    assert c.get_num_ues() == 6 and len(c.rows.free_rows) == 1 and c.rows.num_rows == 7
+    assert c.count_by("crnti", FLAG_DU) == {1000: 1, 1002: 1, 1004: 1, 1005: 1, 1010: 1}
+
+    # the crnti update of the DU
+    s.hook_du_ue_ctx_update_crnti("du0", 10, 1011, now=now)
+    assert 1011 in c.count_by("crnti") and 1010 not in c.count_by("crnti")
+
+    c.close()
+    s.hook_du_ue_ctx_deletion("du0", 10, now=now)
+    assert c.get_num_ues() == 6
+
+    print("\n\n------ Test: UE context columns of a sharded map ---------")
+    s = ShardedUeContextsMap(2, shard_by_src={"du0": 0, "du1": 1})
+    c = UeContextColumns(s)
+    s.hook_du_ue_ctx_creation("du0", 0, 101, 400, 1000, 12, 201, now=now)
+    s.hook_du_ue_ctx_creation("du1", 0, 101, 401, 1000, 12, 202, now=now)
+    assert c.count_by("nci") == {201: 1, 202: 1}
+    s.hook_du_ue_ctx_deletion("du1", 0, now=now)
+    assert c.count_by("nci") == {201: 1}
+
+    print("\n\n------ All tests passed ---------")
+    sys.exit(0)
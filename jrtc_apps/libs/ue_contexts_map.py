@@ -116,8 +116,21 @@
 
 
 
+import os
+import gc
 import sys
-from dataclasses import dataclass, asdict, replace
+import re
+import mmap
+import struct
+import marshal
+import json
+import heapq
+import zlib
+import time
+import inspect
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass, asdict, replace, fields
 from typing import List, Tuple, Dict
 from enum import IntEnum
 import datetime as dt
@@ -154,50 +167,234 @@ def rrc_procedure_to_str(proc: int) -> str:
         return "UNKNOWN"
 
 ##########################################
-@dataclass(frozen=True)
-class UniqueIndex:
+# Helpers for secondary indexes where one key can map to several UE contexts.
+# Almost every key maps to a single id, so an entry holds the id itself and is
+# only turned into a set of ids when a second id is added for the same key.
+# The key is dropped once it has no ids left.
+# A set is replaced rather than modified in place, so a lookup of another thread
+# can iterate it while a hook runs.
+def _index_add(index: Dict, key, value) -> None:
+    ids = index.get(key)
+    if ids is None:
+        index[key] = value
+    elif isinstance(ids, set):
+        if value not in ids:
+            index[key] = ids | {value}
+    elif ids != value:
+        index[key] = {ids, value}
+
+def _index_remove(index: Dict, key, value) -> None:
+    ids = index.get(key)
+    if ids is None:
+        return
+    if isinstance(ids, set):
+        ids = ids - {value}
+        if len(ids) == 1:
+            index[key] = next(iter(ids))
+        else:
+            index[key] = ids
+    elif ids == value:
+        del index[key]
+
+def _index_first(index: Dict, key) -> int:
+    # lowest id for the key, which is the oldest context, or None
+    ids = index.get(key)
+    if isinstance(ids, set):
+        return min(ids)
+    return ids
+
+def _index_unique(index: Dict, key) -> int:
+    # the id for the key if there is exactly one, otherwise None
+    ids = index.get(key)
+    if isinstance(ids, set):
+        return None
+    return ids
+
+def _ids_any(ids) -> int:
+    # any id of an index entry
+    if isinstance(ids, set):
+        return next(iter(ids))
+    return ids
+
+# The indexes of the DU / CU-CP / CU-UP UE indexes and of the E1AP ids are keyed on
+# packed ints, src_id << SRC_ID_SHIFT | idx, where src_id is a small int given to the
+# src when the map first sees it.  The indexes and E1AP ids are 32 bit in the jbpf messages.
+SRC_ID_SHIFT = 32
+SRC_IDX_MASK = (1 << SRC_ID_SHIFT) - 1
+
+# Membership sets, src -> set of the ue_ids of that src.
+# Unlike the indexes above, a source has many contexts, so its set is modified in place.
+# Only the hooks iterate them, the lookups take their len().
+def _member_add(members: Dict, src, ue_id: int) -> None:
+    ids = members.get(src)
+    if ids is None:
+        members[src] = {ue_id}
+    else:
+        ids.add(ue_id)
+
+def _member_remove(members: Dict, src, ue_id: int) -> None:
+    ids = members.get(src)
+    if ids is None:
+        return
+    ids.discard(ue_id)
+    if len(ids) == 0:
+        del members[src]
+
+##########################################
+# Concurrency of UeContextsMap.
+# The methods which modify the map are marked with @_hook.  In concurrent mode, the map
+# wraps them so they hold its lock, which serializes the hooks of all the threads.
+# The lookups take no lock: each of them is a single dict access, which is atomic,
+# so a lookup running during a hook sees the context either before or after the change.
+def _hook(method):
+    method._hook = True
+    return method
+
+def _locked(lock, method):
+    def locked(*args, **kwargs):
+        with lock:
+            return method(*args, **kwargs)
+    locked.__name__ = method.__name__
+    locked.__doc__ = method.__doc__
+    return locked
+
+##########################################
+class ExpiryScheduler:
+    """
+    Min-heap of (expiry time, key) entries, with lazy deletion.
+    Rescheduling or cancelling a key only updates its entry in 'expiries';
+    outdated heap entries are skipped when they reach the top of the heap.
+    A timeout tick therefore only touches the keys that are actually due.
+    """
+    def __init__(self):
+        self.heap = []          # (expiry, seq, key)
+        self.expiries = {}      # key -> expiry currently scheduled
+        self.seq = 0            # tie-breaker, so keys never need to be comparable
+        self.last_expired = 0   # number of keys expired by the last pop_expired() call
+        self.total_expired = 0
+
+    def schedule(self, key, expiry: dt.datetime) -> None:
+        self.expiries[key] = expiry
+        heapq.heappush(self.heap, (expiry, self.seq, key))
+        self.seq += 1
+        # rebuild the heap if it is mostly outdated entries
+        if len(self.heap) > 64 and len(self.heap) > 2 * len(self.expiries):
+            self.rebuild()
+
+    def schedule_all(self, entries: List[Tuple]) -> None:
+        # (key, expiry) entries, scheduled with a single heapify rather than a push each
+        self.expiries.update(entries)
+        self.heap.extend((expiry, self.seq + n, key) for n, (key, expiry) in enumerate(entries))
+        self.seq += len(entries)
+        self.rebuild()
+
+    def rebuild(self) -> None:
+        self.heap = [(e, n, k) for (e, n, k) in self.heap if self.expiries.get(k) == e]
+        heapq.heapify(self.heap)
+
+    def cancel(self, key) -> None:
+        self.expiries.pop(key, None)
+
+    def pop_expired(self, now: dt.datetime) -> List:
+        expired = []
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            expiry, _, key = heapq.heappop(self.heap)
+            if self.expiries.get(key) == expiry:
+                del self.expiries[key]
+                expired.append(key)
+        self.last_expired = len(expired)
+        self.total_expired += len(expired)
+        return expired
+
+    def __len__(self) -> int:
+        return len(self.expiries)
+
+    def __contains__(self, key) -> bool:
+        return key in self.expiries
+
+##########################################
+class _HashedKey:
+    """
+    Base of the frozen dataclasses used as index keys.
+    The hash is computed once in __post_init__ and kept in a slot, since the keys
+    are hashed on every lookup. The slot is not a dataclass field, so asdict()
+    and the generated __eq__/__repr__ are unchanged.
+    """
+    __slots__ = ("_hash",)
+
+    def __reduce__(self):
+        # rebuild through __init__ so that copies and pickles get their hash
+        return (type(self), tuple(getattr(self, f.name) for f in fields(self)))
+
+##########################################
+@dataclass(frozen=True, slots=True)
+class UniqueIndex(_HashedKey):
     src: str
     idx: int
 
+    def __post_init__(self):
+        object.__setattr__(self, "_hash", hash((self.src, self.idx)))
+
+    def __hash__(self):
+        return self._hash
+
     def __str__(self):
         return f'{{"src":"{self.src}", "idx":{self.idx}}}'
 
 ##########################################
 # The following are the group of identifiers that, as a group, are used to uniquely identify a UE at both DU and CUCP.
-@dataclass(frozen=True)
-class RanUniqueUeId:
+@dataclass(frozen=True, slots=True)
+class RanUniqueUeId(_HashedKey):
     plmn: int
     pci: int
     crnti: int
 
+    def __post_init__(self):
+        object.__setattr__(self, "_hash", hash((self.plmn, self.pci, self.crnti)))
+
+    def __hash__(self):
+        return self._hash
+
     def __str__(self):
         return f'{{"plmn":"{self.plmn}", "pci":{self.pci}, "crnti":{self.crnti}}}'
 
-@dataclass(frozen=True)
-class RanNgapUeIds:
+@dataclass(frozen=True, slots=True)
+class RanNgapUeIds(_HashedKey):
     ran_ue_ngap_id: int = None
     amf_ue_ngap_id: int = None 
+
+    def __post_init__(self):
+        object.__setattr__(self, "_hash", hash((self.ran_ue_ngap_id, self.amf_ue_ngap_id)))
+
+    def __hash__(self):
+        return self._hash
        
     def __str__(self):
         return f'{{"ran_ue_ngap_id":"{self.ran_ue_ngap_id}", "amf_ue_ngap_id":{self.amf_ue_ngap_id}}}'
 
-@dataclass(frozen=True)
-class CoreGUTI:
+@dataclass(frozen=True, slots=True)
+class CoreGUTI(_HashedKey):
     plmn_id: str
     amf_id: str
     mtmsi: int 
 
-@dataclass(frozen=True)
+    def __post_init__(self):
+        object.__setattr__(self, "_hash", hash((self.plmn_id, self.amf_id, self.mtmsi)))
+
+    def __hash__(self):
+        return self._hash
+
+@dataclass(frozen=True, slots=True)
 class CoreCGI:
     plmn_id: str
     cell_id: str
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class CoreTAI:
     plmn_id: str
     tac: str
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class CoreAMFInfo:  
     suci: str = None 
     supi: str = None
@@ -208,31 +405,245 @@ class CoreAMFInfo:
     cgi: CoreCGI = None
     ngap_ids: RanNgapUeIds = None 
 
-@dataclass
-class UeContext:
+##########################################
+# Snapshot file helpers.
+# A snapshot is a fixed header (magic, version, Python major.minor, payload length) followed by a
+# marshal payload holding only tuples of primitive values.  The marshal format is only guaranteed
+# within a Python version, so a snapshot is only loaded by the Python version which wrote it.
+SNAPSHOT_MAGIC = b"UECTXMAP"
+SNAPSHOT_VERSION = 4
+SNAPSHOT_HEADER = struct.Struct("<8sIBBQ")
+
+# The indexes are stored too, so a load restores them with a dict update rather than an insert
+# per key.  These are keyed by ints, strs and tuples, which marshal as they are.
+SNAPSHOT_INDEXES = ("contexts_by_du_index", "contexts_by_cucp_index", "contexts_by_cuup_index",
+                    "contexts_by_cucp_ue_e1ap_id", "contexts_by_cuup_ue_e1ap_id", "contexts_by_bare_cucp_ue_e1ap_id",
+                    "contexts_by_pci_crnti", "contexts_by_crnti", "contexts_by_ngap_ran_ue_id", "contexts_by_ngap_amf_ue_id",
+                    "contexts_by_tmsi",
+                    "amf_contexts_by_suci", "amf_contexts_by_supi", "amf_contexts_by_current_mtmsi", "amf_contexts_by_next_mtmsi")
+# The membership sets are modified in place, so they are stored as copies.
+SNAPSHOT_MEMBERS = ("contexts_by_du_src", "contexts_by_cucp_src", "contexts_by_cuup_src")
+# The other indexes are keyed by dataclasses, which do not marshal.  Only their values are stored, and
+# the keys are taken back from the restored contexts: the key of an entry is the field of any of its ids.
+SNAPSHOT_KEYED_INDEXES = (("contexts_by_ran_unique_ue_id", "ran_unique_ue_id"), ("contexts_by_ngap_ue_ids", "ngap_ids"))
+SNAPSHOT_KEYED_AMF_INDEXES = (("amf_contexts_by_current_guti", "current_guti"), ("amf_contexts_by_next_guti", "next_guti"),
+                              ("amf_contexts_by_ngap_ids", "ngap_ids"))
+
+def _index_to_row(index: UniqueIndex) -> Tuple[str, int]:
+    return None if index is None else (index.src, index.idx)
+
+def _row_to_index(row: Tuple[str, int]) -> UniqueIndex:
+    return None if row is None else UniqueIndex(row[0], row[1])
+
+def _write_snapshot(path: str, rows: Tuple) -> int:
+    # written to a temporary file, then renamed, so a reader never sees a partial snapshot
+    payload = marshal.dumps(rows, 4)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, sys.version_info[0], sys.version_info[1], len(payload)))
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return SNAPSHOT_HEADER.size + len(payload)
+
+##########################################
+# Journal file helpers.
+# A journal is a header (magic, version) followed by one record per hook call:
+# a 32 bit length, then the marshal of (seq, hook, now, args, kwargs), where hook
+# is the position of the hook in JOURNAL_HOOKS and now is in microseconds since
+# JOURNAL_EPOCH, or None for the hooks without a time.
+# seq increases by 1 per record and continues across journal rotations, so the
+# records already in a snapshot are skipped when the journal is replayed on it.
+JOURNAL_MAGIC = b"UECTXJNL"
+JOURNAL_VERSION = 2
+JOURNAL_HEADER = struct.Struct("<8sI")
+JOURNAL_RECORD_LEN = struct.Struct("<I")
+JOURNAL_EPOCH = dt.datetime(1970, 1, 1, tzinfo=dt.UTC)
+JOURNAL_US = dt.timedelta(microseconds=1)
+
+# the order of this tuple is part of the journal format, new hooks are added at the end
+JOURNAL_HOOKS = (
+    "set_fapi_cell_pci",
+    "hook_du_ue_ctx_creation",
+    "hook_du_ue_ctx_update_crnti",
+    "hook_du_ue_ctx_deletion",
+    "hook_cucp_uemgr_ue_add",
+    "hook_cucp_uemgr_ue_remove",
+    "hook_e1_cucp_bearer_context_setup",
+    "hook_e1_cuup_bearer_context_setup",
+    "hook_e1_cuup_bearer_context_release",
+    "add_tmsi",
+    "hook_ngap_procedure_started",
+    "hook_ngap_procedure_completed",
+    "hook_ngap_reset",
+    "hook_core_amf_info",
+    "hook_core_amf_info_remove_ran",
+    "process_timeout",
+    "reset_ngap_for_source",
+    "purge_source",
+    "hook_rrc_ue_update_context",
+    "disassociate_ue_context",
+    "evict_contexts",
+    "link_amf_context",
+)
+JOURNAL_EVICT_CONTEXTS = JOURNAL_HOOKS.index("evict_contexts")
+JOURNAL_LINK_AMF_CONTEXT = JOURNAL_HOOKS.index("link_amf_context")
+
+def _journal_records(data: bytes, path: str):
+    # yields (end offset, record) for each complete record of the journal data
+    if len(data) < JOURNAL_HEADER.size or JOURNAL_HEADER.unpack_from(data, 0) != (JOURNAL_MAGIC, JOURNAL_VERSION):
+        raise ValueError(f"{path} is not a version {JOURNAL_VERSION} UE contexts journal")
+    pos = JOURNAL_HEADER.size
+    end = len(data)
+    while pos + JOURNAL_RECORD_LEN.size <= end:
+        (length,) = JOURNAL_RECORD_LEN.unpack_from(data, pos)
+        pos += JOURNAL_RECORD_LEN.size
+        if pos + length > end:
+            return
+        pos += length
+        try:
+            rec = marshal.loads(data[pos - length:pos])
+        except (EOFError, TypeError, ValueError) as e:
+            raise ValueError(f"{path} has a corrupted UE contexts journal record: {e}") from e
+        yield pos, rec
+
+def _journal_write(m, hook: int, now: dt.datetime, args: Tuple, kwargs: Dict) -> None:
+    m.journal_seq += 1
+    rec = (m.journal_seq, hook, None if now is None else (now - JOURNAL_EPOCH) // JOURNAL_US, args, tuple(kwargs.items()))
+    try:
+        rec = marshal.dumps(rec, 4)
+    except ValueError:
+        # IntEnum arguments, such as an NGAP procedure
+        rec = marshal.dumps(rec[:3] + (tuple(int(a) if isinstance(a, IntEnum) else a for a in args), rec[4]), 4)
+    m.journal.write(JOURNAL_RECORD_LEN.pack(len(rec)) + rec)
+
+def _journaled(m, hook: int, method):
+    # records the call, unless it is made by another hook, with the time the hook will use
+    timed = "now" in inspect.signature(method).parameters
+    def journaled(*args, **kwargs):
+        if m.journal_depth > 0:
+            return method(*args, **kwargs)
+        now = None
+        if timed:
+            now = kwargs.pop("now", None)
+            if now is None:
+                now = dt.datetime.now(dt.UTC)
+        _journal_write(m, hook, now, args, kwargs)
+        if timed:
+            kwargs["now"] = now
+        m.journal_depth += 1
+        try:
+            return method(*args, **kwargs)
+        finally:
+            m.journal_depth -= 1
+    journaled.__name__ = method.__name__
+    journaled.__doc__ = method.__doc__
+    return journaled
+
+##########################################
+# Trace of the hook calls, see UeContextsMap.start_trace().
+class UeContextsTrace:
+    """
+    Ring buffers of the recent activity of a UeContextsMap, for the post-mortem of a UE whose
+    mapping looks wrong, without the dbg prints.
+    'calls' holds the last hook calls, as (time_ns, hook, args, kwargs) with hook the index of
+    the hook in JOURNAL_HOOKS.  The timeout ticks are not recorded.
+    'ues' holds, per UE context, its last changes as (time_ns, hook, kind, fields), with hook the
+    hook which made the change.  The rings of the deleted contexts are kept in 'deleted', up to
+    max_deleted of them.
+    """
+
+    def __init__(self, size: int = 4096, ue_size: int = 32, max_deleted: int = 1024):
+        self.calls = deque(maxlen=size)
+        self.ue_size = ue_size
+        self.ues = {}                   # ue_id -> deque of changes
+        self.deleted = OrderedDict()    # ue_id -> deque of changes, oldest deletion first
+        self.max_deleted = max_deleted
+        self.hook = None                # the hook running
+
+    def on_change(self, change: "UeContextChange") -> None:
+        ring = self.ues.get(change.ue_id, None)
+        if ring is None:
+            ring = self.ues[change.ue_id] = deque(maxlen=self.ue_size)
+        ring.append((time.time_ns(), self.hook, change.kind, change.fields))
+        if change.kind == UeContextChangeKind.DELETED:
+            self.deleted[change.ue_id] = self.ues.pop(change.ue_id)
+            if len(self.deleted) > self.max_deleted:
+                self.deleted.popitem(last=False)
+
+    def dump_calls(self) -> List[Dict]:
+        return [{"time": t, "hook": JOURNAL_HOOKS[hook], "args": list(args), "kwargs": dict(kwargs)}
+                for t, hook, args, kwargs in self.calls]
+
+    def dump_ue(self, ue_id: int) -> List[Dict]:
+        ring = self.ues.get(ue_id, None)
+        if ring is None:
+            ring = self.deleted.get(ue_id, ())
+        return [{"time": t, "hook": None if hook is None else JOURNAL_HOOKS[hook], "change": kind.name, "fields": sorted(names)}
+                for t, hook, kind, names in ring]
+
+def _traced(m, hook: int, method):
+    # records the call, and the hook running for the changes of the UE contexts it makes
+    record = JOURNAL_HOOKS[hook] != "process_timeout"
+    def traced(*args, **kwargs):
+        trace = m.trace
+        if record:
+            trace.calls.append((time.time_ns(), hook, args, tuple((k, v) for k, v in kwargs.items() if k != "now")))
+        outer = trace.hook
+        trace.hook = hook
+        try:
+            return method(*args, **kwargs)
+        finally:
+            trace.hook = outer
+    traced.__name__ = method.__name__
+    traced.__doc__ = method.__doc__
+    return traced
+
+##########################################
+class _ConciseCache:
+    """
+    Base of UeContext holding its cached concise dict and JSON fragment.
+    The slots are not dataclass fields, so asdict(), __eq__ and __repr__ ignore them.
+    _gen counts the changes, so a cache built while a hook changed the context is dropped.
+    """
+    __slots__ = ("_concise", "_concise_json", "_gen")
+
+@dataclass(slots=True)
+class UeContext(_ConciseCache):
     du_index: UniqueIndex
     cucp_index: UniqueIndex
     cuup_index: UniqueIndex
     ran_unique_ue_id: RanUniqueUeId 
     nci: int
     tac: int
-    e1_bearers: List[Tuple[int, int]]     # tuple of (cucp_ue_e1ap_id, cuup_ue_e1ap_id)
+    e1_bearers: Dict[Tuple[str, int], Tuple[str, int]]     # cucp_ue_e1ap_id -> cuup_ue_e1ap_id, in the order the bearers were set up
     tmsi: int = None  
     ngap_ids: RanNgapUeIds = None 
     core_amf_context_index: int = None
     core_amf_info: CoreAMFInfo = None
 
     def __init__(self, ran_unique_ue_id: RanUniqueUeId, du_index: UniqueIndex = None, cucp_index: UniqueIndex = None, cuup_index: UniqueIndex = None,
-                 nci: int = None, tac: int = None):
-        self.ran_unique_ue_id = ran_unique_ue_id
+                 nci: int = None, tac: int = None, e1_bearers: Dict = None, tmsi: int = None, ngap_ids: RanNgapUeIds = None,
+                 core_amf_context_index: int = None, core_amf_info: CoreAMFInfo = None):
+        # object.__setattr__ skips the cache invalidation of __setattr__, as there is nothing cached yet
+        init = object.__setattr__
+        init(self, "_concise", None)
+        init(self, "_concise_json", None)
+        init(self, "_gen", 0)
+        init(self, "ran_unique_ue_id", ran_unique_ue_id)
         # optional
-        self.nci = nci
-        self.tac = tac
-        self.du_index = du_index
-        self.cucp_index = cucp_index
-        self.cuup_index = cuup_index
-        self.e1_bearers = []
-        self.ngap_ids = None
+        init(self, "nci", nci)
+        init(self, "tac", tac)
+        init(self, "du_index", du_index)
+        init(self, "cucp_index", cucp_index)
+        init(self, "cuup_index", cuup_index)
+        init(self, "e1_bearers", {} if e1_bearers is None else e1_bearers)
+        # slotted, so the fields with class defaults must also be set here
+        init(self, "tmsi", tmsi)
+        init(self, "ngap_ids", ngap_ids)
+        init(self, "core_amf_context_index", core_amf_context_index)
+        init(self, "core_amf_info", core_amf_info)
 
     def used(self) -> bool:
         """
@@ -248,13 +659,13 @@ class UeContext:
         return False
 
     def get_bearer(self, cucp_ue_e1ap_id: UniqueIndex) -> Tuple[Tuple[str, int], Tuple[str, int]]:
-        for bearer in self.e1_bearers:
-            if bearer[0] == cucp_ue_e1ap_id:
-                return bearer
+        if cucp_ue_e1ap_id in self.e1_bearers:
+            return cucp_ue_e1ap_id, self.e1_bearers[cucp_ue_e1ap_id]
         return None, None
         
     def get_bearer_NoSrcCheck(self, cucp_ue_e1ap_id: int) -> Tuple[Tuple[str, int], Tuple[str, int]]:
-        for bearer in self.e1_bearers:
+        # UeContextsMap.get_e1_bearer_NoSrcCheck() finds the src from its index instead
+        for bearer in self.e1_bearers.items():
             if bearer[0][1] == cucp_ue_e1ap_id:
                 return bearer
         return None, None
@@ -269,8 +680,29 @@ class UeContext:
                 f"core_amf_context_index={self.core_amf_context_index}, "
                 f"core_amf_info={self.core_amf_info})")
 
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        self.invalidate()
+
+    def invalidate(self) -> None:
+        """
+        Drop the cached concise dict and JSON.
+        Assigning a field does this automatically, in-place changes of e1_bearers must call it.
+        """
+        object.__setattr__(self, "_gen", self._gen + 1)
+        object.__setattr__(self, "_concise", None)
+        object.__setattr__(self, "_concise_json", None)
+
     def concise_dict(self) -> Dict:
+        """
+        The context without internal and empty fields, cached until the context changes.
+        The returned dict is shared between callers, so it must not be modified.
+        """
+        d = self._concise
+        if d is not None:
+            return d
 
+        gen = self._gen
         d = asdict(self)
 
         # Remove internal mapping fields
@@ -279,12 +711,256 @@ class UeContext:
         # Remove keys with None values
         [d.pop(k) for k in list(d) if d[k] is None]
 
-        # remove e1_beaerss if it is empty
+        # remove e1_beaerss if it is empty, else output them as a list of (cucp_ue_e1ap_id, cuup_ue_e1ap_id)
         if "e1_bearers" in d and len(d["e1_bearers"]) == 0:
             d.pop("e1_bearers")
+        elif "e1_bearers" in d:
+            d["e1_bearers"] = list(d["e1_bearers"].items())
 
+        object.__setattr__(self, "_concise", d)
+        # the cache is stored before checking _gen: a change after the check drops it itself
+        if self._gen != gen:
+            object.__setattr__(self, "_concise", None)
         return d
 
+    def concise_json(self) -> str:
+        """
+        json.dumps() of concise_dict(), cached until the context changes.
+        """
+        j = self._concise_json
+        if j is None:
+            gen = self._gen
+            j = json.dumps(self.concise_dict())
+            object.__setattr__(self, "_concise_json", j)
+            if self._gen != gen:
+                object.__setattr__(self, "_concise_json", None)
+        return j
+
+##########################################
+class UeCtxJson:
+    """
+    Serializes output messages which embed UE contexts, splicing in the cached
+    JSON fragment of each context instead of encoding its dict again.
+    ref() returns a placeholder to put in the message in place of concise_dict(),
+    and dumps() replaces the placeholders once the message is encoded.
+    With omit, ref() returns None, for consumers which follow the contexts from their changes instead.
+    """
+    PLACEHOLDER_RE = re.compile(r'"\\u0000UECTX(\d+)\\u0000"')
+
+    def __init__(self, omit: bool = False):
+        self.fragments = []
+        self.omit = omit
+
+    def ref(self, uectx: UeContext) -> str:
+        if uectx is None or self.omit:
+            return None
+        self.fragments.append(uectx.concise_json())
+        return f"\x00UECTX{len(self.fragments) - 1}\x00"
+
+    def dumps(self, output) -> str:
+        s = json.dumps(output)
+        if len(self.fragments) == 0:
+            return s
+        return self.PLACEHOLDER_RE.sub(lambda m: self.fragments[int(m.group(1))], s)
+
+###########################################################################################################
+# Change notifications of UeContextsMap.subscribe().
+# The kinds are ordered so that, when the changes of a tick are coalesced, the kind of a UE context is
+# the highest of its changes: a context created then updated is reported as created.
+###########################################################################################################
+class UeContextChangeKind(IntEnum):
+    UPDATED = 0
+    AMF_ASSOCIATED = 1
+    CREATED = 2
+    DELETED = 3
+
+@dataclass(frozen=True, slots=True)
+class UeContextChange:
+    kind: UeContextChangeKind
+    ue_id: int
+    fields: frozenset      # names of the UeContext fields which changed, empty for DELETED
+
+UE_CONTEXT_AMF_FIELDS = ("core_amf_context_index", "core_amf_info")
+UE_CONTEXT_FIELDS = tuple(f.name for f in fields(UeContext))
+
+###########################################################################################################
+# Typed events for UeContextsMap.apply_events().
+# Each event carries the arguments of the matching hook_* method, and apply() runs
+# the hook and returns the ue_id of the UE context it concerns (None if there is none).
+# The hooks return the ue_id they resolved, so an event costs the lookups of its hook only.
+###########################################################################################################
+@dataclass(frozen=True, slots=True)
+class DuUeCtxCreationEvent:
+    du_src: str
+    du_index: int
+    plmn: int
+    pci: int
+    crnti: int
+    tac: int
+    nci: int
+
+    def apply(self, m: "UeContextsMap", now: dt.datetime) -> int:
+        return m.hook_du_ue_ctx_creation(self.du_src, self.du_index, self.plmn, self.pci, self.crnti, self.tac, self.nci, now=now)
+
+@dataclass(frozen=True, slots=True)
+class DuUeCtxUpdateCrntiEvent:
+    du_src: str
+    du_index: int
+    crnti: int
+
+    def apply(self, m: "UeContextsMap", now: dt.datetime) -> int:
+        return m.hook_du_ue_ctx_update_crnti(self.du_src, self.du_index, self.crnti, now=now)
+
+@dataclass(frozen=True, slots=True)
+class DuUeCtxDeletionEvent:
+    du_src: str
+    du_index: int
+
+    def apply(self, m: "UeContextsMap", now: dt.datetime) -> int:
+        return m.hook_du_ue_ctx_deletion(self.du_src, self.du_index, now=now)
+
+@dataclass(frozen=True, slots=True)
+class CucpUeAddEvent:
+    cucp_src: str
+    cucp_index: int
+    plmn: int
+    pci: int
+    crnti: int
+
+    def apply(self, m: "UeContextsMap", now: dt.datetime) -> int:
+        return m.hook_cucp_uemgr_ue_add(self.cucp_src, self.cucp_index, self.plmn, self.pci, self.crnti, now=now)
+
+@dataclass(frozen=True, slots=True)
+class CucpUeRemoveEvent:
+    cucp_src: str
+    cucp_index: int
+
+    def apply(self, m: "UeContextsMap", now: dt.datetime) -> int:
+        return m.hook_cucp_uemgr_ue_remove(self.cucp_src, self.cucp_index, now=now)
+
+@dataclass(frozen=True, slots=True)
+class RrcUeUpdateContextEvent:
+    cucp_src: str
+    old_cucp_index: int
+    cucp_index: int
+    plmn: int
+    pci: int
+    crnti: int
+    tac: int = None
+    nci: int = None
+
+    def apply(self, m: "UeContextsMap", now: dt.datetime) -> int:
+        return m.hook_rrc_ue_update_context(self.cucp_src, self.old_cucp_index, self.cucp_index, self.plmn, self.pci, self.crnti,
+                                            self.tac, self.nci, now=now)
+
+@dataclass(frozen=True, slots=True)
+class CucpUeTmsiEvent:
+    cucp_src: str
+    cucp_index: int
+    tmsi: int
+
+    def apply(self, m: "UeContextsMap", now: dt.datetime) -> int:
+        return m.add_tmsi(self.cucp_src, self.cucp_index, self.tmsi, now=now)
+
+@dataclass(frozen=True, slots=True)
+class E1CucpBearerSetupEvent:
+    cucp_src: str
+    cucp_index: int
+    gnb_cucp_ue_e1ap_id: int
+
+    def apply(self, m: "UeContextsMap", now: dt.datetime) -> int:
+        return m.hook_e1_cucp_bearer_context_setup(self.cucp_src, self.cucp_index, self.gnb_cucp_ue_e1ap_id, now=now)
+
+@dataclass(frozen=True, slots=True)
+class E1CuupBearerSetupEvent:
+    cuup_src: str
+    cuup_index: int
+    gnb_cucp_ue_e1ap_id: int
+    gnb_cuup_ue_e1ap_id: int
+    success: bool
+
+    def apply(self, m: "UeContextsMap", now: dt.datetime) -> int:
+        return m.hook_e1_cuup_bearer_context_setup(self.cuup_src, self.cuup_index, self.gnb_cucp_ue_e1ap_id, self.gnb_cuup_ue_e1ap_id,
+                                                   self.success, now=now)
+
+@dataclass(frozen=True, slots=True)
+class E1CuupBearerReleaseEvent:
+    cuup_src: str
+    cuup_index: int
+    cucp_ue_e1ap_id: int
+    cuup_ue_e1ap_id: int
+    success: bool
+
+    def apply(self, m: "UeContextsMap", now: dt.datetime) -> int:
+        return m.hook_e1_cuup_bearer_context_release(self.cuup_src, self.cuup_index, self.cucp_ue_e1ap_id, self.cuup_ue_e1ap_id,
+                                                     self.success, now=now)
+
+@dataclass(frozen=True, slots=True)
+class NgapProcedureStartedEvent:
+    cucp_src: str
+    cucp_index: int
+    procedure: int
+    ngap_ran_ue_id: int
+    ngap_amf_ue_id: int = None
+
+    def apply(self, m: "UeContextsMap", now: dt.datetime) -> int:
+        return m.hook_ngap_procedure_started(self.cucp_src, self.cucp_index, self.procedure, self.ngap_ran_ue_id, self.ngap_amf_ue_id, now=now)
+
+@dataclass(frozen=True, slots=True)
+class NgapProcedureCompletedEvent:
+    cucp_src: str
+    cucp_index: int
+    procedure: int
+    success: bool
+    ngap_ran_ue_id: int
+    ngap_amf_ue_id: int
+
+    def apply(self, m: "UeContextsMap", now: dt.datetime) -> int:
+        return m.hook_ngap_procedure_completed(self.cucp_src, self.cucp_index, self.procedure, self.success,
+                                               self.ngap_ran_ue_id, self.ngap_amf_ue_id, now=now)
+
+@dataclass(frozen=True, slots=True)
+class NgapResetEvent:
+    cucp_src: str
+    ngap_ran_ue_id: int = None
+    ngap_amf_ue_id: int = None
+
+    def apply(self, m: "UeContextsMap", now: dt.datetime) -> int:
+        # a reset can concern several UEs, or none
+        m.hook_ngap_reset(self.cucp_src, self.ngap_ran_ue_id, self.ngap_amf_ue_id, now=now)
+        return None
+
+@dataclass(frozen=True, slots=True)
+class CoreAmfInfoEvent:
+    ran_ue_ngap_id: int = None
+    amf_ue_ngap_id: int = None
+    suci: str = None
+    supi: str = None
+    home_plmn_id: str = None
+    current_guti_plmn: str = None
+    current_guti_amf_id: str = None
+    current_guti_m_tmsi: int = None
+    next_guti_plmn: str = None
+    next_guti_amf_id: str = None
+    next_guti_m_tmsi: int = None
+    tai_plmn: str = None
+    tai_tac: str = None
+    cgi_plmn: str = None
+    cgi_cellid: str = None
+    remove_ran: bool = False    # True for the core "ran-ue-remove" event
+
+    def apply(self, m: "UeContextsMap", now: dt.datetime) -> int:
+        if self.remove_ran:
+            return m.hook_core_amf_info_remove_ran(self.suci, self.supi, self.home_plmn_id,
+                        self.current_guti_plmn, self.current_guti_amf_id, self.current_guti_m_tmsi,
+                        self.next_guti_plmn, self.next_guti_amf_id, self.next_guti_m_tmsi,
+                        self.tai_plmn, self.tai_tac, self.cgi_plmn, self.cgi_cellid, now=now)
+
+        return m.hook_core_amf_info(self.ran_ue_ngap_id, self.amf_ue_ngap_id, self.suci, self.supi, self.home_plmn_id,
+                    self.current_guti_plmn, self.current_guti_amf_id, self.current_guti_m_tmsi,
+                    self.next_guti_plmn, self.next_guti_amf_id, self.next_guti_m_tmsi,
+                    self.tai_plmn, self.tai_tac, self.cgi_plmn, self.cgi_cellid, now=now)
+
 ###########################################################################################################
 class UeContextsMap:
     """
@@ -293,27 +969,213 @@ class UeContextsMap:
     """
 
     ####################################################################
-    def __init__(self, dbg: bool=False):
+    def __init__(self, dbg: bool=False, fapi_cell_id_to_pci: Dict[int, int] = None, concurrent: bool = False):
         self.dbg = dbg
+        # in concurrent mode, the hooks hold self.lock, the lookups are lock-free.  See _hook().
+        self.lock = threading.RLock() if concurrent else None
+        # journal of the hook calls, see start_journal()
+        self.journal = None
+        self.journal_path = None
+        self.journal_seq = 0
+        self.journal_depth = 0
+        self.replaying = False    # in replay_journal(), where the evictions come from the journal
+        # trace of the hook calls, see start_trace()
+        self.trace = None
+        self.wrap_hooks()
         self.context_id = 0       # will just increase by 1 for each new context.  No need to handle wrap as we'll never reach that
         self.contexts = {}
-        self.contexts_by_du_index = {}
-        self.contexts_by_cucp_index = {}
-        self.contexts_by_cuup_index = {}
-        self.contexts_by_cucp_ue_e1ap_id = {}
-        self.contexts_by_cuup_ue_e1ap_id = {}
+        # interned srcs, see intern_src()
+        self.src_ids = {}                          # src -> src_id
+        self.srcs = []                             # src_id -> src
+        self.contexts_by_du_index = {}             # packed du_index -> ue_id
+        self.contexts_by_cucp_index = {}           # packed cucp_index -> ue_id
+        self.contexts_by_cuup_index = {}           # packed cuup_index -> ue_id
+        self.contexts_by_cucp_ue_e1ap_id = {}      # packed cucp_ue_e1ap_id -> ue_id
+        self.contexts_by_cuup_ue_e1ap_id = {}      # packed cuup_ue_e1ap_id -> ue_id
+        self.contexts_by_bare_cucp_ue_e1ap_id = {} # cucp_ue_e1ap_id -> (cucp_src, ue_id)(s), for the CU-UP, which does not know the cucp_src
+        # src -> set of ue_id, of the contexts with a du_index / cucp_index / cuup_index of that src, see purge_source()
+        self.contexts_by_du_src = {}
+        self.contexts_by_cucp_src = {}
+        self.contexts_by_cuup_src = {}
+        self.contexts_by_ran_unique_ue_id = {}     # RanUniqueUeId -> ue_id(s)
+        self.contexts_by_pci_crnti = {}            # (pci, crnti) -> ue_id(s)
+        self.contexts_by_crnti = {}                # crnti -> ue_id(s)
+        self.contexts_by_ngap_ran_ue_id = {}       # (cucp_src, ran_ue_ngap_id) -> ue_id(s)
+        self.contexts_by_ngap_amf_ue_id = {}       # (cucp_src, amf_ue_ngap_id) -> ue_id(s)
+        self.contexts_by_ngap_ue_ids = {}          # RanNgapUeIds -> ue_id(s)
+        self.contexts_by_tmsi = {}                 # tmsi -> ue_id(s)
+        # FAPI reports carry a cell_id rather than the PCI
+        self.fapi_cell_id_to_pci = {} if fapi_cell_id_to_pci is None else dict(fapi_cell_id_to_pci)
         self.amf_context_id = 0 # will just increase by 1 for each new AMF context.  No need to handle wrap as we'll never reach that
         self.amf_contexts = {}
+        # secondary indexes of the AMF contexts
+        self.amf_contexts_by_suci = {}
+        self.amf_contexts_by_supi = {}
+        self.amf_contexts_by_current_guti = {}     # CoreGUTI -> amf_context_id(s)
+        self.amf_contexts_by_next_guti = {}        # CoreGUTI -> amf_context_id(s)
+        self.amf_contexts_by_current_mtmsi = {}
+        self.amf_contexts_by_next_mtmsi = {}
+        self.amf_contexts_by_ngap_ids = {}         # RanNgapUeIds -> amf_context_id(s)
         self.amf_tmsi_expiry_secs = dt.timedelta(seconds=21600)  # 6 hours
+        self.amf_expiry = ExpiryScheduler()        # amf_context_id of AMF contexts not linked to a UE
+        # in a shard of ShardedUeContextsMap, the AMF contexts are in the router's store and the shard
+        # queues its UE associations (ue_id, ngap_ids, tmsi, disassociated amf_context_id, now) here
+        self.amf_requests = None
+        # UE contexts whose delete event was lost would otherwise never be removed.
+        # contexts_activity holds the time of the last activity of each UE context (an event changing it, or a
+        # report looked up by getuectx(), see touch_context()), least recently active first,
+        # and process_timeout() evicts the contexts idle for longer than context_idle_expiry_secs, then the least
+        # recently active ones above max_contexts.  None disables either eviction.
+        self.now = dt.datetime.now(dt.UTC)
+        self.contexts_activity = OrderedDict()     # ue_id -> time of last activity
+        self.context_idle_expiry_secs = None       # dt.timedelta
+        self.max_contexts = None
+        self.num_idle_evictions = 0
+        self.num_lru_evictions = 0
+        # The reports covering the last period of a UE often arrive after its delete events.  With
+        # tombstone_expiry_secs set, the keys cleared from the UE contexts and the deleted contexts are kept
+        # for that long (and up to max_tombstones of each), and the lookups called with tombstone=True
+        # fall back to them on a miss.  process_timeout() evicts them.
+        self.tombstone_expiry_secs = None          # dt.timedelta, None disables the tombstones
+        self.max_tombstones = 4096
+        self.tombstones = OrderedDict()            # (kind, key) -> (ue_id, time cleared), oldest first
+        self.tombstone_contexts = OrderedDict()    # ue_id -> (UeContext, time deleted), oldest first
+        self.num_tombstone_hits = 0
+        # lookups of a bare cucp_ue_e1ap_id matching the bearers of several CU-CPs
+        self.num_ambiguous_e1ap_lookups = 0
+        # change notifications, see subscribe().  The tuples are replaced, never modified, so the hooks
+        # can iterate them while another thread subscribes.
+        self.observers = ()                        # callbacks called with each UeContextChange
+        self.batch_observers = ()                  # callbacks called with the coalesced changes of each tick
+        self.observed = False
+        self.pending_changes = {}                  # ue_id -> [UeContextChangeKind, set of field names]
+
+    ####################################################################
+    def wrap_hooks(self) -> None:
+        """
+        Set the instance attributes which wrap the @_hook methods, for the trace, the journal and the lock.
+        The journal and the trace are written within the lock, so their records are in the order the hooks ran.
+        """
+        for name in dir(type(self)):
+            method = getattr(type(self), name)
+            if not getattr(method, "_hook", False):
+                continue
+            method = method.__get__(self)
+            wrapped = False
+            if self.trace is not None and name in JOURNAL_HOOKS:
+                method = _traced(self, JOURNAL_HOOKS.index(name), method)
+                wrapped = True
+            if self.journal is not None and name in JOURNAL_HOOKS:
+                method = _journaled(self, JOURNAL_HOOKS.index(name), method)
+                wrapped = True
+            if self.lock is not None:
+                method = _locked(self.lock, method)
+                wrapped = True
+            if wrapped:
+                setattr(self, name, method)
+            else:
+                self.__dict__.pop(name, None)
+
+    ####################################################################
+    def subscribe(self, callback, coalesce: bool = False) -> None:
+        """
+        Call callback on the changes of the UE contexts: creation, deletion, change of fields and
+        association with an AMF context.
+        Without coalesce, callback(change) is called with each UeContextChange as the hooks make it.
+        With coalesce, callback(changes) is called by process_timeout() with a list holding one
+        UeContextChange per UE context changed since the previous tick, its fields merged.  A context
+        both created and deleted within the tick is not reported.
+        The callbacks run within the hooks (and their lock, in concurrent mode), so must not block
+        nor call the hooks.  The contexts restored by load_snapshot() are reported as created.
+        """
+        if coalesce:
+            self.batch_observers = self.batch_observers + (callback,)
+        else:
+            self.observers = self.observers + (callback,)
+        self.observed = True
+
+    ####################################################################
+    def unsubscribe(self, callback) -> None:
+        self.observers = tuple(c for c in self.observers if c != callback)
+        self.batch_observers = tuple(c for c in self.batch_observers if c != callback)
+        self.observed = len(self.observers) + len(self.batch_observers) > 0
+        if len(self.batch_observers) == 0:
+            self.pending_changes = {}
+
+    ####################################################################
+    def notify(self, kind: UeContextChangeKind, ue_id: int, names) -> None:
+        # the callers check self.observed first, so an unobserved map does not build the changes
+        for callback in self.observers:
+            callback(UeContextChange(kind, ue_id, frozenset(names)))
+        if len(self.batch_observers) == 0:
+            return
+        pending = self.pending_changes.get(ue_id, None)
+        if pending is None:
+            self.pending_changes[ue_id] = [kind, set(names)]
+        elif kind == UeContextChangeKind.DELETED and pending[0] == UeContextChangeKind.CREATED:
+            del self.pending_changes[ue_id]
+        elif kind == UeContextChangeKind.DELETED:
+            self.pending_changes[ue_id] = [kind, set()]
+        elif pending[0] != UeContextChangeKind.DELETED:
+            pending[0] = max(pending[0], kind)
+            pending[1].update(names)
+
+    ####################################################################
+    def notify_created(self, ue_id: int, ue: UeContext) -> None:
+        self.notify(UeContextChangeKind.CREATED, ue_id,
+                    [name for name in UE_CONTEXT_FIELDS if getattr(ue, name) not in (None, {})])
+
+    ####################################################################
+    def flush_changes(self) -> List[UeContextChange]:
+        """
+        Call the coalescing callbacks with the changes since the previous flush, and return them.
+        Called by process_timeout().
+        """
+        if len(self.pending_changes) == 0:
+            return []
+        changes = [UeContextChange(kind, ue_id, frozenset(names)) for ue_id, (kind, names) in self.pending_changes.items()]
+        self.pending_changes = {}
+        for callback in self.batch_observers:
+            callback(changes)
+        return changes
+
+    ####################################################################
+    # A lookup hashes the packed int of its src and idx, rather than building a UniqueIndex
+    # and hashing its str.  Only the hooks intern the srcs, so a lookup of a src the map
+    # has never seen finds nothing, and the lookups of other threads never add to src_ids.
+    def intern_src(self, src: str) -> int:
+        src_id = self.src_ids.get(src, None)
+        if src_id is None:
+            src_id = len(self.srcs)
+            self.srcs.append(src)
+            self.src_ids[src] = src_id
+        return src_id
+
+    def index_key(self, index: UniqueIndex) -> int:
+        if index is None:
+            return None
+        return (self.intern_src(index.src) << SRC_ID_SHIFT) | index.idx
+
+    def e1ap_key(self, e1ap_id: Tuple[str, int]) -> int:
+        if e1ap_id is None:
+            return None
+        return (self.intern_src(e1ap_id[0]) << SRC_ID_SHIFT) | e1ap_id[1]
+
+    def unpack_key(self, key: int) -> Tuple[str, int]:
+        return self.srcs[key >> SRC_ID_SHIFT], key & SRC_IDX_MASK
 
     ####################################################################
     def context_create(self, ran_unique_ue_id: RanUniqueUeId, du_index: UniqueIndex = None, cucp_index: UniqueIndex = None, cuup_index: UniqueIndex = None,
-        nci: int=None, tac: int=None) -> None:
+        nci: int=None, tac: int=None) -> int:
         if self.dbg:
             print(f"context_create: ran_unique_ue_id={ran_unique_ue_id} du_index={du_index} cucp_index={cucp_index} cuup_index={cuup_index} nci={nci} tac={tac}")
         ue = UeContext(ran_unique_ue_id, du_index=du_index, cucp_index=cucp_index, cuup_index=cuup_index, nci=nci, tac=tac)
         # add mappings
         self.contexts[self.context_id] = ue
+        self.contexts_activity[self.context_id] = self.now
+        if self.observed:
+            self.notify_created(self.context_id, ue)
+        self.add_ran_unique_ue_id_mappings(self.context_id, ran_unique_ue_id)
         if ue.du_index is not None:
             self.set_du_index(self.context_id, du_index)
         if ue.cucp_index is not None:
@@ -322,6 +1184,7 @@ class UeContextsMap:
             self.set_cuup_index(self.context_id, cuup_index)
         # increment context id for next context
         self.context_id += 1
+        return self.context_id - 1
 
     ###################################################################
     def associate_ue_context_with_amf_ngap(self, ue_id: int) -> None:
@@ -338,25 +1201,12 @@ class UeContextsMap:
             # cannot assocate as no NGAP Ids
             return
 
-        # get amf
-        amf_id = self.get_amfid_by_ngap_ids(ue.ngap_ids)
-        if amf_id is None:
-            # no AMF context found
+        if self.amf_requests is not None:
+            # a shard, the router links it, see ShardedAmfContexts
+            self.amf_requests.append((ue_id, ue.ngap_ids, None, None, self.now))
             return
 
-        # to ensure consistency, disassociate the currently linked UE.
-        ue2_id = self.amf_contexts[amf_id][0]
-        if (ue2_id is not None) and (ue_id != ue2_id):
-            ue2 = self.getue_by_id(ue2_id)
-            self.disassociate_amf_context_with_ue(ue2)
-
-        # point to AMF from UE
-        ue.core_amf_context_index = amf_id
-        ue.core_amf_info = self.amf_contexts[amf_id][1]  # the second element in the tuple is the CoreAMFInfo
-
-        # point to UE from AMF
-        new_t = (ue_id, self.amf_contexts[amf_id][1], None)
-        self.amf_contexts[amf_id] = new_t
+        self.link_ue_context(self.get_amfid_by_ngap_ids(ue.ngap_ids), ue_id)
 
     ###################################################################
     def associate_ue_context_with_amf_tmsi(self, ue_id: int) -> None:
@@ -373,8 +1223,16 @@ class UeContextsMap:
             # cannot assocate as no TMSI
             return
 
-        # get amf
-        amf_id = self.get_amfid_by_tmsi(ue.tmsi)
+        if self.amf_requests is not None:
+            # a shard, the router links it, see ShardedAmfContexts
+            self.amf_requests.append((ue_id, None, ue.tmsi, None, self.now))
+            return
+
+        self.link_ue_context(self.get_amfid_by_tmsi(ue.tmsi), ue_id)
+
+    ###################################################################
+    def link_ue_context(self, amf_id: int, ue_id: int) -> None:
+
         if amf_id is None:
             # no AMF context found
             return
@@ -382,16 +1240,74 @@ class UeContextsMap:
         # to ensure consistency, disassociate the currently linked UE.
         ue2_id = self.amf_contexts[amf_id][0]
         if (ue2_id is not None) and (ue_id != ue2_id):
-            ue2 = self.getue_by_id(ue2_id)
-            self.disassociate_amf_context_with_ue(ue2)
+            self.unlink_amf_context(amf_id)
 
-        # point to AMF from UE
-        ue.core_amf_context_index = amf_id
-        ue.core_amf_info = self.amf_contexts[amf_id][1]  # the second element in the tuple is the CoreAMFInfo
+        # point to AMF from UE, then to UE from AMF
+        amf_info = self.amf_contexts[amf_id][1]  # the second element in the tuple is the CoreAMFInfo
+        if self.set_context_amf(ue_id, amf_id, amf_info, UeContextChangeKind.AMF_ASSOCIATED):
+            self.amf_context_set(amf_id, ue_id, amf_info, None)
 
-        # point to UE from AMF
-        new_t = (ue_id, self.amf_contexts[amf_id][1], None)
-        self.amf_contexts[amf_id] = new_t
+    ###################################################################
+    def set_context_amf(self, ue_id: int, amf_context_id: int, amf_info: CoreAMFInfo, kind: UeContextChangeKind) -> bool:
+        """
+        Point the UE context at its AMF context, or at none with amf_context_id None.
+        :return: False if there is no such UE context, e.g. it is being deleted.
+        """
+        ue = self.contexts.get(ue_id, None)
+        if ue is None:
+            return False
+        ue.core_amf_context_index = amf_context_id
+        ue.core_amf_info = amf_info
+        if self.observed:
+            self.notify(kind, ue_id, UE_CONTEXT_AMF_FIELDS)
+        return True
+
+    ####################################################################
+    def add_tombstone(self, kind: str, key, ue_id: int) -> None:
+        # kind is "du", "cucp" or "cuup" with a packed index key, or "pci_rnti" with a (pci, crnti)
+        tombstones = self.tombstones
+        tombstones[(kind, key)] = (ue_id, self.now)
+        tombstones.move_to_end((kind, key))
+        if len(tombstones) > self.max_tombstones:
+            tombstones.popitem(last=False)
+
+    ####################################################################
+    def add_context_tombstones(self, ue_id: int, ue: UeContext) -> None:
+        if ue.du_index is not None:
+            self.add_tombstone("du", self.index_key(ue.du_index), ue_id)
+        if ue.cucp_index is not None:
+            self.add_tombstone("cucp", self.index_key(ue.cucp_index), ue_id)
+        if ue.cuup_index is not None:
+            self.add_tombstone("cuup", self.index_key(ue.cuup_index), ue_id)
+        r = ue.ran_unique_ue_id
+        self.add_tombstone("pci_rnti", (r.pci, r.crnti), ue_id)
+        self.tombstone_contexts[ue_id] = (ue, self.now)
+        if len(self.tombstone_contexts) > self.max_tombstones:
+            self.tombstone_contexts.popitem(last=False)
+
+    ####################################################################
+    def get_tombstone(self, kind: str, key) -> int:
+        v = self.tombstones.get((kind, key), None)
+        if v is None:
+            return None
+        self.num_tombstone_hits += 1
+        return v[0]
+
+    ####################################################################
+    def has_tombstone(self, ue_id: int) -> bool:
+        # whether the context of a deleted ue_id is still kept, see getuectx()
+        return ue_id in self.tombstone_contexts
+
+    ####################################################################
+    def evict_tombstones(self) -> None:
+        if self.tombstone_expiry_secs is None:
+            self.tombstones.clear()
+            self.tombstone_contexts.clear()
+            return
+        deleted_before = self.now - self.tombstone_expiry_secs
+        for tombstones in (self.tombstones, self.tombstone_contexts):
+            while len(tombstones) > 0 and next(iter(tombstones.values()))[1] <= deleted_before:
+                tombstones.popitem(last=False)
 
     ####################################################################
     def context_delete(self, ue_id: int) -> None:
@@ -399,19 +1315,28 @@ class UeContextsMap:
             if self.dbg:
                 print(f"context_delete: ue_id={ue_id}")
             ue = self.contexts[ue_id]
+            if self.tombstone_expiry_secs is not None:
+                self.add_context_tombstones(ue_id, ue)
             # Also remove from the other mappings
-            self.contexts_by_du_index.pop(ue.du_index, None)
-            self.contexts_by_cucp_index.pop(ue.cucp_index, None)
-            self.contexts_by_cuup_index.pop(ue.cuup_index, None)
-            for b in ue.e1_bearers:
-                self.contexts_by_cucp_ue_e1ap_id.pop(b[0], None)
-                self.contexts_by_cuup_ue_e1ap_id.pop(b[1], None)
+            self.remove_ran_unique_ue_id_mappings(ue_id, ue.ran_unique_ue_id)
+            self.remove_ngap_ids_mappings(ue_id, ue)
+            _index_remove(self.contexts_by_tmsi, ue.tmsi, ue_id)
+            self.contexts_by_du_index.pop(self.index_key(ue.du_index), None)
+            self.contexts_by_cucp_index.pop(self.index_key(ue.cucp_index), None)
+            self.contexts_by_cuup_index.pop(self.index_key(ue.cuup_index), None)
+            self.remove_src_mappings(ue_id, ue)
+            for b in ue.e1_bearers.items():
+                self.remove_e1_bearer_mappings(ue_id, b)
             # remove context
             self.contexts.pop(ue_id, None)
+            self.contexts_activity.pop(ue_id, None)
 
             # remove associated AMF context if it exists
             if ue.core_amf_context_index is not None:
-                self.disassociate_amf_context_with_ue(ue)
+                self.disassociate_amf_context_with_ue(ue_id, ue)
+
+            if self.observed:
+                self.notify(UeContextChangeKind.DELETED, ue_id, ())
 
     ####################################################################
     def delete_unused_context(self, ue_id: int) -> None:
@@ -421,11 +1346,23 @@ class UeContextsMap:
             if self.dbg:
                 print(f"delete_unused_context: ue_id={ue_id}")
             ue = self.contexts[ue_id]
+            if self.tombstone_expiry_secs is not None:
+                self.add_context_tombstones(ue_id, ue)
+            self.remove_ran_unique_ue_id_mappings(ue_id, ue.ran_unique_ue_id)
+            self.remove_ngap_ids_mappings(ue_id, ue)
+            _index_remove(self.contexts_by_tmsi, ue.tmsi, ue_id)
+            for b in ue.e1_bearers.items():
+                self.remove_e1_bearer_mappings(ue_id, b)
+            self.remove_src_mappings(ue_id, ue)
             self.contexts.pop(ue_id, None)
+            self.contexts_activity.pop(ue_id, None)
 
             # remove associated AMF context if it exists
             if ue.core_amf_context_index is not None:
-                self.disassociate_amf_context_with_ue(ue)
+                self.disassociate_amf_context_with_ue(ue_id, ue)
+
+            if self.observed:
+                self.notify(UeContextChangeKind.DELETED, ue_id, ())
 
     ####################################################################
     def amf_context_create_update(self, 
@@ -465,21 +1402,19 @@ class UeContextsMap:
         else:
 
             # update the existing one
-            t = self.amf_contexts[amf_context_id]
-
             # to ensure consistency, disassociate the currently linked UE.
-            ue_id = t[0]
-            if ue_id is not None:
-                ue = self.getue_by_id(ue_id)
-                self.disassociate_amf_context_with_ue(ue)
+            self.unlink_amf_context(amf_context_id)
+
+            self.remove_amf_info_mappings(amf_context_id, self.amf_contexts[amf_context_id][1])
 
-        # tuple is ue_context_id, amf_info
-        self.amf_contexts[amf_context_id] = (None, amf_info, None)
+        self.amf_context_set(amf_context_id, None, amf_info, None)
+        self.add_amf_info_mappings(amf_context_id, amf_info)
 
         # Associate AMF with UE context.
         # Try NGAP-Ids, the TMSI
         if self.associate_amf_context_with_ue_ngap(amf_context_id) is False:
             self.associate_amf_context_with_ue_tmsi(amf_context_id)
+        return amf_context_id
 
     ####################################################################
     def amf_context_delete(self, amf_context_id = int) -> None:
@@ -493,13 +1428,53 @@ class UeContextsMap:
 
         # dis-associate from UE context if it exists
         if t[0] is not None:
-            ue_context_id = t[0]
-            ue = self.contexts[ue_context_id]
-            ue.core_amf_context_index = None
-            ue.core_amf_info = None
+            self.set_context_amf(t[0], None, None, UeContextChangeKind.UPDATED)
 
+        self.remove_amf_info_mappings(amf_context_id, t[1])
+        self.amf_expiry.cancel(amf_context_id)
         self.amf_contexts.pop(amf_context_id, None)
 
+    ####################################################################
+    def amf_context_set(self, amf_context_id: int, ue_id: int, amf_info: CoreAMFInfo, disassociated_at: dt.datetime) -> None:
+        # tuple is ue_context_id, amf_info, time it was disassociated from its UE
+        self.amf_contexts[amf_context_id] = (ue_id, amf_info, disassociated_at)
+        if ue_id is not None and ue_id in self.contexts:
+            self.touch_context(ue_id)
+        if disassociated_at is None:
+            self.amf_expiry.cancel(amf_context_id)
+        else:
+            self.amf_expiry.schedule(amf_context_id, disassociated_at + self.amf_tmsi_expiry_secs)
+
+    ####################################################################
+    def add_amf_info_mappings(self, amf_context_id: int, amf_info: CoreAMFInfo) -> None:
+        if amf_info.suci is not None:
+            _index_add(self.amf_contexts_by_suci, amf_info.suci, amf_context_id)
+        if amf_info.supi is not None:
+            _index_add(self.amf_contexts_by_supi, amf_info.supi, amf_context_id)
+        if amf_info.current_guti is not None:
+            _index_add(self.amf_contexts_by_current_guti, amf_info.current_guti, amf_context_id)
+            _index_add(self.amf_contexts_by_current_mtmsi, amf_info.current_guti.mtmsi, amf_context_id)
+        if amf_info.next_guti is not None:
+            _index_add(self.amf_contexts_by_next_guti, amf_info.next_guti, amf_context_id)
+            _index_add(self.amf_contexts_by_next_mtmsi, amf_info.next_guti.mtmsi, amf_context_id)
+        if amf_info.ngap_ids is not None:
+            _index_add(self.amf_contexts_by_ngap_ids, amf_info.ngap_ids, amf_context_id)
+
+    ####################################################################
+    def remove_amf_info_mappings(self, amf_context_id: int, amf_info: CoreAMFInfo) -> None:
+        if amf_info.suci is not None:
+            _index_remove(self.amf_contexts_by_suci, amf_info.suci, amf_context_id)
+        if amf_info.supi is not None:
+            _index_remove(self.amf_contexts_by_supi, amf_info.supi, amf_context_id)
+        if amf_info.current_guti is not None:
+            _index_remove(self.amf_contexts_by_current_guti, amf_info.current_guti, amf_context_id)
+            _index_remove(self.amf_contexts_by_current_mtmsi, amf_info.current_guti.mtmsi, amf_context_id)
+        if amf_info.next_guti is not None:
+            _index_remove(self.amf_contexts_by_next_guti, amf_info.next_guti, amf_context_id)
+            _index_remove(self.amf_contexts_by_next_mtmsi, amf_info.next_guti.mtmsi, amf_context_id)
+        if amf_info.ngap_ids is not None:
+            _index_remove(self.amf_contexts_by_ngap_ids, amf_info.ngap_ids, amf_context_id)
+
     ###################################################################
     def associate_amf_context_with_ue_ngap(self, amf_context_id: int) -> bool:
 
@@ -513,14 +1488,9 @@ class UeContextsMap:
             # find ue
             ueid = self.getid_by_ngap_ue_ids(t[1].ngap_ids.ran_ue_ngap_id, t[1].ngap_ids.amf_ue_ngap_id)
 
-            if ueid is not None:
-                self.amf_contexts[amf_context_id] = (ueid, t[1], None)  # update the ue_context_id in the tuple
-
-                # update UE with the AMF context ID
-                ue = self.contexts[ueid]
-                ue.core_amf_context_index = amf_context_id
-                ue.core_amf_info = t[1] 
-
+            # update UE with the AMF context ID
+            if ueid is not None and self.set_context_amf(ueid, amf_context_id, t[1], UeContextChangeKind.AMF_ASSOCIATED):
+                self.amf_context_set(amf_context_id, ueid, t[1], None)  # update the ue_context_id in the tuple
                 return True
 
         return False
@@ -543,35 +1513,151 @@ class UeContextsMap:
                 # find ue
                 ueid = self.getid_by_tmsi(guti.mtmsi)
 
-                if ueid is not None:
-                    self.amf_contexts[amf_context_id] = (ueid, t[1], None)  # update the ue_context_id in the tuple
-
-                    # update UE with the AMF context ID
-                    ue = self.contexts[ueid]
-                    ue.core_amf_context_index = amf_context_id
-                    ue.core_amf_info = t[1] 
-
+                # update UE with the AMF context ID
+                if ueid is not None and self.set_context_amf(ueid, amf_context_id, t[1], UeContextChangeKind.AMF_ASSOCIATED):
+                    self.amf_context_set(amf_context_id, ueid, t[1], None)  # update the ue_context_id in the tuple
                     return True
 
         return False
 
     ###################################################################
-    def disassociate_amf_context_with_ue(self, ue: UeContext) -> None:
-
-        if ue is None:
-            return
+    def disassociate_amf_context_with_ue(self, ue_id: int, ue: UeContext) -> None:
+        # the UE context is being deleted, so it is not reported as updated
 
         if self.dbg:
             print(f"disassociate_amf_context_with_ue: amf_context_id={ue.core_amf_context_index}")
 
-        t = self.amf_contexts[ue.core_amf_context_index]
-
-        self.amf_contexts[ue.core_amf_context_index] = (None, t[1], self.now)  # update the ue_context_id in the tuple
+        if self.amf_requests is not None:
+            # a shard, the router unlinks it, see ShardedAmfContexts
+            self.amf_requests.append((ue_id, None, None, ue.core_amf_context_index, self.now))
+        else:
+            t = self.amf_contexts[ue.core_amf_context_index]
+            self.amf_context_set(ue.core_amf_context_index, None, t[1], self.now)  # update the ue_context_id in the tuple
 
         # update UE to clear the AMF context ID
         ue.core_amf_context_index = None
         ue.core_amf_info = None
 
+    ###################################################################
+    def unlink_amf_context(self, amf_context_id: int) -> int:
+        """
+        Unlink the AMF context from its UE context, if it has one.
+        :return: the ue_id of that UE context, None if there is none.
+        """
+        t = self.amf_contexts[amf_context_id]
+        if t[0] is None:
+            return None
+
+        if self.dbg:
+            print(f"unlink_amf_context: amf_context_id={amf_context_id} ue_id={t[0]}")
+
+        self.amf_context_set(amf_context_id, None, t[1], self.now)  # update the ue_context_id in the tuple
+        self.set_context_amf(t[0], None, None, UeContextChangeKind.UPDATED)
+        return t[0]
+
+    ####################################################################
+    def add_ran_unique_ue_id_mappings(self, ue_id: int, ran_unique_ue_id: RanUniqueUeId) -> None:
+        _index_add(self.contexts_by_ran_unique_ue_id, ran_unique_ue_id, ue_id)
+        _index_add(self.contexts_by_pci_crnti, (ran_unique_ue_id.pci, ran_unique_ue_id.crnti), ue_id)
+        _index_add(self.contexts_by_crnti, ran_unique_ue_id.crnti, ue_id)
+
+    ####################################################################
+    def remove_ran_unique_ue_id_mappings(self, ue_id: int, ran_unique_ue_id: RanUniqueUeId) -> None:
+        _index_remove(self.contexts_by_ran_unique_ue_id, ran_unique_ue_id, ue_id)
+        _index_remove(self.contexts_by_pci_crnti, (ran_unique_ue_id.pci, ran_unique_ue_id.crnti), ue_id)
+        _index_remove(self.contexts_by_crnti, ran_unique_ue_id.crnti, ue_id)
+
+    ####################################################################
+    # The hooks record the activity of a UE context through the set_* helpers, which they call for
+    # each event of the UE, getuectx() through the reports of the UE.
+    def touch_context(self, ue_id: int) -> None:
+        activity = self.contexts_activity
+        activity[ue_id] = self.now
+        activity.move_to_end(ue_id)
+
+    ####################################################################
+    def set_ran_unique_ue_id(self, ue_id: int, ran_unique_ue_id: RanUniqueUeId) -> None:
+        if ue_id not in self.contexts:
+            if self.dbg:
+                print(f"UE context with ID {ue_id} does not exist.")
+            return
+        if self.dbg:
+            print(f"set_ran_unique_ue_id: ue_id={ue_id} ran_unique_ue_id={ran_unique_ue_id}")
+        self.touch_context(ue_id)
+        ue = self.contexts[ue_id]
+        changed = ue.ran_unique_ue_id != ran_unique_ue_id
+        self.remove_ran_unique_ue_id_mappings(ue_id, ue.ran_unique_ue_id)
+        ue.ran_unique_ue_id = ran_unique_ue_id
+        self.add_ran_unique_ue_id_mappings(ue_id, ran_unique_ue_id)
+        if self.observed and changed:
+            self.notify(UeContextChangeKind.UPDATED, ue_id, ("ran_unique_ue_id",))
+
+    ####################################################################
+    # The NGAP ids are only unique within a CU-CP, so they are indexed with the src of the 
+    # cucp_index of the UE.   A UE without a cucp_index is indexed with a src of None, and 
+    # so is never found by the cucp_src scoped lookups.
+    def add_ngap_ids_mappings(self, ue_id: int, ue: UeContext) -> None:
+        ngap_ids = ue.ngap_ids
+        if ngap_ids is None:
+            return
+        cucp_src = None if ue.cucp_index is None else ue.cucp_index.src
+        if ngap_ids.ran_ue_ngap_id is not None:
+            _index_add(self.contexts_by_ngap_ran_ue_id, (cucp_src, ngap_ids.ran_ue_ngap_id), ue_id)
+        if ngap_ids.amf_ue_ngap_id is not None:
+            _index_add(self.contexts_by_ngap_amf_ue_id, (cucp_src, ngap_ids.amf_ue_ngap_id), ue_id)
+        _index_add(self.contexts_by_ngap_ue_ids, ngap_ids, ue_id)
+
+    ####################################################################
+    def remove_ngap_ids_mappings(self, ue_id: int, ue: UeContext) -> None:
+        ngap_ids = ue.ngap_ids
+        if ngap_ids is None:
+            return
+        cucp_src = None if ue.cucp_index is None else ue.cucp_index.src
+        if ngap_ids.ran_ue_ngap_id is not None:
+            _index_remove(self.contexts_by_ngap_ran_ue_id, (cucp_src, ngap_ids.ran_ue_ngap_id), ue_id)
+        if ngap_ids.amf_ue_ngap_id is not None:
+            _index_remove(self.contexts_by_ngap_amf_ue_id, (cucp_src, ngap_ids.amf_ue_ngap_id), ue_id)
+        _index_remove(self.contexts_by_ngap_ue_ids, ngap_ids, ue_id)
+
+    ####################################################################
+    def set_ngap_ids(self, ue_id: int, ngap_ids: RanNgapUeIds) -> None:
+        if ue_id not in self.contexts:
+            if self.dbg:
+                print(f"UE context with ID {ue_id} does not exist.")
+            return
+        if self.dbg:
+            print(f"set_ngap_ids: ue_id={ue_id} ngap_ids={ngap_ids}")
+        self.touch_context(ue_id)
+        ue = self.contexts[ue_id]
+        changed = ue.ngap_ids != ngap_ids
+        self.remove_ngap_ids_mappings(ue_id, ue)
+        ue.ngap_ids = ngap_ids
+        self.add_ngap_ids_mappings(ue_id, ue)
+        if self.observed and changed:
+            self.notify(UeContextChangeKind.UPDATED, ue_id, ("ngap_ids",))
+
+    ####################################################################
+    def clear_ngap_ids(self, ue_id: int) -> None:
+        self.set_ngap_ids(ue_id, None)
+
+    ####################################################################
+    def set_tmsi(self, ue_id: int, tmsi: int) -> None:
+        if ue_id not in self.contexts:
+            if self.dbg:
+                print(f"UE context with ID {ue_id} does not exist.")
+            return
+        if self.dbg:
+            print(f"set_tmsi: ue_id={ue_id} tmsi={tmsi}")
+        self.touch_context(ue_id)
+        ue = self.contexts[ue_id]
+        changed = ue.tmsi != tmsi
+        _index_remove(self.contexts_by_tmsi, ue.tmsi, ue_id)
+        ue.tmsi = tmsi
+        if tmsi is not None:
+            _index_add(self.contexts_by_tmsi, tmsi, ue_id)
+        if self.observed and changed:
+            self.notify(UeContextChangeKind.UPDATED, ue_id, ("tmsi",))
+
     ####################################################################
     def set_du_index(self, ue_id: int, du_index: UniqueIndex) -> None:
         if ue_id not in self.contexts:
@@ -580,8 +1666,15 @@ class UeContextsMap:
             return
         if self.dbg:
             print(f"set_du_index: ue_id={ue_id} du_index={du_index}")
+        self.touch_context(ue_id)
+        changed = self.contexts[ue_id].du_index != du_index
+        if self.contexts[ue_id].du_index is not None:
+            _member_remove(self.contexts_by_du_src, self.contexts[ue_id].du_index.src, ue_id)
+        _member_add(self.contexts_by_du_src, du_index.src, ue_id)
         self.contexts[ue_id].du_index = du_index
-        self.contexts_by_du_index[du_index] = ue_id
+        self.contexts_by_du_index[self.index_key(du_index)] = ue_id
+        if self.observed and changed:
+            self.notify(UeContextChangeKind.UPDATED, ue_id, ("du_index",))
 
     ####################################################################
     def clear_du_index(self, ue_id: int) -> None:
@@ -591,8 +1684,14 @@ class UeContextsMap:
         if self.dbg:
             print(f"clear_du_index: ue_id={ue_id}")
         du_index = self.contexts[ue_id].du_index
+        if du_index is not None:
+            _member_remove(self.contexts_by_du_src, du_index.src, ue_id)
+            if self.tombstone_expiry_secs is not None:
+                self.add_tombstone("du", self.index_key(du_index), ue_id)
         self.contexts[ue_id].du_index = None
-        self.contexts_by_du_index.pop(du_index, None)
+        self.contexts_by_du_index.pop(self.index_key(du_index), None)
+        if self.observed and du_index is not None:
+            self.notify(UeContextChangeKind.UPDATED, ue_id, ("du_index",))
         self.delete_unused_context(ue_id)
 
     ####################################################################
@@ -602,8 +1701,18 @@ class UeContextsMap:
             return
         if self.dbg:
             print(f"set_cucp_index: ue_id={ue_id} cucp_index={cucp_index}")
+        self.touch_context(ue_id)
+        changed = self.contexts[ue_id].cucp_index != cucp_index
+        if self.contexts[ue_id].cucp_index is not None:
+            _member_remove(self.contexts_by_cucp_src, self.contexts[ue_id].cucp_index.src, ue_id)
+        _member_add(self.contexts_by_cucp_src, cucp_index.src, ue_id)
+        # the NGAP mappings are scoped by the cucp src, so re-add them
+        self.remove_ngap_ids_mappings(ue_id, self.contexts[ue_id])
         self.contexts[ue_id].cucp_index = cucp_index
-        self.contexts_by_cucp_index[cucp_index] = ue_id
+        self.contexts_by_cucp_index[self.index_key(cucp_index)] = ue_id
+        self.add_ngap_ids_mappings(ue_id, self.contexts[ue_id])
+        if self.observed and changed:
+            self.notify(UeContextChangeKind.UPDATED, ue_id, ("cucp_index",))
 
     ####################################################################
     def clear_cucp_index(self, ue_id: int) -> None:
@@ -614,10 +1723,68 @@ class UeContextsMap:
         if self.dbg:
             print(f"clear_cucp_index: ue_id={ue_id}")
         cucp_index = self.contexts[ue_id].cucp_index
+        if cucp_index is not None:
+            _member_remove(self.contexts_by_cucp_src, cucp_index.src, ue_id)
+            if self.tombstone_expiry_secs is not None:
+                self.add_tombstone("cucp", self.index_key(cucp_index), ue_id)
+        self.remove_ngap_ids_mappings(ue_id, self.contexts[ue_id])
         self.contexts[ue_id].cucp_index = None
-        self.contexts_by_cucp_index.pop(cucp_index, None)
+        self.contexts_by_cucp_index.pop(self.index_key(cucp_index), None)
+        self.add_ngap_ids_mappings(ue_id, self.contexts[ue_id])
+        if self.observed and cucp_index is not None:
+            self.notify(UeContextChangeKind.UPDATED, ue_id, ("cucp_index",))
         self.delete_unused_context(ue_id)
 
+    ####################################################################
+    # Moves a UE context to a new cucp_index and RAN identity, keeping its ue_id, TMSI, NGAP ids,
+    # E1 bearers and AMF association.  The contexts holding the new keys are deleted, the du_index
+    # of the one with the new RAN identity is taken over by the context.
+    def rekey_context(self, ue_id: int, cucp_index: UniqueIndex, ran_unique_ue_id: RanUniqueUeId,
+                      nci: int = None, tac: int = None) -> None:
+        if ue_id not in self.contexts:
+            if self.dbg:
+                print(f"UE context with ID {ue_id} does not exist.")
+            return
+        if self.dbg:
+            print(f"rekey_context: ue_id={ue_id} cucp_index={cucp_index} ran_unique_ue_id={ran_unique_ue_id} nci={nci} tac={tac}")
+        ue = self.contexts[ue_id]
+
+        du_index = None
+        others = self.contexts_by_ran_unique_ue_id.get(ran_unique_ue_id, None)
+        others = set() if others is None else (set(others) if isinstance(others, set) else {others})
+        for other in sorted(others):
+            if other != ue_id and du_index is None:
+                du_index = self.contexts[other].du_index
+        other = self.getid_by_cucp_index(cucp_index.src, cucp_index.idx)
+        if other is not None:
+            others.add(other)
+        others.discard(ue_id)
+        for other in sorted(others):
+            if self.dbg:
+                print(f"UE context {other} holds the new keys of UE context {ue_id}, it will be deleted")
+            self.context_delete(other)
+
+        # the set_* helpers do not drop the index entries of the keys they replace
+        if du_index is not None:
+            if ue.du_index is not None:
+                self.contexts_by_du_index.pop(self.index_key(ue.du_index), None)
+            self.set_du_index(ue_id, du_index)
+        if ue.cucp_index != cucp_index:
+            if ue.cucp_index is not None:
+                self.contexts_by_cucp_index.pop(self.index_key(ue.cucp_index), None)
+            self.set_cucp_index(ue_id, cucp_index)
+        self.set_ran_unique_ue_id(ue_id, ran_unique_ue_id)
+
+        names = []
+        if nci is not None and ue.nci != nci:
+            ue.nci = nci
+            names.append("nci")
+        if tac is not None and ue.tac != tac:
+            ue.tac = tac
+            names.append("tac")
+        if self.observed and len(names) > 0:
+            self.notify(UeContextChangeKind.UPDATED, ue_id, names)
+
     ####################################################################
     def set_cuup_index(self, ue_id: int, cuup_index: UniqueIndex) -> None:
         if ue_id not in self.contexts:
@@ -626,8 +1793,15 @@ class UeContextsMap:
             return
         if self.dbg:
             print(f"set_cuup_index: ue_id={ue_id} cuup_index={cuup_index}")
+        self.touch_context(ue_id)
+        changed = self.contexts[ue_id].cuup_index != cuup_index
+        if self.contexts[ue_id].cuup_index is not None:
+            _member_remove(self.contexts_by_cuup_src, self.contexts[ue_id].cuup_index.src, ue_id)
+        _member_add(self.contexts_by_cuup_src, cuup_index.src, ue_id)
         self.contexts[ue_id].cuup_index = cuup_index
-        self.contexts_by_cuup_index[cuup_index] = ue_id
+        self.contexts_by_cuup_index[self.index_key(cuup_index)] = ue_id
+        if self.observed and changed:
+            self.notify(UeContextChangeKind.UPDATED, ue_id, ("cuup_index",))
 
     ####################################################################
     def clear_cuup_index(self, ue_id: int) -> None:
@@ -638,8 +1812,14 @@ class UeContextsMap:
         if self.dbg:
             print(f"clear_cuup_index: ue_id={ue_id}")        
         cuup_index = self.contexts[ue_id].cuup_index
+        if cuup_index is not None:
+            _member_remove(self.contexts_by_cuup_src, cuup_index.src, ue_id)
+            if self.tombstone_expiry_secs is not None:
+                self.add_tombstone("cuup", self.index_key(cuup_index), ue_id)
         self.contexts[ue_id].cuup_index = None
-        self.contexts_by_cuup_index.pop(cuup_index, None)
+        self.contexts_by_cuup_index.pop(self.index_key(cuup_index), None)
+        if self.observed and cuup_index is not None:
+            self.notify(UeContextChangeKind.UPDATED, ue_id, ("cuup_index",))
         self.delete_unused_context(ue_id)
 
     ####################################################################
@@ -650,9 +1830,31 @@ class UeContextsMap:
             return
         if self.dbg:
             print(f"set_cucp_ue_e1ap_id: ue_id={ue_id} cucp_ue_e1ap_id={cucp_ue_e1ap_id}")
-        bearer = (cucp_ue_e1ap_id, None)
-        self.contexts[ue_id].e1_bearers.append(bearer)
-        self.contexts_by_cucp_ue_e1ap_id[cucp_ue_e1ap_id] = ue_id
+        self.touch_context(ue_id)
+        ue = self.contexts[ue_id]
+        if ue.e1_bearers.get(cucp_ue_e1ap_id, None) is not None:
+            self.contexts_by_cuup_ue_e1ap_id.pop(self.e1ap_key(ue.e1_bearers[cucp_ue_e1ap_id]), None)
+        ue.e1_bearers[cucp_ue_e1ap_id] = None
+        ue.invalidate()
+        if self.observed:
+            self.notify(UeContextChangeKind.UPDATED, ue_id, ("e1_bearers",))
+        self.contexts_by_cucp_ue_e1ap_id[self.e1ap_key(cucp_ue_e1ap_id)] = ue_id
+        _index_add(self.contexts_by_bare_cucp_ue_e1ap_id, cucp_ue_e1ap_id[1], (cucp_ue_e1ap_id[0], ue_id))
+
+    ####################################################################
+    def remove_e1_bearer_mappings(self, ue_id: int, bearer: Tuple[Tuple[str, int], Tuple[str, int]]) -> None:
+        self.contexts_by_cucp_ue_e1ap_id.pop(self.e1ap_key(bearer[0]), None)
+        self.contexts_by_cuup_ue_e1ap_id.pop(self.e1ap_key(bearer[1]), None)
+        _index_remove(self.contexts_by_bare_cucp_ue_e1ap_id, bearer[0][1], (bearer[0][0], ue_id))
+
+    ####################################################################
+    def remove_src_mappings(self, ue_id: int, ue: UeContext) -> None:
+        if ue.du_index is not None:
+            _member_remove(self.contexts_by_du_src, ue.du_index.src, ue_id)
+        if ue.cucp_index is not None:
+            _member_remove(self.contexts_by_cucp_src, ue.cucp_index.src, ue_id)
+        if ue.cuup_index is not None:
+            _member_remove(self.contexts_by_cuup_src, ue.cuup_index.src, ue_id)
 
     ####################################################################
     def clear_cucp_ue_e1ap_id(self, ue_id: int, cucp_ue_e1ap_id: UniqueIndex) -> None:
@@ -665,14 +1867,13 @@ class UeContextsMap:
             print(f"clear_cucp_ue_e1ap_id: ue_id={ue_id} cucp_ue_e1ap_id={cucp_ue_e1ap_id}")
 
         # remove the bearer with the matching cucp_ue_e1ap_id
-        bearer = None
-        for i, b in enumerate(self.contexts[ue_id].e1_bearers):
-            if b[0] == cucp_ue_e1ap_id:
-                bearer = self.contexts[ue_id].e1_bearers.pop(i)
-                
-        if bearer is not None:
-            self.contexts_by_cucp_ue_e1ap_id.pop(bearer[0], None)
-            self.contexts_by_cuup_ue_e1ap_id.pop(bearer[1], None)
+        ue = self.contexts[ue_id]
+        if cucp_ue_e1ap_id in ue.e1_bearers:
+            bearer = (cucp_ue_e1ap_id, ue.e1_bearers.pop(cucp_ue_e1ap_id))
+            ue.invalidate()
+            if self.observed:
+                self.notify(UeContextChangeKind.UPDATED, ue_id, ("e1_bearers",))
+            self.remove_e1_bearer_mappings(ue_id, bearer)
             # if no more bearers are present, remove the cuup_index too
             if len(self.contexts[ue_id].e1_bearers) == 0:
                 self.clear_cuup_index(ue_id)
@@ -688,17 +1889,19 @@ class UeContextsMap:
 
         if self.dbg:
             print(f"set_cuup_ue_e1ap_id: ue_id={ue_id} cucp_ue_e1ap_id={cucp_ue_e1ap_id} cuup_ue_e1ap_id={cuup_ue_e1ap_id}")
+        self.touch_context(ue_id)
 
         # update the bearer with the matching cucp_ue_e1ap_id with the cuup_ue_e1ap_id
-        for i, b in enumerate(self.contexts[ue_id].e1_bearers):
-            if b[0] == cucp_ue_e1ap_id:
-                self.contexts[ue_id].e1_bearers[i] = (b[0], cuup_ue_e1ap_id)
-                break
-        else:
+        ue = self.contexts[ue_id]
+        if cucp_ue_e1ap_id not in ue.e1_bearers:
             if self.dbg:
                 print(f"Bearer with cucp_ue_e1ap_id {cucp_ue_e1ap_id} not found in UE context {ue_id}.")
             return
-        self.contexts_by_cuup_ue_e1ap_id[cuup_ue_e1ap_id] = ue_id
+        ue.e1_bearers[cucp_ue_e1ap_id] = cuup_ue_e1ap_id
+        ue.invalidate()
+        if self.observed:
+            self.notify(UeContextChangeKind.UPDATED, ue_id, ("e1_bearers",))
+        self.contexts_by_cuup_ue_e1ap_id[self.e1ap_key(cuup_ue_e1ap_id)] = ue_id
 
     ####################################################################
     def clear_cuup_ue_e1ap_id(self, ue_id: int, cuup_ue_e1ap_id: UniqueIndex) -> None:
@@ -710,15 +1913,15 @@ class UeContextsMap:
         if self.dbg:
             print(f"clear_cuup_ue_e1ap_id: ue_id={ue_id} cuup_ue_e1ap_id={cuup_ue_e1ap_id}")
         
-        # remove the bearer with the matching cuup_ue_e1ap_id
-        bearer = None
-        for i, b in enumerate(self.contexts[ue_id].e1_bearers):
-            if b[1] == cuup_ue_e1ap_id:
-                bearer = self.contexts[ue_id].e1_bearers.pop(i)
-
+        # remove the bearer with the matching cuup_ue_e1ap_id.  A UE has a few bearers, so they are just scanned.
+        ue = self.contexts[ue_id]
+        bearer = next((b for b in ue.e1_bearers.items() if b[1] == cuup_ue_e1ap_id), None)
         if bearer is not None:
-            self.contexts_by_cucp_ue_e1ap_id.pop(bearer[0], None)
-            self.contexts_by_cuup_ue_e1ap_id.pop(bearer[1], None)
+            del ue.e1_bearers[bearer[0]]
+            ue.invalidate()
+            if self.observed:
+                self.notify(UeContextChangeKind.UPDATED, ue_id, ("e1_bearers",))
+            self.remove_e1_bearer_mappings(ue_id, bearer)
             # if no more bearers are present, remove the cuup_index too
             if len(self.contexts[ue_id].e1_bearers) == 0:
                 self.clear_cuup_index(ue_id)
@@ -726,88 +1929,150 @@ class UeContextsMap:
 
     ####################################################################
     def getid_by_ran_unique_ue_id(self, ran_unique_ue_id: RanUniqueUeId ) -> int:
-        filtered_contexts = {
-            k: v for k, v in self.contexts.items()
-            if v.ran_unique_ue_id == ran_unique_ue_id
-        }
-        if len(filtered_contexts) == 1:
-            return list(filtered_contexts.keys())[0]
-        elif len(filtered_contexts) > 1:
+        ue_ids = self.contexts_by_ran_unique_ue_id.get(ran_unique_ue_id, None)
+        if isinstance(ue_ids, set):
             raise ValueError("Multiple UE contexts found for the given PLMN, PCI, and RNTI.")
-
-        # if we reach here, it means no context was found
-        return None 
+        return ue_ids
         
     #####################################################################
     # This is as above, except it search based on the PCI and RNTI only.
-    # This is used for the FAPI case where the PLMN is not available
-    # --------------- TBD:
-    # Currently the FAPI is not prividing the "pci" either, so for now just use the rnti.
-    # This means it will only woek for one DU.
+    # This is used for the FAPI case where the PLMN is not available.
+    # If the pci is None, the search is based on the rnti only, which will
+    # only work for one DU.
     # 
-    def getid_by_pci_rnti(self, pci: int, rnti: int) -> int:
+    def getid_by_pci_rnti(self, pci: int, rnti: int, tombstone: bool = False) -> int:
+
+        # no context or >=2 found gives None
+        if pci is None:
+            return _index_unique(self.contexts_by_crnti, rnti)
+        ue_id = _index_unique(self.contexts_by_pci_crnti, (pci, rnti))
+        if ue_id is None and tombstone:
+            return self.get_tombstone("pci_rnti", (pci, rnti))
+        return ue_id
 
-        filtered_contexts = {
-            k: v for k, v in self.contexts.items()
-            if v.ran_unique_ue_id.crnti == rnti
-            # TBD : add pci too
-        }
-        if len(filtered_contexts) == 1:
-            return list(filtered_contexts.keys())[0]
+    #####################################################################
+    @_hook
+    def set_fapi_cell_pci(self, cell_id: int, pci: int) -> None:
+        if self.dbg:
+            print(f"set_fapi_cell_pci: cell_id={cell_id} pci={pci}")
+        if pci is None:
+            self.fapi_cell_id_to_pci.pop(cell_id, None)
+        else:
+            self.fapi_cell_id_to_pci[cell_id] = pci
 
-        # if we reach here, it means no context or >=2 was found
-        return None 
+    #####################################################################
+    # FAPI reports identify the cell by the FAPI cell_id.  This is mapped to the PCI
+    # using fapi_cell_id_to_pci.  If the cell_id is not configured, the lookup falls
+    # back to the rnti only.
+    def getid_by_fapi_cell_rnti(self, cell_id: int, rnti: int, tombstone: bool = False) -> int:
+        return self.getid_by_pci_rnti(self.fapi_cell_id_to_pci.get(cell_id, None), rnti, tombstone)
 
     #####################################################################
     def getue_by_id(self, ue_id: int) -> UeContext:
         return self.contexts.get(ue_id, None)
     
     #####################################################################
+    # getuectx() is the lookup used for every message of a UE, so it also records
+    # the activity of the UE.  The time is that of the last hook or timeout, which
+    # saves reading the clock for each lookup.
+    # In concurrent mode it runs without the lock, so a context_delete() can run between
+    # the lookup and the write: the write is then undone, as context_delete() pops the
+    # context before its activity, and the readers of contexts_activity skip the ue_ids
+    # not in contexts in between.
     def getuectx(self, ue_id: int) -> UeContext:
         if ue_id is None:
             return None
-        if ue_id not in self.contexts:
+        ue = self.contexts.get(ue_id, None)
+        if ue is None:
+            # the context of a tombstone lookup
+            v = self.tombstone_contexts.get(ue_id, None)
+            if v is not None:
+                return v[0]
             if self.dbg:
                 print(f"getuectx: UE context with ID {ue_id} does not exist.")
             return None
-        return self.contexts[ue_id]
+        activity = self.contexts_activity
+        activity[ue_id] = self.now
+        try:
+            activity.move_to_end(ue_id)
+        except KeyError:
+            pass            # popped by a context_delete() since the write
+        if ue_id not in self.contexts:
+            activity.pop(ue_id, None)
+        return ue
 
     #####################################################################
-    def getid_by_du_index(self, du_src: str, du_index: int) -> int:
-        du_index = UniqueIndex(du_src, du_index)
-        return self.contexts_by_du_index.get(du_index, None)
+    def getid_by_du_index(self, du_src: str, du_index: int, tombstone: bool = False) -> int:
+        src_id = self.src_ids.get(du_src, None)
+        if src_id is None:
+            return None
+        key = (src_id << SRC_ID_SHIFT) | du_index
+        ue_id = self.contexts_by_du_index.get(key, None)
+        if ue_id is None and tombstone:
+            return self.get_tombstone("du", key)
+        return ue_id
 
     #####################################################################
-    def getid_by_cucp_index(self, cucp_src: str, cucp_index: int) -> int:
-        cucp_index = UniqueIndex(cucp_src, cucp_index)
-        return self.contexts_by_cucp_index.get(cucp_index, None)
+    def getid_by_cucp_index(self, cucp_src: str, cucp_index: int, tombstone: bool = False) -> int:
+        src_id = self.src_ids.get(cucp_src, None)
+        if src_id is None:
+            return None
+        key = (src_id << SRC_ID_SHIFT) | cucp_index
+        ue_id = self.contexts_by_cucp_index.get(key, None)
+        if ue_id is None and tombstone:
+            return self.get_tombstone("cucp", key)
+        return ue_id
 
     #####################################################################
-    def getid_by_cuup_index(self, cuup_src: str, cuup_index: int) -> int:
-        cuup_index = UniqueIndex(cuup_src, cuup_index)
-        return self.contexts_by_cuup_index.get(cuup_index, None)
+    def getid_by_cuup_index(self, cuup_src: str, cuup_index: int, tombstone: bool = False) -> int:
+        src_id = self.src_ids.get(cuup_src, None)
+        if src_id is None:
+            return None
+        key = (src_id << SRC_ID_SHIFT) | cuup_index
+        ue_id = self.contexts_by_cuup_index.get(key, None)
+        if ue_id is None and tombstone:
+            return self.get_tombstone("cuup", key)
+        return ue_id
 
     #####################################################################
     def getid_by_cucp_ue_e1ap_id(self, cucp_src: str, cucp_ue_e1ap_id: int) -> int:
-        cucp_ue_e1ap_id = (cucp_src, cucp_ue_e1ap_id)
-        return self.contexts_by_cucp_ue_e1ap_id.get(cucp_ue_e1ap_id, None)
+        src_id = self.src_ids.get(cucp_src, None)
+        if src_id is None:
+            return None
+        return self.contexts_by_cucp_ue_e1ap_id.get((src_id << SRC_ID_SHIFT) | cucp_ue_e1ap_id, None)
 
     #####################################################################
+    # The CU-UP does not know the src of the CU-CP, so these find the bearer by the bare cucp_ue_e1ap_id.
+    # If the bearers of several CU-CPs have it, the one of the lowest (cucp_src, ue_id) is used, and
+    # num_ambiguous_e1ap_lookups is incremented.
     def getid_by_cucp_ue_e1ap_id_NoSrcCheck(self, cucp_ue_e1ap_id: int) -> int:
-        # find using only the 2nd element of the tuple
-        # as the src is not available
-        filtered_contexts = {
-            k: v for k, v in self.contexts_by_cucp_ue_e1ap_id.items()
-            if k[1] == cucp_ue_e1ap_id
-        }
-        if len(filtered_contexts) > 0:
-            return list(filtered_contexts.values())[0]
-        return None
+        v = self.get_e1_bearer_src_NoSrcCheck(cucp_ue_e1ap_id)
+        return None if v is None else v[1]
+
+    #####################################################################
+    def getids_by_cucp_ue_e1ap_id_NoSrcCheck(self, cucp_ue_e1ap_id: int) -> List[Tuple[str, int]]:
+        # all the (cucp_src, ue_id) with a bearer of this cucp_ue_e1ap_id
+        v = self.contexts_by_bare_cucp_ue_e1ap_id.get(cucp_ue_e1ap_id, None)
+        if v is None:
+            return []
+        return sorted(v) if isinstance(v, set) else [v]
+
+    #####################################################################
+    def get_e1_bearer_src_NoSrcCheck(self, cucp_ue_e1ap_id: int) -> Tuple[str, int]:
+        v = self.contexts_by_bare_cucp_ue_e1ap_id.get(cucp_ue_e1ap_id, None)
+        if isinstance(v, set):
+            self.num_ambiguous_e1ap_lookups += 1
+            if self.dbg:
+                print(f"cucp_ue_e1ap_id {cucp_ue_e1ap_id} is ambiguous, (cucp_src, ue_id) {sorted(v)}")
+            v = min(v)
+        return v
         
     #####################################################################
     def getid_by_cuup_ue_e1ap_id(self, cuup_src: str, cuup_ue_e1ap_id: int) -> int:
-        cuup_ue_e1ap_id = (cuup_src, cuup_ue_e1ap_id)
-        return self.contexts_by_cuup_ue_e1ap_id.get(cuup_ue_e1ap_id, None)
+        src_id = self.src_ids.get(cuup_src, None)
+        if src_id is None:
+            return None
+        return self.contexts_by_cuup_ue_e1ap_id.get((src_id << SRC_ID_SHIFT) | cuup_ue_e1ap_id, None)
 
     #####################################################################
     def getid_by_ngap_ran_ue_id(self, cucp_src: str, ngap_ran_ue_id: int) -> int:
@@ -815,22 +2080,7 @@ class UeContextsMap:
         if ngap_ran_ue_id is None:
             return None
         
-        # filter contexts by ngap_ids.ran_ue_ngap_id
-        filtered_contexts = {
-            k: v for k, v in self.contexts.items()
-            if v.ngap_ids is not None and v.ngap_ids.ran_ue_ngap_id == ngap_ran_ue_id
-        }
-
-        # filter where cucp_index.src matches cucp_src
-        filtered_contexts = {
-            k: v for k, v in filtered_contexts.items()
-            if v.cucp_index is not None and v.cucp_index.src == cucp_src
-        }
-
-        if len(filtered_contexts) == 0:
-            return None
-        else:
-            return list(filtered_contexts.keys())[0]
+        return _index_first(self.contexts_by_ngap_ran_ue_id, (cucp_src, ngap_ran_ue_id))
 
     #####################################################################
     def getid_by_ngap_amf_ue_id(self, cucp_src: str, ngap_amf_ue_id: int) -> int:
@@ -838,23 +2088,7 @@ class UeContextsMap:
         if ngap_amf_ue_id is None:
             return None
         
-        # filter contexts by ngap_ids.amf_ue_ngap_id
-        filtered_contexts = {
-            k: v for k, v in self.contexts.items()
-            if v.ngap_ids is not None and v.ngap_ids.amf_ue_ngap_id == ngap_amf_ue_id
-        }
-
-        # filter where cucp_index.src matches cucp_src
-        filtered_contexts = {
-            k: v for k, v in filtered_contexts.items()
-            if v.cucp_index is not None and v.cucp_index.src == cucp_src
-        }
-
-
-        if len(filtered_contexts) == 0:
-            return None
-        else:
-            return list(filtered_contexts.keys())[0]
+        return _index_first(self.contexts_by_ngap_amf_ue_id, (cucp_src, ngap_amf_ue_id))
 
     #####################################################################
     def getid_by_ngap_ue_ids(self, ngap_ran_ue_id: int, ngap_amf_ue_id: int) -> int:
@@ -862,16 +2096,7 @@ class UeContextsMap:
         if ngap_amf_ue_id is None and ngap_ran_ue_id is None:
             return None
         
-        # filter contexts by ngap_ids.amf_ue_ngap_id
-        filtered_contexts = {
-            k: v for k, v in self.contexts.items()
-            if v.ngap_ids == RanNgapUeIds(ngap_ran_ue_id, ngap_amf_ue_id)
-        }
-
-        if len(filtered_contexts) == 0:
-            return None
-        else:
-            return list(filtered_contexts.keys())[0]
+        return _index_first(self.contexts_by_ngap_ue_ids, RanNgapUeIds(ngap_ran_ue_id, ngap_amf_ue_id))
 
     #####################################################################
     def getid_by_tmsi(self, tmsi: int) -> int:
@@ -879,16 +2104,7 @@ class UeContextsMap:
         if tmsi is None:
             return None
         
-        # filter contexts by ngap_ids.amf_ue_ngap_id
-        filtered_contexts = {
-            k: v for k, v in self.contexts.items()
-            if v.tmsi == tmsi
-        }
-
-        if len(filtered_contexts) == 0:
-            return None
-        else:
-            return list(filtered_contexts.keys())[0]
+        return _index_first(self.contexts_by_tmsi, tmsi)
 
     #####################################################################
     def get_amfid_by_ngap_ids(self, ngap_ids: RanNgapUeIds = None) -> int:
@@ -896,16 +2112,7 @@ class UeContextsMap:
         if ngap_ids is None:
             return None
 
-        # filter contexts by ngap_ids.ran_ue_ngap_id and ngap_ids.amf_ue_ngap_id
-        filtered_contexts = {
-            k: v for k, v in self.amf_contexts.items()
-            if v[1].ngap_ids is not None and v[1].ngap_ids == ngap_ids
-        }
-        if len(filtered_contexts) > 0:
-            amf_id = list(filtered_contexts.keys())[0]
-            return amf_id
-
-        return None
+        return _index_first(self.amf_contexts_by_ngap_ids, ngap_ids)
 
     #####################################################################
     def get_amfid_by_tmsi(self, tmsi: int = None) -> int:
@@ -913,31 +2120,11 @@ class UeContextsMap:
         if tmsi is None:
             return None
 
-         # Try current GUTI
-
-        # filter contexts by current_guti.mtmsi
-        filtered_contexts = {
-            k: v for k, v in self.amf_contexts.items()
-            if v[1].current_guti is not None and v[1].current_guti.mtmsi == tmsi
-        }
-
-        if len(filtered_contexts) > 0:
-            amf_id = list(filtered_contexts.keys())[0]
-            return amf_id
-
-        # Try next GUTI
-
-        # filter contexts by next_guti.mtmsi
-        filtered_contexts = {
-            k: v for k, v in self.amf_contexts.items()
-            if v[1].next_guti is not None and v[1].next_guti.mtmsi == tmsi
-        }
-
-        if len(filtered_contexts) > 0:
-            amf_id = list(filtered_contexts.keys())[0]
-            return amf_id
-
-        return None
+        # Try current GUTI, then next GUTI
+        amf_id = _index_first(self.amf_contexts_by_current_mtmsi, tmsi)
+        if amf_id is None:
+            amf_id = _index_first(self.amf_contexts_by_next_mtmsi, tmsi)
+        return amf_id
 
     #####################################################################
     def get_amfid_by_core_amf_info(self, suci: str = None, supi: str = None, 
@@ -945,46 +2132,19 @@ class UeContextsMap:
                                next_guti_plmn: str = None, next_guti_amf_id: str = None, next_guti_m_tmsi: int = None) -> int:
 
         # get UE by any of the unique identifying parameters
-        amf_id = None
         if suci is not None:
-            filtered_contexts = {
-                k: v for k, v in self.amf_contexts.items()
-                if v[1].suci is not None and v[1].suci == suci
-            }
-            if len(filtered_contexts) > 0:
-                amf_id = list(filtered_contexts.keys())[0]
-        elif amf_id is None and supi is not None:
-            filtered_contexts = {
-                k: v for k, v in self.amf_contexts.items()
-                if v[1].supi is not None and v[1].supi == supi
-            }
-            if len(filtered_contexts) > 0:
-                amf_id = list(filtered_contexts.keys())[0]
-        elif amf_id is None and current_guti_plmn is not None:
-            filtered_contexts = {
-                k: v for k, v in self.amf_contexts.items()
-                if v[1].current_guti is not None and \
-                   v[1].current_guti.plmn_id == current_guti_plmn and \
-                   v[1].current_guti.amf_id == current_guti_amf_id and \
-                   v[1].current_guti.mtmsi == current_guti_m_tmsi
-            }
-            if len(filtered_contexts) > 0:
-                amf_id = list(filtered_contexts.keys())[0]
-        elif amf_id is None and next_guti_plmn is not None:
-            filtered_contexts = {
-                k: v for k, v in self.amf_contexts.items()
-                if v[1].next_guti is not None and \
-                   v[1].next_guti.plmn_id == next_guti_plmn and \
-                   v[1].next_guti.amf_id == next_guti_amf_id and \
-                   v[1].next_guti.mtmsi == next_guti_m_tmsi
-            }
-            if len(filtered_contexts) > 0:
-                amf_id = list(filtered_contexts.keys())[0]
+            return _index_first(self.amf_contexts_by_suci, suci)
+        elif supi is not None:
+            return _index_first(self.amf_contexts_by_supi, supi)
+        elif current_guti_plmn is not None:
+            return _index_first(self.amf_contexts_by_current_guti,
+                CoreGUTI(plmn_id=current_guti_plmn, amf_id=current_guti_amf_id, mtmsi=current_guti_m_tmsi))
+        elif next_guti_plmn is not None:
+            return _index_first(self.amf_contexts_by_next_guti,
+                CoreGUTI(plmn_id=next_guti_plmn, amf_id=next_guti_amf_id, mtmsi=next_guti_m_tmsi))
         else:
             # not found
             return None
-        
-        return amf_id
 
     #####################################################################
     def getid_by_core_amf_info(self, suci: str = None, supi: str = None, 
@@ -1001,19 +2161,42 @@ class UeContextsMap:
             return self.amf_contexts[amf_id][0]
         
         return None
-    
+
+    #####################################################################
+    @_hook
+    def disassociate_ue_context(self, ue_id: int, amf_context_id: int, now: dt.datetime = None) -> bool:
+        """
+        Unlink the AMF context from the UE context ue_id, deleted in a shard of ShardedUeContextsMap.
+        :return: True if it was still linked to it.
+        """
+        self.now = now if now is not None else dt.datetime.now(dt.UTC)
+
+        t = self.amf_contexts.get(amf_context_id, None)
+        if t is None or t[0] != ue_id:
+            return False
+        self.amf_context_set(amf_context_id, None, t[1], self.now)  # update the ue_context_id in the tuple
+        return True
+
+    #####################################################################
+    def link_amf_context(self, amf_context_id: int, ue_id: int, now: dt.datetime = None) -> None:
+        # replays a link made by ShardedAmfContexts, whose shard holds the UE context
+        self.now = now if now is not None else dt.datetime.now(dt.UTC)
+        if amf_context_id in self.amf_contexts:
+            self.link_ue_context(amf_context_id, ue_id)
+
     ####################################################################
     def get_e1_bearer_NoSrcCheck(self, cucp_ue_e1ap_id: int) -> (int, Tuple[Tuple[str, int], Tuple[str, int]]):
-        ue_id = self.getid_by_cucp_ue_e1ap_id_NoSrcCheck(cucp_ue_e1ap_id)
-        if ue_id is None:
+        v = self.get_e1_bearer_src_NoSrcCheck(cucp_ue_e1ap_id)
+        if v is None:
             if self.dbg:
                 print(f"get_e1_bearer_NoSrcCheck: UE context with cucp_ue_e1ap_id {cucp_ue_e1ap_id} not found.")
             return None, (None, None)
-        v = ue_id, self.contexts[ue_id].get_bearer_NoSrcCheck(cucp_ue_e1ap_id)
-        return ue_id, self.contexts[ue_id].get_bearer_NoSrcCheck(cucp_ue_e1ap_id)
+        cucp_src, ue_id = v
+        return ue_id, self.contexts[ue_id].get_bearer((cucp_src, cucp_ue_e1ap_id))
 
     ####################################################################
-    def hook_du_ue_ctx_creation(self, du_src: str, du_index: int, plmn: int, pci: int, crnti: int, tac: int, nci: int,  now: dt.datetime = None) -> None:
+    @_hook
+    def hook_du_ue_ctx_creation(self, du_src: str, du_index: int, plmn: int, pci: int, crnti: int, tac: int, nci: int,  now: dt.datetime = None) -> int:
         """
         Create a UE context in the DU subsystem.
 
@@ -1023,6 +2206,7 @@ class UeContextsMap:
         :param nci: NR Cell Identity.
         :param pci: Physical Cell Identity.
         :param crnti: C-RNTI (Cell Radio Network Temporary Identifier).
+        :return: the ue_id of the new UE context.
         """
 
         if self.dbg:
@@ -1052,10 +2236,11 @@ class UeContextsMap:
             self.context_delete(ue_id)
 
         # Create a new UE context
-        self.context_create(ran_unique_ue_id, du_index=du_index, nci=nci, tac=tac)
+        return self.context_create(ran_unique_ue_id, du_index=du_index, nci=nci, tac=tac)
 
     ####################################################################
-    def hook_du_ue_ctx_update_crnti(self, du_src: str, du_index: int, crnti: int, now: dt.datetime = None) -> None:
+    @_hook
+    def hook_du_ue_ctx_update_crnti(self, du_src: str, du_index: int, crnti: int, now: dt.datetime = None) -> int:
         if self.dbg:
             print("-------------------------------------------------")
             print(f"hook_du_ue_ctx_update_crnti: du_src {du_src} du_index {du_index} crnti {crnti}")
@@ -1067,12 +2252,14 @@ class UeContextsMap:
             if self.dbg:
                 print(f"UE for du_src {du_src} du_index {du_index} could not be found.")
             return
-        self.contexts[ue_id].ran_unique_ue_id = replace(
+        self.set_ran_unique_ue_id(ue_id, replace(
             self.contexts[ue_id].ran_unique_ue_id,
-            crnti=crnti)
+            crnti=crnti))
+        return ue_id
 
     ####################################################################
-    def hook_du_ue_ctx_deletion(self, du_src: str, du_index: int, now: dt.datetime = None) -> None:
+    @_hook
+    def hook_du_ue_ctx_deletion(self, du_src: str, du_index: int, now: dt.datetime = None) -> int:
         if self.dbg:
             print("-------------------------------------------------")
             print(f"hook_du_ue_ctx_deletion: du_src {du_src} du_index {du_index}")
@@ -1082,9 +2269,11 @@ class UeContextsMap:
         ue_id = self.getid_by_du_index(du_src, du_index)
         if ue_id is not None:
             self.clear_du_index(ue_id)
+        return ue_id
 
     ####################################################################
-    def hook_cucp_uemgr_ue_add(self, cucp_src: str, cucp_index: str, plmn: int, pci: int, crnti: int, now: dt.datetime = None) -> None:
+    @_hook
+    def hook_cucp_uemgr_ue_add(self, cucp_src: str, cucp_index: str, plmn: int, pci: int, crnti: int, now: dt.datetime = None) -> int:
         """
         Create a UE context in the CU-CP subsystem.
 
@@ -1092,6 +2281,7 @@ class UeContextsMap:
         :param plmn: Public Land Mobile Network identifier.
         :param pci: Physical Cell Identity.
         :param crnti: C-RNTI (Cell Radio Network Temporary Identifier).
+        :return: the ue_id of the UE context holding the cucp index.
         """
 
         if self.dbg:
@@ -1122,23 +2312,25 @@ class UeContextsMap:
         ue_id = self.getid_by_ran_unique_ue_id(ran_unique_ue_id)
         if ue_id is None:
             # Create a new UE context
-            self.context_create(ran_unique_ue_id, cucp_index=cucp_index)
+            ue_id = self.context_create(ran_unique_ue_id, cucp_index=cucp_index)
         else:
             if self.contexts[ue_id].cucp_index is not None:
                 if self.dbg:
                     print(f"Unexpected UE context with [ran_unique_ue_id={ran_unique_ue_id}] already exists.  Stale UE will be deleted")
                 self.context_delete(ue_id)
                 # Create a new UE context
-                self.context_create(ran_unique_ue_id, cucp_index=cucp_index)
+                ue_id = self.context_create(ran_unique_ue_id, cucp_index=cucp_index)
             else:
                 if self.dbg:
                     print(f"UE context with [ran_unique_ue_id={ran_unique_ue_id}] already exists.  Setting cucp index")
                 self.set_cucp_index(ue_id, cucp_index)
                 if self.dbg:
                     print(f"UE context updated: {self.contexts[ue_id]}")
+        return ue_id
 
     ####################################################################
-    def hook_cucp_uemgr_ue_remove(self, cucp_src: str, cucp_index: int, now: dt.datetime = None) -> None:
+    @_hook
+    def hook_cucp_uemgr_ue_remove(self, cucp_src: str, cucp_index: int, now: dt.datetime = None) -> int:
         if self.dbg:
             print("-------------------------------------------------")
             print(f"hook_cucp_uemgr_ue_remove: cucp_src {cucp_src} cucp_index {cucp_index}")
@@ -1148,9 +2340,40 @@ class UeContextsMap:
         ue_id = self.getid_by_cucp_index(cucp_src, cucp_index)
         if ue_id is not None:
             self.clear_cucp_index(ue_id)
+        return ue_id
 
     ####################################################################
-    def hook_e1_cucp_bearer_context_setup(self, cucp_src: str, cucp_index: int, gnb_cucp_ue_e1ap_id: int, now: dt.datetime = None) -> None:
+    @_hook
+    def hook_rrc_ue_update_context(self, cucp_src: str, old_cucp_index: int, cucp_index: int, plmn: int, pci: int, crnti: int,
+                                   tac: int = None, nci: int = None, now: dt.datetime = None) -> int:
+        """
+        Handle the transfer of the RRC context of a UE to a new CU-CP UE, on a re-establishment or
+        an intra CU-CP handover.  The UE context of old_cucp_index is re-keyed in place to cucp_index
+        and the new (plmn, pci, crnti), so it keeps its ue_id and its TMSI, NGAP and AMF associations.
+        The context created for the new CU-CP UE by cucp_uemgr_ue_add is deleted, and its du_index
+        moves to the re-keyed context.
+
+        :param old_cucp_index: The index of the UE in the CU-CP subsystem before the transfer.
+        :param cucp_index: The index of the UE in the CU-CP subsystem after the transfer.
+        """
+        if self.dbg:
+            print("-------------------------------------------------")
+            print(f"hook_rrc_ue_update_context: cucp_src={cucp_src} old_cucp_index={old_cucp_index} cucp_index={cucp_index} "
+                  f"plmn={plmn} pci={pci} crnti={crnti} tac={tac} nci={nci}")
+
+        self.now = now if now is not None else dt.datetime.now(dt.UTC)
+
+        ue_id = self.getid_by_cucp_index(cucp_src, old_cucp_index)
+        if ue_id is None:
+            if self.dbg:
+                print(f"UE for cucp_src {cucp_src} cucp_index {old_cucp_index} could not be found.")
+            return
+        self.rekey_context(ue_id, UniqueIndex(cucp_src, cucp_index), RanUniqueUeId(plmn, pci, crnti), nci=nci, tac=tac)
+        return ue_id
+
+    ####################################################################
+    @_hook
+    def hook_e1_cucp_bearer_context_setup(self, cucp_src: str, cucp_index: int, gnb_cucp_ue_e1ap_id: int, now: dt.datetime = None) -> int:
         """
         Handle the E1AP Bearer Context Setup for CU-CP.
 
@@ -1184,15 +2407,18 @@ class UeContextsMap:
     
         # update the gnb_cucp_ue_e1ap_id
         self.set_cucp_ue_e1ap_id(ue_id, gnb_cucp_ue_e1ap_id_tup)
+        return ue_id
 
     ####################################################################
-    def hook_e1_cuup_bearer_context_setup(self, cuup_src: str, cuup_index: int, gnb_cucp_ue_e1ap_id: int, gnb_cuup_ue_e1ap_id: int, success: bool, now: dt.datetime = None) -> None:
+    @_hook
+    def hook_e1_cuup_bearer_context_setup(self, cuup_src: str, cuup_index: int, gnb_cucp_ue_e1ap_id: int, gnb_cuup_ue_e1ap_id: int, success: bool, now: dt.datetime = None) -> int:
         """
         Handle the E1AP Bearer Context Setup for CU-UP.
 
         :param cuup_index: The index of the UE in the CU-UP subsystem.
         :param gnb_cu_cp_ue_e1ap_id: The E1AP ID for the CU-CP.
         :param gnb_cu_up_ue_e1ap_id: The E1AP ID for the CU-UP.
+        :return: the ue_id of the UE context holding the bearer, None if there is none.
         """
 
         if self.dbg:
@@ -1222,32 +2448,34 @@ class UeContextsMap:
             # the bearer already has a cuup_ue_e1ap_id, clear it
             self.clear_cuup_ue_e1ap_id(ue_id, bearer[1])
             # the mapping cannot be done
-            return
+            return ue_id
 
         # if this point it reached, it means we have the ue context with a matching bearer (cucp_ue_e1ap_id, None)
 
         # check if the cucp index is different
 
-        ue_id2 = self.getid_by_cuup_index(cuup_src, cuup_index)
+        ue_id2 = self.getid_by_cuup_index(cuup_src, cuup_index.idx)
         if ue_id2 is not None and ue_id2 != ue_id:
             if self.dbg:
                 print(f"Unexpected UE context with cuup_src {cuup_src} cuup_index {cuup_index} already exists.  Stale UE will be deleted")
             self.context_delete(ue_id2)
-            return
+            return ue_id
 
         # if this is a failure, clear the cucp_ue_e1ap_id
         if success is False:
             # remove the cucp_ue_e1ap_id from the context
             self.clear_cucp_ue_e1ap_id(ue_id, bearer[0])
-            return
+            return ue_id
 
         # set the cuup_ue_e1ap_id
         self.set_cuup_ue_e1ap_id(ue_id, bearer[0], gnb_cuup_ue_e1ap_id_tup)
         # update the cuup index
         self.set_cuup_index(ue_id, cuup_index)
+        return ue_id
 
     #####################################################################
-    def hook_e1_cuup_bearer_context_release(self, cuup_src: str, cuup_index: int, cucp_ue_e1ap_id: int, cuup_ue_e1ap_id: int, success: bool, now: dt.datetime = None) -> None:
+    @_hook
+    def hook_e1_cuup_bearer_context_release(self, cuup_src: str, cuup_index: int, cucp_ue_e1ap_id: int, cuup_ue_e1ap_id: int, success: bool, now: dt.datetime = None) -> int:
         if self.dbg:
             print("-------------------------------------------------")
             print(f"hook_e1_cuup_bearer_context_release success {success} cuup_src {cuup_src} cuup_index {cuup_index} gnb_cucp_ue_e1ap_id={cucp_ue_e1ap_id} gnb_cuup_ue_e1ap_id={cuup_ue_e1ap_id}")
@@ -1267,9 +2495,11 @@ class UeContextsMap:
         if ue_id is not None:
             cuup_ue_e1ap_id_tup = (cuup_src, cuup_ue_e1ap_id)
             self.clear_cuup_ue_e1ap_id(ue_id, cuup_ue_e1ap_id_tup)
+        return ue_id
 
     ####################################################################
-    def add_tmsi(self, cucp_src: str, cucp_index: int, tmsi: int, now: dt.datetime = None) -> None:
+    @_hook
+    def add_tmsi(self, cucp_src: str, cucp_index: int, tmsi: int, now: dt.datetime = None) -> int:
         if self.dbg:
             print("-------------------------------------------------")
             print(f"add_tmsi: cucp_src={cucp_src} cucp_index={cucp_index} tmsi={tmsi}")
@@ -1281,11 +2511,13 @@ class UeContextsMap:
             if self.dbg:
                 print(f"UE context with cucp_src {cucp_src} cucp_index {cucp_index} not found. !!")
             return
-        self.contexts[ue_id].tmsi = tmsi
+        self.set_tmsi(ue_id, tmsi)
         self.associate_ue_context_with_amf_tmsi(ue_id)
+        return ue_id
 
     #####################################################################
-    def hook_ngap_procedure_started(self, cucp_src: str, cucp_index: int, procedure: int, ngap_ran_ue_id, ngap_amf_ue_id: int = None, now: dt.datetime = None) -> None:
+    @_hook
+    def hook_ngap_procedure_started(self, cucp_src: str, cucp_index: int, procedure: int, ngap_ran_ue_id, ngap_amf_ue_id: int = None, now: dt.datetime = None) -> int:
         if self.dbg:
             print("-------------------------------------------------")
             print(f"hook_ngap_procedure_started: cucp_src={cucp_src} cucp_index={cucp_index} ngap_ran_ue_id={ngap_ran_ue_id} ngap_amf_ue_id={ngap_amf_ue_id}")
@@ -1296,24 +2528,26 @@ class UeContextsMap:
         # if a UE has this already, and it is a different index, delete it from that UE
         ue_id = self.getid_by_ngap_ran_ue_id(cucp_src, ngap_ran_ue_id)
         if ue_id is not None and self.contexts[ue_id].cucp_index != UniqueIndex(cucp_src, cucp_index):
-            self.contexts[ue_id].ngap_ids = None
+            self.clear_ngap_ids(ue_id)
                 
         # get by amf_ue_id
         # if a UE has this already, and it is a different index, delete it from that UE
         if ngap_amf_ue_id is not None:
             ue_id = self.getid_by_ngap_amf_ue_id(cucp_src, ngap_amf_ue_id)
             if ue_id is not None and self.contexts[ue_id].cucp_index != UniqueIndex(cucp_src, cucp_index):
-                self.contexts[ue_id].ngap_ids = None
+                self.clear_ngap_ids(ue_id)
 
         ue_id = self.getid_by_cucp_index(cucp_src, cucp_index)
         if ue_id is None:
             if self.dbg:
                 print(f"UE context with cucp_src {cucp_src} cucp_index {cucp_index} not found. !!")
             return
-        self.contexts[ue_id].ngap_ids = RanNgapUeIds(ngap_ran_ue_id, ngap_amf_ue_id)
+        self.set_ngap_ids(ue_id, RanNgapUeIds(ngap_ran_ue_id, ngap_amf_ue_id))
+        return ue_id
 
     #####################################################################
-    def hook_ngap_procedure_completed(self, cucp_src: str, cucp_index: int, procedure: int, success: bool, ngap_ran_ue_id: int, ngap_amf_ue_id: int, now: dt.datetime = None) -> None:
+    @_hook
+    def hook_ngap_procedure_completed(self, cucp_src: str, cucp_index: int, procedure: int, success: bool, ngap_ran_ue_id: int, ngap_amf_ue_id: int, now: dt.datetime = None) -> int:
         if self.dbg:
             print("-------------------------------------------------")
             print(f"hook_ngap_procedure_completed: cucp_src={cucp_src} cucp_index={cucp_index} success={success} ngap_ran_ue_id={ngap_ran_ue_id} ngap_amf_ue_id={ngap_amf_ue_id}")
@@ -1324,13 +2558,13 @@ class UeContextsMap:
         # if a UE has this already, and it is a different index, delete it from that UE
         ue_id = self.getid_by_ngap_ran_ue_id(cucp_src, ngap_ran_ue_id)
         if ue_id is not None and self.contexts[ue_id].cucp_index != UniqueIndex(cucp_src, cucp_index):
-            self.contexts[ue_id].ngap_ids = None
+            self.clear_ngap_ids(ue_id)
                 
         # get by amf_ue_id
         # if a UE has this already, and it is a different index, delete it from that UE
         ue_id = self.getid_by_ngap_amf_ue_id(cucp_src, ngap_amf_ue_id)
         if ue_id is not None and self.contexts[ue_id].cucp_index != UniqueIndex(cucp_src, cucp_index):
-            self.contexts[ue_id].ngap_ids = None
+            self.clear_ngap_ids(ue_id)
 
         ue_id = self.getid_by_cucp_index(cucp_src, cucp_index)
         if ue_id is None:
@@ -1342,37 +2576,32 @@ class UeContextsMap:
 
             # if the procedure was the context setup, clear the ngap_ids
             if procedure == JbpfNgapProcedure.NGAP_PROCEDURE_INITIAL_CONTEXT_SETUP:
-                self.contexts[ue_id].ngap_ids = None
+                self.clear_ngap_ids(ue_id)
             
         else:
 
             # the procedure was a release, clear the ngap_ids
             if procedure == JbpfNgapProcedure.NGAP_PROCEDURE_UE_CONTEXT_RELEASE:
-                 self.contexts[ue_id].ngap_ids = None
+                 self.clear_ngap_ids(ue_id)
 
             else:
-                self.contexts[ue_id].ngap_ids = RanNgapUeIds(ngap_ran_ue_id, ngap_amf_ue_id)
+                self.set_ngap_ids(ue_id, RanNgapUeIds(ngap_ran_ue_id, ngap_amf_ue_id))
                 self.associate_ue_context_with_amf_ngap(ue_id)
 
+        return ue_id
 
     #####################################################################
+    @_hook
     def hook_ngap_reset(self, cucp_src: str, ngap_ran_ue_id: int = None, ngap_amf_ue_id: int = None, now: dt.datetime = None) -> None:
         if self.dbg:
             print("-------------------------------------------------")
-            print(f"hook_ngap_reset: cucp_src={cucp_src} cucp_index={cucp_index} ngap_ran_ue_id={ngap_ran_ue_id} ngap_amf_ue_id={ngap_amf_ue_id}")
+            print(f"hook_ngap_reset: cucp_src={cucp_src} ngap_ran_ue_id={ngap_ran_ue_id} ngap_amf_ue_id={ngap_amf_ue_id}")
 
         self.now = now if now is not None else dt.datetime.now(dt.UTC)
 
         if ngap_ran_ue_id is None and ngap_amf_ue_id is None:
             # reset all contexts for this cucp
-
-            if self.dbg:
-                print(f"Resetting ngap_ids for all UEs with cucp_src '{cucp_src}'")
-
-            # get all contexts with this cucp_src
-            for ue_id, context in self.contexts.items():
-                if context.cucp_index is not None and context.cucp_index.src == cucp_src:
-                    context.ngap_ids = None
+            self.reset_ngap_for_source(cucp_src, now=self.now)
             return
             
         # get by ran_ue_id
@@ -1380,7 +2609,7 @@ class UeContextsMap:
         if ue_id is not None:
             if self.dbg:
                 print(f"Resetting ngap_ids for UE context with cucp_src '{cucp_src}' ngap_ran_ue_id {ngap_ran_ue_id}")
-            self.contexts[ue_id].ngap_ids = None     
+            self.clear_ngap_ids(ue_id)
             return
     
         # get by amf_ue_id
@@ -1388,18 +2617,74 @@ class UeContextsMap:
         if ue_id is not None:
             if self.dbg:
                 print(f"Resetting ngap_ids for UE context with cucp_src '{cucp_src}' ngap_amf_ue_id {ngap_amf_ue_id}")
-            self.contexts[ue_id].ngap_ids = None     
+            self.clear_ngap_ids(ue_id)
             return
 
 
     #####################################################################
+    @_hook
+    def reset_ngap_for_source(self, cucp_src: str, now: dt.datetime = None) -> int:
+        """
+        Clear the NGAP ids of all the UE contexts of a CU-CP, e.g. on an NG Reset of the whole interface.
+        Returns the number of contexts reset.
+        """
+        if self.dbg:
+            print(f"Resetting ngap_ids for all UEs with cucp_src '{cucp_src}'")
+
+        self.now = now if now is not None else dt.datetime.now(dt.UTC)
+
+        ue_ids = list(self.contexts_by_cucp_src.get(cucp_src, ()))
+        for ue_id in ue_ids:
+            self.clear_ngap_ids(ue_id)
+        return len(ue_ids)
+
+    #####################################################################
+    @_hook
+    def purge_source(self, src: str, now: dt.datetime = None) -> int:
+        """
+        Remove a DU, CU-CP or CU-UP from all the UE contexts, as if it had deleted all of its UEs,
+        e.g. when it disconnected.  The contexts left unused are deleted.
+        Returns the number of contexts deleted.
+        """
+        if self.dbg:
+            print("-------------------------------------------------")
+            print(f"purge_source: src {src}")
+
+        self.now = now if now is not None else dt.datetime.now(dt.UTC)
+
+        num_contexts = len(self.contexts)
+        for ue_id in list(self.contexts_by_du_src.get(src, ())):
+            self.clear_du_index(ue_id)
+        for ue_id in list(self.contexts_by_cucp_src.get(src, ())):
+            self.clear_cucp_index(ue_id)
+        for ue_id in list(self.contexts_by_cuup_src.get(src, ())):
+            # release the bearers of the CU-UP, which clears the cuup_index after the last one
+            for bearer in list(self.contexts[ue_id].e1_bearers.items()):
+                if bearer[1] is not None and bearer[1][0] == src and ue_id in self.contexts:
+                    self.clear_cuup_ue_e1ap_id(ue_id, bearer[1])
+            if ue_id in self.contexts and self.contexts[ue_id].cuup_index is not None:
+                self.clear_cuup_index(ue_id)
+        return num_contexts - len(self.contexts)
+
+    #####################################################################
+    def get_num_contexts_per_src(self) -> Dict[str, Dict[str, int]]:
+        # {"du": {du_src: count}, "cucp": {...}, "cuup": {...}}
+        return {"du": {src: len(ids) for src, ids in list(self.contexts_by_du_src.items())},
+                "cucp": {src: len(ids) for src, ids in list(self.contexts_by_cucp_src.items())},
+                "cuup": {src: len(ids) for src, ids in list(self.contexts_by_cuup_src.items())}}
+
+    #####################################################################
+    @_hook
     def hook_core_amf_info(self, ran_ue_ngap_id: int = None, amf_ue_ngap_id: int = None,
                               suci: str = None, supi: str = None, home_plmn_id: str = None,
                               current_guti_plmn: str = None, current_guti_amf_id: str = None, current_guti_m_tmsi: int = None,
                               next_guti_plmn: str = None, next_guti_amf_id: str = None, next_guti_m_tmsi: int = None,
                               tai_plmn: str = None, tai_tac: str = None,
                               cgi_plmn: str = None, cgi_cellid: str = None,
-                              now: dt.datetime = None) -> None:
+                              now: dt.datetime = None) -> int:
+        """
+        :return: the ue_id of the UE context linked to the AMF context, None if there is none.
+        """
 
         if self.dbg:
             print(f"hook_core_amf_info: ran_ue_ngap_id={ran_ue_ngap_id}, amf_ue_ngap_id={amf_ue_ngap_id}, "
@@ -1421,20 +2706,25 @@ class UeContextsMap:
             # No AMF info present
             return
         
-        self.amf_context_create_update(ran_ue_ngap_id, amf_ue_ngap_id,
+        amf_context_id = self.amf_context_create_update(ran_ue_ngap_id, amf_ue_ngap_id,
                 suci, supi, home_plmn_id,
                 current_guti_plmn, current_guti_amf_id, current_guti_m_tmsi,
                 next_guti_plmn, next_guti_amf_id, next_guti_m_tmsi,
                 tai_plmn, tai_tac,
                 cgi_plmn, cgi_cellid)
+        return self.amf_contexts[amf_context_id][0]
 
     #####################################################################
+    @_hook
     def hook_core_amf_info_remove_ran(self, suci: str = None, supi: str = None, home_plmn_id: str = None,
                               current_guti_plmn: str = None, current_guti_amf_id: str = None, current_guti_m_tmsi: int = None,
                               next_guti_plmn: str = None, next_guti_amf_id: str = None, next_guti_m_tmsi: int = None,
                               tai_plmn: str = None, tai_tac: str = None,
                               cgi_plmn: str = None, cgi_cellid: str = None,
-                              now: dt.datetime = None) -> None:
+                              now: dt.datetime = None) -> int:
+        """
+        :return: the ue_id of the UE context the AMF context was unlinked from, None if there is none.
+        """
 
         if self.dbg:
             print(f"hook_core_amf_info_remove_ran: suci={suci}, supi={supi}, home_plmn_id={home_plmn_id}, "
@@ -1455,30 +2745,417 @@ class UeContextsMap:
         if amf_context_id is None:
             return
 
-        # get UE
-        ueid = self.getid_by_core_amf_info(suci, supi, 
-                               current_guti_plmn, current_guti_amf_id, current_guti_m_tmsi,
-                               next_guti_plmn, next_guti_amf_id, next_guti_m_tmsi)
-        ue = self.getue_by_id(ueid)
-        if ue is None:
-            return
+        return self.unlink_amf_context(amf_context_id)
+
+    #####################################################################
+    @_hook
+    def apply_events(self, events, now: dt.datetime = None) -> List[int]:
+        """
+        Apply a sequence of typed events (DuUeCtxCreationEvent, CucpUeAddEvent, ...) in order.
+        The clock is read once and used as the time of all the events.
+        :return: the ue_id concerned by each event, None where there is none.
+        """
+        now = now if now is not None else dt.datetime.now(dt.UTC)
+        return [ev.apply(self, now) for ev in events]
+
+    #####################################################################
+    @_hook
+    def process_timeout(self, now: dt.datetime = None) -> int:
+
+        self.now = now if now is not None else dt.datetime.now(dt.UTC)
+
+        # delete the AMF contexts which have been unlinked for longer than amf_tmsi_expiry_secs
+        expired = self.amf_expiry.pop_expired(self.now)
+        for k in expired:
+            self.amf_context_delete(k)
+
+        if self.dbg and len(expired) > 0:
+            print(f"process_timeout: expired {len(expired)} AMF contexts")
+
+        # The evictions depend on the activity recorded by getuectx(), which is not journaled, so they
+        # are journaled as an evict_contexts() call, which a replay applies instead of deciding them again.
+        if not self.replaying:
+            idle, lru = self.evict_inactive_contexts()
+            if self.journal is not None and (len(idle) > 0 or len(lru) > 0):
+                _journal_write(self, JOURNAL_EVICT_CONTEXTS, self.now, (tuple(idle), tuple(lru)), {})
+
+        if self.journal is not None:
+            self.journal.flush()
+
+        if len(self.tombstones) > 0 or len(self.tombstone_contexts) > 0:
+            self.evict_tombstones()
 
-        self.disassociate_amf_context_with_ue(ue)
+        if len(self.batch_observers) > 0:
+            self.flush_changes()
+
+        return len(expired)
 
     #####################################################################
-    def process_timeout(self, now: dt.datetime = None) -> None:
+    def evict_inactive_contexts(self) -> Tuple[List[int], List[int]]:
+        # evict the idle UE contexts, then the least recently active ones above max_contexts
+        idle = []
+        lru = []
+        activity = self.contexts_activity
+        if self.context_idle_expiry_secs is not None:
+            idle_since = self.now - self.context_idle_expiry_secs
+            while len(activity) > 0:
+                ue_id, last = next(iter(activity.items()))
+                if ue_id not in self.contexts:
+                    activity.pop(ue_id, None)       # left by a concurrent getuectx(), see there
+                    continue
+                if last > idle_since:
+                    break
+                if self.dbg:
+                    print(f"process_timeout: evicting idle UE context {ue_id}, last active {last}")
+                self.context_delete(ue_id)
+                self.num_idle_evictions += 1
+                idle.append(ue_id)
+
+        if self.max_contexts is not None:
+            while len(self.contexts) > self.max_contexts and len(activity) > 0:
+                ue_id = next(iter(activity))
+                if ue_id not in self.contexts:
+                    activity.pop(ue_id, None)
+                    continue
+                if self.dbg:
+                    print(f"process_timeout: evicting least recently active UE context {ue_id}")
+                self.context_delete(ue_id)
+                self.num_lru_evictions += 1
+                lru.append(ue_id)
+
+        return idle, lru
 
+    #####################################################################
+    @_hook
+    def evict_contexts(self, idle_ue_ids: Tuple[int] = (), lru_ue_ids: Tuple[int] = (), now: dt.datetime = None) -> None:
+        """
+        Delete the UE contexts evicted by a process_timeout(), as journaled by it.
+        Called by replay_journal(), as the activity the evictions were decided on is not journaled.
+        """
         self.now = now if now is not None else dt.datetime.now(dt.UTC)
 
-        # filter contexts by current_guti.mtmsi
-        filtered_contexts = {
-            k: v for k, v in self.amf_contexts.items()
-            if (v[2] is not None) and ((v[2]+self.amf_tmsi_expiry_secs) <= self.now)
-        }
+        for ue_ids, kind in ((idle_ue_ids, "idle"), (lru_ue_ids, "lru")):
+            for ue_id in ue_ids:
+                if ue_id not in self.contexts:
+                    continue
+                if self.dbg:
+                    print(f"evict_contexts: evicting {kind} UE context {ue_id}")
+                self.context_delete(ue_id)
+                if kind == "idle":
+                    self.num_idle_evictions += 1
+                else:
+                    self.num_lru_evictions += 1
+
+        if len(self.batch_observers) > 0:
+            self.flush_changes()
+
+    #####################################################################
+    def get_eviction_counts(self) -> Dict[str, int]:
+        return {"idle": self.num_idle_evictions, "lru": self.num_lru_evictions}
+
+    ####################################################################
+    def save_snapshot(self, path: str) -> int:
+        """
+        Write all the UE and AMF contexts, and their indexes, to a binary snapshot file.
+        The contexts are stored least recently active first, and restored as active at the time of the load.
+        Only the copy of the rows, snapshot_rows(), holds the lock of concurrent mode: the hooks of the
+        other threads do not wait for the marshal and the write of the file.
+        :return: the size of the snapshot in bytes.
+        """
+        rows, journal_offset = self.snapshot_rows()
+        size = _write_snapshot(path, rows)
+        self.snapshot_written(journal_offset)
+
+        if self.dbg:
+            print(f"save_snapshot: {len(rows[5])} contexts, {len(rows[6])} AMF contexts, {size} bytes to {path}")
+
+        return size
+
+    ####################################################################
+    @_hook
+    def snapshot_rows(self) -> Tuple[Tuple, int]:
+        """
+        :return: the payload of a snapshot, which only holds tuples, dicts and sets of primitive values,
+                 none shared with the map, and the offset of the journal at the time of the copy, or None
+                 without a journal, for snapshot_written().
+        """
+        contexts = []
+        # a copy, as the lock-free getuectx() of concurrent mode reorders contexts_activity
+        for ue_id in list(self.contexts_activity):
+            ue = self.contexts.get(ue_id, None)
+            if ue is None:
+                continue
+            r = ue.ran_unique_ue_id
+            contexts.append((ue_id,
+                             _index_to_row(ue.du_index), _index_to_row(ue.cucp_index), _index_to_row(ue.cuup_index),
+                             r.plmn, r.pci, r.crnti, ue.nci, ue.tac,
+                             tuple(ue.e1_bearers.items()),
+                             ue.tmsi,
+                             None if ue.ngap_ids is None else (ue.ngap_ids.ran_ue_ngap_id, ue.ngap_ids.amf_ue_ngap_id),
+                             # a shard links its contexts to the router's store after loading them
+                             ue.core_amf_context_index if self.amf_requests is None else None))
+
+        amf_contexts = []
+        for amf_id, (ue_id, a, disassociated_at) in self.amf_contexts.items():
+            amf_contexts.append((amf_id, ue_id,
+                                 a.suci, a.supi, a.home_plmn_id,
+                                 None if a.current_guti is None else (a.current_guti.plmn_id, a.current_guti.amf_id, a.current_guti.mtmsi),
+                                 None if a.next_guti is None else (a.next_guti.plmn_id, a.next_guti.amf_id, a.next_guti.mtmsi),
+                                 None if a.tai is None else (a.tai.plmn_id, a.tai.tac),
+                                 None if a.cgi is None else (a.cgi.plmn_id, a.cgi.cell_id),
+                                 None if a.ngap_ids is None else (a.ngap_ids.ran_ue_ngap_id, a.ngap_ids.amf_ue_ngap_id),
+                                 None if disassociated_at is None else disassociated_at.timestamp()))
+
+        # the sets of the indexes are replaced, never modified, so a shallow copy does
+        indexes = tuple(dict(getattr(self, name)) for name in SNAPSHOT_INDEXES)
+        members = tuple({src: set(ids) for src, ids in getattr(self, name).items()} for name in SNAPSHOT_MEMBERS)
+        keyed_indexes = tuple(tuple(getattr(self, name).values()) for name, _ in SNAPSHOT_KEYED_INDEXES + SNAPSHOT_KEYED_AMF_INDEXES)
+
+        rows = (self.context_id, self.amf_context_id, self.journal_seq,
+                tuple(self.fapi_cell_id_to_pci.items()), tuple(self.srcs),
+                tuple(contexts), tuple(amf_contexts),
+                indexes, members, keyed_indexes)
+        return rows, None if self.journal is None else self.journal.tell()
+
+    ####################################################################
+    @_hook
+    def snapshot_written(self, journal_offset: int) -> None:
+        # the snapshot holds the records journaled up to journal_offset, the journal keeps the later ones
+        if self.journal is not None and journal_offset is not None:
+            self.rotate_journal(journal_offset)
+
+    ####################################################################
+    def snapshot_exists(self, path: str) -> bool:
+        return os.path.exists(path)
+
+    ####################################################################
+    def discard_journal(self, path: str) -> None:
+        # the journal of a snapshot which could not be loaded cannot be replayed without it
+        if os.path.exists(path):
+            os.remove(path)
+
+    ####################################################################
+    @_hook
+    def load_snapshot(self, path: str) -> None:
+        """
+        Restore the UE and AMF contexts of a snapshot written by save_snapshot(), and their indexes.
+        The map must be empty.  Raises ValueError if the file is not a valid snapshot, was written by another
+        Python version, or is corrupted.  A corrupted snapshot can be detected after some of its contexts were
+        restored, so the map must then be discarded.
+        """
+        if len(self.contexts) > 0 or len(self.amf_contexts) > 0:
+            raise ValueError("load_snapshot requires an empty UeContextsMap")
+
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if len(mm) < SNAPSHOT_HEADER.size:
+                    raise ValueError(f"{path} is not a UE contexts snapshot")
+                magic, version, py_major, py_minor, length = SNAPSHOT_HEADER.unpack_from(mm, 0)
+                if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or len(mm) != SNAPSHOT_HEADER.size + length:
+                    raise ValueError(f"{path} is not a version {SNAPSHOT_VERSION} UE contexts snapshot")
+                if (py_major, py_minor) != sys.version_info[:2]:
+                    raise ValueError(f"{path} was written by Python {py_major}.{py_minor}, "
+                                     f"it cannot be loaded by Python {sys.version_info[0]}.{sys.version_info[1]}")
+                # the load allocates a few objects per context, and nothing it creates is garbage,
+                # so the cyclic GC passes triggered by these allocations are pure overhead
+                gc_enabled = gc.isenabled()
+                gc.disable()
+                try:
+                    try:
+                        rows = marshal.loads(mm[SNAPSHOT_HEADER.size:])
+                    except (EOFError, TypeError, ValueError) as e:
+                        raise ValueError(f"{path} is a corrupted UE contexts snapshot: {e}") from e
+                    try:
+                        self.restore_snapshot_rows(*rows)
+                    except (TypeError, ValueError, KeyError, IndexError, AttributeError) as e:
+                        # rows of the wrong shape or type
+                        raise ValueError(f"{path} is a corrupted UE contexts snapshot: {e!r}") from e
+                finally:
+                    if gc_enabled:
+                        gc.enable()
+
+        if self.dbg:
+            print(f"load_snapshot: {len(self.contexts)} contexts, {len(self.amf_contexts)} AMF contexts from {path}")
+
+    ####################################################################
+    def restore_snapshot_rows(self, context_id: int, amf_context_id: int, journal_seq: int, fapi_cells: Tuple, srcs: Tuple,
+                              contexts: Tuple, amf_contexts: Tuple, indexes: Tuple, members: Tuple, keyed_indexes: Tuple) -> None:
+        """
+        Restore the contexts and their indexes from the rows of a snapshot, see snapshot_rows().
+        The AMF contexts are restored first, so the UE contexts can point at their CoreAMFInfo.
+        Each index is restored at once, rather than key by key as the hooks do.
+        """
+
+        self.context_id = context_id
+        self.amf_context_id = amf_context_id
+        self.journal_seq = journal_seq
+        self.fapi_cell_id_to_pci.update(fapi_cells)
+        self.srcs.extend(srcs)
+        self.src_ids.update(zip(srcs, range(len(srcs))))
+
+        expiries = []
+        for (amf_id, ue_id, suci, supi, home_plmn_id, current_guti, next_guti, tai, cgi, ngap_ids, disassociated_at) in amf_contexts:
+            amf_info = CoreAMFInfo(
+                suci=suci,
+                supi=supi,
+                home_plmn_id=home_plmn_id,
+                current_guti=None if current_guti is None else CoreGUTI(*current_guti),
+                next_guti=None if next_guti is None else CoreGUTI(*next_guti),
+                tai=None if tai is None else CoreTAI(*tai),
+                cgi=None if cgi is None else CoreCGI(*cgi),
+                ngap_ids=None if ngap_ids is None else RanNgapUeIds(*ngap_ids))
+            if disassociated_at is not None:
+                disassociated_at = dt.datetime.fromtimestamp(disassociated_at, dt.UTC)
+                expiries.append((amf_id, disassociated_at + self.amf_tmsi_expiry_secs))
+            self.amf_contexts[amf_id] = (ue_id, amf_info, disassociated_at)
+        self.amf_expiry.schedule_all(expiries)
+
+        amf_contexts = self.amf_contexts
+        for (ue_id, du_index, cucp_index, cuup_index, plmn, pci, crnti, nci, tac, e1_bearers, tmsi, ngap_ids,
+             core_amf_context_index) in contexts:
+            self.contexts[ue_id] = UeContext(RanUniqueUeId(plmn, pci, crnti),
+                                             du_index=_row_to_index(du_index), cucp_index=_row_to_index(cucp_index), cuup_index=_row_to_index(cuup_index),
+                                             nci=nci, tac=tac,
+                                             e1_bearers=dict(e1_bearers),
+                                             tmsi=tmsi,
+                                             ngap_ids=None if ngap_ids is None else RanNgapUeIds(*ngap_ids),
+                                             core_amf_context_index=core_amf_context_index,
+                                             core_amf_info=None if core_amf_context_index is None else amf_contexts[core_amf_context_index][1])
+        # in the order of the rows, least recently active first
+        self.contexts_activity.update(dict.fromkeys(self.contexts, self.now))
+
+        # the map is empty, so the indexes of the snapshot, which nothing else references, are taken as they are
+        for name, index in zip(SNAPSHOT_INDEXES + SNAPSHOT_MEMBERS, indexes + members):
+            if not isinstance(index, dict):
+                raise TypeError(f"{name} is not a dict")
+            setattr(self, name, index)
+        ues = self.contexts
+        for (name, field), values in zip(SNAPSHOT_KEYED_INDEXES, keyed_indexes):
+            getattr(self, name).update((getattr(ues[_ids_any(ids)], field), ids) for ids in values)
+        for (name, field), values in zip(SNAPSHOT_KEYED_AMF_INDEXES, keyed_indexes[len(SNAPSHOT_KEYED_INDEXES):]):
+            getattr(self, name).update((getattr(amf_contexts[_ids_any(ids)][1], field), ids) for ids in values)
+
+        if self.observed:
+            for ue_id, ue in self.contexts.items():
+                self.notify_created(ue_id, ue)
+
+    ####################################################################
+    def start_journal(self, path: str) -> None:
+        """
+        Append a record of every hook call to the journal file at path, see JOURNAL_HOOKS.
+        The records are flushed by process_timeout(), so a crash loses at most the hooks of one tick.
+        To recover, load the last snapshot, then replay_journal() the journal, then start_journal() again.
+        """
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            # drop a record cut by a crash, so the new records follow the last complete one
+            with open(path, "r+b") as f:
+                valid = JOURNAL_HEADER.size
+                for valid, _ in _journal_records(f.read(), path):
+                    pass
+                f.truncate(valid)
+        self.journal = open(path, "ab")
+        if self.journal.tell() == 0:
+            self.journal.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION))
+        self.journal_path = path
+        self.wrap_hooks()
+
+    ####################################################################
+    def stop_journal(self) -> None:
+        if self.journal is None:
+            return
+        self.journal.close()
+        self.journal = None
+        self.wrap_hooks()
+
+    ####################################################################
+    @_hook
+    def start_trace(self, size: int = 4096, ue_size: int = 32, max_deleted: int = 1024) -> None:
+        """
+        Record the last size hook calls, and the last ue_size changes of each UE context, see UeContextsTrace.
+        Without a trace, the hooks are not wrapped, so they pay nothing for it.
+        """
+        self.stop_trace()
+        self.trace = UeContextsTrace(size, ue_size, max_deleted)
+        self.subscribe(self.trace.on_change)
+        self.wrap_hooks()
+
+    ####################################################################
+    @_hook
+    def stop_trace(self) -> None:
+        if self.trace is None:
+            return
+        self.unsubscribe(self.trace.on_change)
+        self.trace = None
+        self.wrap_hooks()
+
+    ####################################################################
+    @_hook
+    def dump_trace(self, ue_id: int = None) -> Dict:
+        """
+        :return: without ue_id, the hook calls of the trace, {"calls": [...]}.  With ue_id, the changes
+                 of that UE context, {"ueid": ue_id, "deleted": bool, "changes": [...]}.  None without a trace.
+        """
+        if self.trace is None:
+            return None
+        if ue_id is None:
+            return {"calls": self.trace.dump_calls()}
+        return {"ueid": ue_id, "deleted": ue_id in self.trace.deleted, "changes": self.trace.dump_ue(ue_id)}
+
+    ####################################################################
+    def rotate_journal(self, offset: int) -> None:
+        # restart the journal with its records from offset on, once the records before it are in a snapshot
+        self.journal.flush()
+        with open(self.journal_path, "rb") as f:
+            f.seek(offset)
+            newer = f.read()
+        self.journal.close()
+        self.journal = open(self.journal_path, "wb")
+        self.journal.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION))
+        self.journal.write(newer)
+        self.journal.flush()
 
-        if len(filtered_contexts) > 0:
-            for k in filtered_contexts.keys():
-                self.amf_context_delete(k)
+    ####################################################################
+    def replay_journal(self, path: str) -> int:
+        """
+        Apply the hook calls of a journal, with their original times, skipping the records
+        up to journal_seq, which are already in the map when it was loaded from a snapshot.
+        A truncated last record, from a crash while it was written, is ignored.
+        The hooks are called directly, so the replay is not journaled again.
+        The UE contexts evicted by process_timeout() are those of its evict_contexts() records, so the
+        replay does not need the activity of the lookups, which is not journaled.
+        :return: the number of hook calls replayed.
+        """
+        hooks = [getattr(type(self), name) for name in JOURNAL_HOOKS]
+        timed = ["now" in inspect.signature(h).parameters for h in hooks]
+        count = 0
+        self.journal_depth += 1
+        self.replaying = True
+        try:
+            count = self.replay_journal_records(path, hooks, timed)
+        finally:
+            self.journal_depth -= 1
+            self.replaying = False
+
+        if self.dbg:
+            print(f"replay_journal: {count} hook calls from {path}, journal_seq={self.journal_seq}")
+
+        return count
+
+    ####################################################################
+    def replay_journal_records(self, path: str, hooks: List, timed: List[bool]) -> int:
+        count = 0
+        with open(path, "rb") as f:
+            data = f.read()
+        for _, (seq, hook, now, args, kwargs) in _journal_records(data, path):
+            if seq <= self.journal_seq:
+                continue
+            kwargs = dict(kwargs)
+            if timed[hook]:
+                kwargs["now"] = JOURNAL_EPOCH + now * JOURNAL_US
+            hooks[hook](self, *args, **kwargs)
+            self.journal_seq = seq
+            count += 1
+        return count
 
     ####################################################################
     def get_num_contexts(self) -> int:
@@ -1494,11 +3171,556 @@ class UeContextsMap:
             f"  contexts_by_cuup_index={self.contexts_by_cuup_index},\n"
             f"  contexts_by_cucp_ue_e1ap_id={self.contexts_by_cucp_ue_e1ap_id},\n"
             f"  contexts_by_cuup_ue_e1ap_id={self.contexts_by_cuup_ue_e1ap_id},\n"
+            f"  contexts_by_bare_cucp_ue_e1ap_id={self.contexts_by_bare_cucp_ue_e1ap_id},\n"
+            f"  contexts_by_ran_unique_ue_id={self.contexts_by_ran_unique_ue_id},\n"
+            f"  contexts_by_pci_crnti={self.contexts_by_pci_crnti},\n"
+            f"  contexts_by_ngap_ue_ids={self.contexts_by_ngap_ue_ids},\n"
+            f"  contexts_by_tmsi={self.contexts_by_tmsi},\n"
             f"  amf_contexts={self.amf_contexts},\n"
+            f"  amf_contexts_by_suci={self.amf_contexts_by_suci},\n"
+            f"  amf_contexts_by_supi={self.amf_contexts_by_supi},\n"
+            f"  amf_contexts_by_current_guti={self.amf_contexts_by_current_guti},\n"
+            f"  amf_contexts_by_next_guti={self.amf_contexts_by_next_guti},\n"
+            f"  amf_contexts_by_ngap_ids={self.amf_contexts_by_ngap_ids},\n"
             f")"
         )
 
 
+##########################################################################################################
+# Sharded UE contexts map.
+#
+# The contexts are partitioned by source (the jrtc device id of the DU, CU-CP or CU-UP), each shard being
+# a UeContextsMap with its own lock, so the events of different gNBs do not serialize against each other.
+# The DU, CU-CP and CU-UP of a UE are matched within a shard, so the sources of a split gNB must be
+# placed in the same shard with shard_by_src.  Other sources are placed by a hash of the source, which
+# is stable across restarts, so the per-shard snapshots can be reloaded.
+#
+# The ue_id of a context carries its shard in the bits above SHARD_ID_SHIFT.
+# The few associations which can cross shards are handled here:
+# - the CU-UP only knows the gnb_cucp_ue_e1ap_id, so the E1 bearer is looked up in every shard.
+# - the Core AMF info has no source, so the AMF contexts are kept once, in a ShardedAmfContexts store
+#   with its own lock, which links them to the UE contexts of any shard.
+# The hooks hold the lock of their shard, the lookups are lock-free, as in a concurrent UeContextsMap.
+SHARD_ID_SHIFT = 40
+
+class ShardedAmfContexts(UeContextsMap):
+    """
+    The AMF contexts of a ShardedUeContextsMap, a UeContextsMap without UE contexts.
+    It resolves the NGAP ids and TMSI of the UE contexts against the shards, and sets the AMF fields of
+    the UE contexts under the lock of their shard.  The shards queue their own associations and
+    disassociations in amf_requests, which the router applies once it has released the shard lock, so
+    the locks are always taken in the order store, then shard.
+    The links are journaled as link_amf_context() records, so the replay does not look up the shards,
+    and ShardedUeContextsMap.relink_amf_contexts() sets the AMF fields of the UE contexts afterwards.
+    """
+
+    ####################################################################
+    def __init__(self, router, dbg: bool=False):
+        super().__init__(dbg=dbg)
+        self.router = router
+
+    ####################################################################
+    def getid_by_ngap_ue_ids(self, ngap_ran_ue_id: int, ngap_amf_ue_id: int) -> int:
+        if self.replaying:
+            return None
+        return self.router.getid_by_ngap_ue_ids(ngap_ran_ue_id, ngap_amf_ue_id)
+
+    def getid_by_tmsi(self, tmsi: int) -> int:
+        if self.replaying:
+            return None
+        return self.router.getid_by_tmsi(tmsi)
+
+    ####################################################################
+    def set_context_amf(self, ue_id: int, amf_context_id: int, amf_info: CoreAMFInfo, kind: UeContextChangeKind) -> bool:
+        if self.replaying:
+            # the UE contexts are relinked after the replay
+            return True
+        k = self.router.get_shard_index_by_id(ue_id)
+        shard = self.router.shards[k]
+        with self.router.locks[k]:
+            if not shard.set_context_amf(ue_id, amf_context_id, amf_info, kind):
+                return False
+            if amf_context_id is not None:
+                shard.touch_context(ue_id)
+        if amf_context_id is not None and self.journal is not None:
+            _journal_write(self, JOURNAL_LINK_AMF_CONTEXT, self.now, (amf_context_id, ue_id), {})
+        return True
+
+    ####################################################################
+    def associate_ue_context(self, ue_id: int, ngap_ids: RanNgapUeIds, tmsi: int, now: dt.datetime) -> None:
+        # a request of a shard, whose UE context got its NGAP ids or TMSI
+        self.now = now
+        if ngap_ids is not None:
+            self.link_ue_context(self.get_amfid_by_ngap_ids(ngap_ids), ue_id)
+        else:
+            self.link_ue_context(self.get_amfid_by_tmsi(tmsi), ue_id)
+
+
+class ShardedUeContextsMap:
+    """
+    Router over num_shards UeContextsMap shards, with the same hooks and lookups as UeContextsMap.
+    """
+
+    ####################################################################
+    def __init__(self, num_shards: int, dbg: bool=False, fapi_cell_id_to_pci: Dict[int, int] = None, shard_by_src: Dict[str, int] = None):
+        self.dbg = dbg
+        self.shards = []
+        for k in range(num_shards):
+            shard = UeContextsMap(dbg=dbg, fapi_cell_id_to_pci=fapi_cell_id_to_pci)
+            shard.context_id = k << SHARD_ID_SHIFT
+            shard.amf_requests = []
+            self.shards.append(shard)
+        self.locks = [threading.Lock() for _ in range(num_shards)]
+        self.amf = ShardedAmfContexts(self, dbg=dbg)
+        self.amf_lock = threading.Lock()
+        self.shard_by_src = {} if shard_by_src is None else dict(shard_by_src)
+        self.fapi_cell_id_to_pci = {} if fapi_cell_id_to_pci is None else dict(fapi_cell_id_to_pci)
+        self.shards_by_pci = {}     # pci -> tuple of the shards holding UE contexts of that PCI, for the FAPI lookups
+        self.batch_observers = ()
+        self.tick_changes = []      # coalesced changes of the shards, collected by process_timeout()
+
+    ####################################################################
+    def get_shard_index(self, src: str) -> int:
+        k = self.shard_by_src.get(src, None)
+        if k is None:
+            k = zlib.crc32(str(src).encode()) % len(self.shards)
+            self.shard_by_src[src] = k
+        return k
+
+    ####################################################################
+    def get_shard_index_by_id(self, ue_id: int) -> int:
+        return ue_id >> SHARD_ID_SHIFT
+
+    ####################################################################
+    def call_shard(self, k: int, method: str, *args, **kwargs):
+        # a hook of shard k, under its lock, then the AMF requests it made, under the lock of the store
+        shard = self.shards[k]
+        with self.locks[k]:
+            v = getattr(shard, method)(*args, **kwargs)
+            requests = shard.amf_requests
+            if len(requests) == 0:
+                return v
+            shard.amf_requests = []
+        self.apply_amf_requests(requests)
+        return v
+
+    def apply_amf_requests(self, requests: List[Tuple]) -> None:
+        with self.amf_lock:
+            for ue_id, ngap_ids, tmsi, amf_context_id, now in requests:
+                if amf_context_id is not None:
+                    self.amf.disassociate_ue_context(ue_id, amf_context_id, now=now)
+                else:
+                    self.amf.associate_ue_context(ue_id, ngap_ids, tmsi, now)
+
+    ####################################################################
+    def call_src(self, src: str, method: str, *args, **kwargs):
+        return self.call_shard(self.get_shard_index(src), method, src, *args, **kwargs)
+
+    ####################################################################
+    def call_all(self, method: str, *args, **kwargs) -> List:
+        return self.call_shards(range(len(self.shards)), method, *args, **kwargs)
+
+    ####################################################################
+    def call_shards(self, ks, method: str, *args, **kwargs) -> List:
+        return [self.call_shard(k, method, *args, **kwargs) for k in ks]
+
+    ####################################################################
+    # the lookups, without the locks
+    def lookup_src(self, src: str, method: str, *args, **kwargs):
+        return getattr(self.shards[self.get_shard_index(src)], method)(src, *args, **kwargs)
+
+    def lookup_shards(self, ks, method: str, *args, **kwargs) -> List:
+        return [getattr(self.shards[k], method)(*args, **kwargs) for k in ks]
+
+    ####################################################################
+    # PCIs are reused across cells and DUs, so several shards can hold the UE contexts of a PCI.
+    # The tuples are replaced, never changed, so the lookups read them without a lock.
+    def add_shard_pci(self, src: str, pci: int) -> None:
+        k = self.get_shard_index(src)
+        ks = self.shards_by_pci.get(pci, ())
+        if k not in ks:
+            self.shards_by_pci[pci] = ks + (k,)
+
+    def learn_shard_pcis(self) -> None:
+        # after a snapshot load or a journal replay, which bypass the routing hooks
+        for k, (shard, lock) in enumerate(zip(self.shards, self.locks)):
+            with lock:
+                pcis = {pci for (pci, _) in shard.contexts_by_pci_crnti}
+            for pci in pcis:
+                ks = self.shards_by_pci.get(pci, ())
+                if k not in ks:
+                    self.shards_by_pci[pci] = ks + (k,)
+
+    ####################################################################
+    def lookup_first(self, method: str, *args, **kwargs):
+        # the first result which is not None, across all the shards
+        for shard in self.shards:
+            v = getattr(shard, method)(*args, **kwargs)
+            if v is not None:
+                return v
+        return None
+
+    ####################################################################
+    # DU hooks
+    def hook_du_ue_ctx_creation(self, du_src: str, du_index: int, plmn: int, pci: int, crnti: int, tac: int, nci: int, now: dt.datetime = None) -> int:
+        self.add_shard_pci(du_src, pci)
+        return self.call_src(du_src, "hook_du_ue_ctx_creation", du_index, plmn, pci, crnti, tac, nci, now=now)
+
+    def hook_du_ue_ctx_update_crnti(self, du_src: str, du_index: int, crnti: int, now: dt.datetime = None) -> int:
+        return self.call_src(du_src, "hook_du_ue_ctx_update_crnti", du_index, crnti, now=now)
+
+    def hook_du_ue_ctx_deletion(self, du_src: str, du_index: int, now: dt.datetime = None) -> int:
+        return self.call_src(du_src, "hook_du_ue_ctx_deletion", du_index, now=now)
+
+    ####################################################################
+    # CU-CP hooks
+    def hook_cucp_uemgr_ue_add(self, cucp_src: str, cucp_index: int, plmn: int, pci: int, crnti: int, now: dt.datetime = None) -> int:
+        self.add_shard_pci(cucp_src, pci)
+        return self.call_src(cucp_src, "hook_cucp_uemgr_ue_add", cucp_index, plmn, pci, crnti, now=now)
+
+    def hook_cucp_uemgr_ue_remove(self, cucp_src: str, cucp_index: int, now: dt.datetime = None) -> int:
+        return self.call_src(cucp_src, "hook_cucp_uemgr_ue_remove", cucp_index, now=now)
+
+    def hook_rrc_ue_update_context(self, cucp_src: str, old_cucp_index: int, cucp_index: int, plmn: int, pci: int, crnti: int,
+                                   tac: int = None, nci: int = None, now: dt.datetime = None) -> int:
+        self.add_shard_pci(cucp_src, pci)
+        return self.call_src(cucp_src, "hook_rrc_ue_update_context", old_cucp_index, cucp_index, plmn, pci, crnti, tac, nci, now=now)
+
+    def hook_e1_cucp_bearer_context_setup(self, cucp_src: str, cucp_index: int, gnb_cucp_ue_e1ap_id: int, now: dt.datetime = None) -> int:
+        return self.call_src(cucp_src, "hook_e1_cucp_bearer_context_setup", cucp_index, gnb_cucp_ue_e1ap_id, now=now)
+
+    def add_tmsi(self, cucp_src: str, cucp_index: int, tmsi: int, now: dt.datetime = None) -> int:
+        return self.call_src(cucp_src, "add_tmsi", cucp_index, tmsi, now=now)
+
+    def hook_ngap_procedure_started(self, cucp_src: str, cucp_index: int, procedure: int, ngap_ran_ue_id, ngap_amf_ue_id: int = None, now: dt.datetime = None) -> int:
+        return self.call_src(cucp_src, "hook_ngap_procedure_started", cucp_index, procedure, ngap_ran_ue_id, ngap_amf_ue_id, now=now)
+
+    def hook_ngap_procedure_completed(self, cucp_src: str, cucp_index: int, procedure: int, success: bool, ngap_ran_ue_id: int, ngap_amf_ue_id: int, now: dt.datetime = None) -> int:
+        return self.call_src(cucp_src, "hook_ngap_procedure_completed", cucp_index, procedure, success, ngap_ran_ue_id, ngap_amf_ue_id, now=now)
+
+    def hook_ngap_reset(self, cucp_src: str, ngap_ran_ue_id: int = None, ngap_amf_ue_id: int = None, now: dt.datetime = None) -> None:
+        self.call_src(cucp_src, "hook_ngap_reset", ngap_ran_ue_id, ngap_amf_ue_id, now=now)
+
+    def reset_ngap_for_source(self, cucp_src: str, now: dt.datetime = None) -> int:
+        return self.call_src(cucp_src, "reset_ngap_for_source", now=now)
+
+    ####################################################################
+    # A CU-UP may hold bearers in the shards of several CU-CPs, so a source is purged from all the shards
+    def purge_source(self, src: str, now: dt.datetime = None) -> int:
+        now = now if now is not None else dt.datetime.now(dt.UTC)
+        return sum(self.call_all("purge_source", src, now=now))
+
+    def get_num_contexts_per_src(self) -> Dict[str, Dict[str, int]]:
+        counts = {"du": {}, "cucp": {}, "cuup": {}}
+        for shard_counts in self.call_all("get_num_contexts_per_src"):
+            for role, by_src in shard_counts.items():
+                for src, n in by_src.items():
+                    counts[role][src] = counts[role].get(src, 0) + n
+        return counts
+
+    ####################################################################
+    # CU-UP hooks.
+    # The bearer is set up by the CU-CP, so it is in the shard of the CU-CP, which may not be the shard of the CU-UP.
+    def get_shard_index_by_cucp_ue_e1ap_id_NoSrcCheck(self, cuup_src: str, cucp_ue_e1ap_id: int) -> int:
+        k = self.get_shard_index(cuup_src)
+        order = [k] + [i for i in range(len(self.shards)) if i != k]
+        for i in order:
+            if self.shards[i].getid_by_cucp_ue_e1ap_id_NoSrcCheck(cucp_ue_e1ap_id) is not None:
+                return i
+        return k
+
+    def hook_e1_cuup_bearer_context_setup(self, cuup_src: str, cuup_index: int, gnb_cucp_ue_e1ap_id: int, gnb_cuup_ue_e1ap_id: int, success: bool, now: dt.datetime = None) -> int:
+        k = self.get_shard_index_by_cucp_ue_e1ap_id_NoSrcCheck(cuup_src, gnb_cucp_ue_e1ap_id)
+        return self.call_shard(k, "hook_e1_cuup_bearer_context_setup", cuup_src, cuup_index, gnb_cucp_ue_e1ap_id, gnb_cuup_ue_e1ap_id, success, now=now)
+
+    def hook_e1_cuup_bearer_context_release(self, cuup_src: str, cuup_index: int, cucp_ue_e1ap_id: int, cuup_ue_e1ap_id: int, success: bool, now: dt.datetime = None) -> None:
+        self.call_all("hook_e1_cuup_bearer_context_release", cuup_src, cuup_index, cucp_ue_e1ap_id, cuup_ue_e1ap_id, success, now=now)
+
+    ####################################################################
+    # Core hooks, same arguments as UeContextsMap.hook_core_amf_info() and hook_core_amf_info_remove_ran(),
+    # applied to the AMF store, which links the AMF contexts to the UE contexts of the shards.
+    def hook_core_amf_info(self, *args, **kwargs) -> int:
+        with self.amf_lock:
+            return self.amf.hook_core_amf_info(*args, **kwargs)
+
+    def hook_core_amf_info_remove_ran(self, *args, **kwargs) -> int:
+        with self.amf_lock:
+            return self.amf.hook_core_amf_info_remove_ran(*args, **kwargs)
+
+    def relink_amf_contexts(self) -> None:
+        # after a snapshot load or a journal replay, set the AMF fields of the UE contexts from the store,
+        # and unlink the AMF contexts whose UE context is gone
+        with self.amf_lock:
+            links = {t[0]: (amf_id, t[1]) for amf_id, t in self.amf.amf_contexts.items() if t[0] is not None}
+            found = set()
+            for shard, lock in zip(self.shards, self.locks):
+                with lock:
+                    for ue_id, ue in shard.contexts.items():
+                        amf_id, info = links.get(ue_id, (None, None))
+                        if amf_id is not None:
+                            found.add(ue_id)
+                        if ue.core_amf_context_index != amf_id or ue.core_amf_info is not info:
+                            kind = UeContextChangeKind.UPDATED if amf_id is None else UeContextChangeKind.AMF_ASSOCIATED
+                            shard.set_context_amf(ue_id, amf_id, info, kind)
+            for ue_id, (amf_id, _) in links.items():
+                if ue_id not in found:
+                    self.amf.disassociate_ue_context(ue_id, amf_id, now=self.amf.now)
+
+    ####################################################################
+    # lookups
+    def getue_by_id(self, ue_id: int) -> UeContext:
+        return self.shards[self.get_shard_index_by_id(ue_id)].getue_by_id(ue_id)
+
+    def has_tombstone(self, ue_id: int) -> bool:
+        return self.shards[self.get_shard_index_by_id(ue_id)].has_tombstone(ue_id)
+
+    def getuectx(self, ue_id: int) -> UeContext:
+        if ue_id is None:
+            return None
+        return self.shards[self.get_shard_index_by_id(ue_id)].getuectx(ue_id)
+
+    def getid_by_du_index(self, du_src: str, du_index: int, tombstone: bool = False) -> int:
+        return self.lookup_src(du_src, "getid_by_du_index", du_index, tombstone)
+
+    def getid_by_cucp_index(self, cucp_src: str, cucp_index: int, tombstone: bool = False) -> int:
+        return self.lookup_src(cucp_src, "getid_by_cucp_index", cucp_index, tombstone)
+
+    def getid_by_cuup_index(self, cuup_src: str, cuup_index: int, tombstone: bool = False) -> int:
+        # a live context of any shard before a tombstone
+        ue_id = self.lookup_first("getid_by_cuup_index", cuup_src, cuup_index)
+        if ue_id is None and tombstone:
+            return self.lookup_first("getid_by_cuup_index", cuup_src, cuup_index, True)
+        return ue_id
+
+    def getid_by_cucp_ue_e1ap_id(self, cucp_src: str, cucp_ue_e1ap_id: int) -> int:
+        return self.lookup_src(cucp_src, "getid_by_cucp_ue_e1ap_id", cucp_ue_e1ap_id)
+
+    def getid_by_cuup_ue_e1ap_id(self, cuup_src: str, cuup_ue_e1ap_id: int) -> int:
+        return self.lookup_first("getid_by_cuup_ue_e1ap_id", cuup_src, cuup_ue_e1ap_id)
+
+    def getid_by_ngap_ran_ue_id(self, cucp_src: str, ngap_ran_ue_id: int) -> int:
+        return self.lookup_src(cucp_src, "getid_by_ngap_ran_ue_id", ngap_ran_ue_id)
+
+    def getid_by_ngap_amf_ue_id(self, cucp_src: str, ngap_amf_ue_id: int) -> int:
+        return self.lookup_src(cucp_src, "getid_by_ngap_amf_ue_id", ngap_amf_ue_id)
+
+    def getid_by_ngap_ue_ids(self, ngap_ran_ue_id: int, ngap_amf_ue_id: int) -> int:
+        return self.lookup_first("getid_by_ngap_ue_ids", ngap_ran_ue_id, ngap_amf_ue_id)
+
+    def getid_by_tmsi(self, tmsi: int) -> int:
+        return self.lookup_first("getid_by_tmsi", tmsi)
+
+    def getid_by_core_amf_info(self, *args, **kwargs) -> int:
+        return self.amf.getid_by_core_amf_info(*args, **kwargs)
+
+    def set_fapi_cell_pci(self, cell_id: int, pci: int) -> None:
+        if pci is None:
+            self.fapi_cell_id_to_pci.pop(cell_id, None)
+        else:
+            self.fapi_cell_id_to_pci[cell_id] = pci
+        self.call_all("set_fapi_cell_pci", cell_id, pci)
+
+    def getid_by_pci_rnti(self, pci: int, rnti: int, tombstone: bool = False) -> int:
+        ks = None if pci is None else self.shards_by_pci.get(pci, None)
+        if ks is not None and len(ks) == 1:
+            return self.shards[ks[0]].getid_by_pci_rnti(pci, rnti, tombstone)
+        if ks is None:
+            # unknown cell, or rnti only
+            ks = range(len(self.shards))
+        # as in UeContextsMap, >=2 matches gives None
+        ue_ids = [ue_id for ue_id in self.lookup_shards(ks, "getid_by_pci_rnti", pci, rnti) if ue_id is not None]
+        if len(ue_ids) == 0 and tombstone:
+            ue_ids = [ue_id for ue_id in self.lookup_shards(ks, "getid_by_pci_rnti", pci, rnti, True) if ue_id is not None]
+        return ue_ids[0] if len(ue_ids) == 1 else None
+
+    def getid_by_fapi_cell_rnti(self, cell_id: int, rnti: int, tombstone: bool = False) -> int:
+        return self.getid_by_pci_rnti(self.fapi_cell_id_to_pci.get(cell_id, None), rnti, tombstone)
+
+    ####################################################################
+    # eviction, applied by each shard to its own contexts
+    @property
+    def context_idle_expiry_secs(self) -> dt.timedelta:
+        return self.shards[0].context_idle_expiry_secs
+
+    @context_idle_expiry_secs.setter
+    def context_idle_expiry_secs(self, v: dt.timedelta) -> None:
+        for shard in self.shards:
+            shard.context_idle_expiry_secs = v
+
+    @property
+    def max_contexts(self) -> int:
+        # max_contexts is spread evenly over the shards
+        m = self.shards[0].max_contexts
+        return None if m is None else m * len(self.shards)
+
+    @max_contexts.setter
+    def max_contexts(self, v: int) -> None:
+        for shard in self.shards:
+            shard.max_contexts = None if v is None else max(1, v // len(self.shards))
+
+    @property
+    def num_idle_evictions(self) -> int:
+        return sum(shard.num_idle_evictions for shard in self.shards)
+
+    @property
+    def num_lru_evictions(self) -> int:
+        return sum(shard.num_lru_evictions for shard in self.shards)
+
+    def get_eviction_counts(self) -> Dict[str, int]:
+        return {"idle": self.num_idle_evictions, "lru": self.num_lru_evictions}
+
+    # tombstones, kept by each shard for its own contexts
+    @property
+    def tombstone_expiry_secs(self) -> dt.timedelta:
+        return self.shards[0].tombstone_expiry_secs
+
+    @tombstone_expiry_secs.setter
+    def tombstone_expiry_secs(self, v: dt.timedelta) -> None:
+        for shard in self.shards:
+            shard.tombstone_expiry_secs = v
+
+    @property
+    def max_tombstones(self) -> int:
+        return self.shards[0].max_tombstones * len(self.shards)
+
+    @max_tombstones.setter
+    def max_tombstones(self, v: int) -> None:
+        for shard in self.shards:
+            shard.max_tombstones = max(1, v // len(self.shards))
+
+    @property
+    def num_tombstone_hits(self) -> int:
+        return sum(shard.num_tombstone_hits for shard in self.shards)
+
+    @property
+    def num_ambiguous_e1ap_lookups(self) -> int:
+        return sum(shard.num_ambiguous_e1ap_lookups for shard in self.shards)
+
+    ####################################################################
+    # change notifications, see UeContextsMap.subscribe().
+    # The coalesced changes of all the shards are passed in one list per tick.
+    # Each shard calls the callbacks without coalesce under its own lock, so they can run in several
+    # threads at once: a subscriber keeps its state under a lock of its own (e.g. UeContextColumns).
+    def subscribe(self, callback, coalesce: bool = False) -> None:
+        if not coalesce:
+            self.call_all("subscribe", callback)
+            return
+        if len(self.batch_observers) == 0:
+            self.call_all("subscribe", self.tick_changes.extend, coalesce=True)
+        self.batch_observers = self.batch_observers + (callback,)
+
+    def unsubscribe(self, callback) -> None:
+        self.call_all("unsubscribe", callback)
+        self.batch_observers = tuple(c for c in self.batch_observers if c != callback)
+        if len(self.batch_observers) == 0:
+            self.call_all("unsubscribe", self.tick_changes.extend)
+
+    ####################################################################
+    def process_timeout(self, now: dt.datetime = None) -> int:
+        now = now if now is not None else dt.datetime.now(dt.UTC)
+        expired = sum(self.call_all("process_timeout", now=now))
+        with self.amf_lock:
+            expired += self.amf.process_timeout(now=now)
+        if len(self.tick_changes) > 0:
+            changes = list(self.tick_changes)
+            self.tick_changes.clear()
+            for callback in self.batch_observers:
+                callback(changes)
+        return expired
+
+    ####################################################################
+    # one snapshot file per shard, <path>.<shard>, and one for the AMF store, <path>.amf.
+    # As in UeContextsMap.save_snapshot(), only the copy of the rows holds the lock.
+    def save_snapshot(self, path: str) -> int:
+        size = 0
+        for m, lock, suffix in self.persisted():
+            with lock:
+                rows, journal_offset = m.snapshot_rows()
+            size += _write_snapshot(f"{path}.{suffix}", rows)
+            with lock:
+                m.snapshot_written(journal_offset)
+        return size
+
+    def persisted(self) -> List[Tuple]:
+        # (map, lock, file suffix) of the shards and the AMF store
+        return list(zip(self.shards, self.locks, range(len(self.shards)))) + [(self.amf, self.amf_lock, "amf")]
+
+    def snapshot_exists(self, path: str) -> bool:
+        return any(os.path.exists(f"{path}.{suffix}") for _, _, suffix in self.persisted())
+
+    def discard_journal(self, path: str) -> None:
+        for m, _, suffix in self.persisted():
+            m.discard_journal(f"{path}.{suffix}")
+
+    def load_snapshot(self, path: str) -> None:
+        # the store first, then the shards, whose UE contexts are relinked to the store
+        for m, lock, suffix in reversed(self.persisted()):
+            if os.path.exists(f"{path}.{suffix}"):
+                with lock:
+                    m.load_snapshot(f"{path}.{suffix}")
+        self.relink_amf_contexts()
+        self.learn_shard_pcis()
+
+    ####################################################################
+    # one journal file per shard, <path>.<shard>, and one for the AMF store, <path>.amf
+    def start_journal(self, path: str) -> None:
+        for m, lock, suffix in self.persisted():
+            with lock:
+                m.start_journal(f"{path}.{suffix}")
+
+    def stop_journal(self) -> None:
+        self.call_all("stop_journal")
+        with self.amf_lock:
+            self.amf.stop_journal()
+
+    def replay_journal(self, path: str) -> int:
+        # the shards first, whose AMF requests are replayed by the journal of the store, then the store,
+        # which does not look up the shards while replaying, then the links of the UE contexts
+        count = 0
+        for m, lock, suffix in self.persisted():
+            if os.path.exists(f"{path}.{suffix}"):
+                with lock:
+                    count += m.replay_journal(f"{path}.{suffix}")
+                    if m is not self.amf:
+                        m.amf_requests.clear()
+        self.relink_amf_contexts()
+        self.learn_shard_pcis()
+        return count
+
+    ####################################################################
+    # one trace per shard, and one for the AMF store
+    def start_trace(self, *args, **kwargs) -> None:
+        self.call_all("start_trace", *args, **kwargs)
+        with self.amf_lock:
+            self.amf.start_trace(*args, **kwargs)
+
+    def stop_trace(self) -> None:
+        self.call_all("stop_trace")
+        with self.amf_lock:
+            self.amf.stop_trace()
+
+    def dump_trace(self, ue_id: int = None) -> Dict:
+        if ue_id is not None:
+            k = self.get_shard_index_by_id(ue_id)
+            with self.locks[k]:
+                return self.shards[k].dump_trace(ue_id)
+        dumps = [d for d in self.call_all("dump_trace") if d is not None]
+        with self.amf_lock:
+            d = self.amf.dump_trace()
+        if d is not None:
+            dumps.append(d)
+        if len(dumps) == 0:
+            return None
+        return {"calls": sorted((c for d in dumps for c in d["calls"]), key=lambda c: c["time"])}
+
+    ####################################################################
+    def get_num_contexts(self) -> int:
+        return sum(len(shard.contexts) for shard in self.shards)
+
+    def get_num_contexts_per_shard(self) -> List[int]:
+        return [len(shard.contexts) for shard in self.shards]
+
+
 ##########################################################################################################
 ##########################################################################################################
 ##########################################################################################################
@@ -1663,7 +3885,7 @@ if __name__ == "__main__":
     ue = s.getue_by_id(ue_id)
     assert ue is not None and ue.du_index is None and ue.cucp_index==UniqueIndex(cucp1_src, 1) and ue.cuup_index is None \
            and ue.ran_unique_ue_id==RanUniqueUeId(plmn=101, pci=401, crnti=20000) and ue.nci is None and ue.tac is None \
-           and len(ue.e1_bearers)==1 and ue.e1_bearers[0][0]==(cucp1_src,2000) and ue.e1_bearers[0][1] is None
+           and len(ue.e1_bearers)==1 and list(ue.e1_bearers.items())[0][0]==(cucp1_src,2000) and list(ue.e1_bearers.items())[0][1] is None
     
     
     print("############################################################################")
@@ -1708,7 +3930,7 @@ if __name__ == "__main__":
     ue = s.getue_by_id(ue_id)
     assert ue is not None and ue.du_index==UniqueIndex(du1_src,0) and ue.cucp_index==UniqueIndex(cucp1_src, 1) and ue.cuup_index is None \
            and ue.ran_unique_ue_id==RanUniqueUeId(plmn=101, pci=400, crnti=20000) and ue.nci==201 and ue.tac==12 \
-           and len(ue.e1_bearers)==1 and ue.e1_bearers[0][0]==(cucp1_src, 2000) and ue.e1_bearers[0][1] is None
+           and len(ue.e1_bearers)==1 and list(ue.e1_bearers.items())[0][0]==(cucp1_src, 2000) and list(ue.e1_bearers.items())[0][1] is None
 
 
     print("#############################################################################")
@@ -1729,7 +3951,7 @@ if __name__ == "__main__":
     ue = s.getue_by_id(ue_id)
     assert ue is not None and ue.du_index==UniqueIndex(du1_src,0) and ue.cucp_index==UniqueIndex(cucp1_src, 1) and ue.cuup_index==UniqueIndex(cuup1_src,10) \
            and ue.ran_unique_ue_id==RanUniqueUeId(plmn=101, pci=400, crnti=20000) and ue.nci==201 and ue.tac==12 \
-           and len(ue.e1_bearers)==1 and ue.e1_bearers[0][0]==(cucp1_src,2000) and ue.e1_bearers[0][1]==(cuup1_src,12000)
+           and len(ue.e1_bearers)==1 and list(ue.e1_bearers.items())[0][0]==(cucp1_src,2000) and list(ue.e1_bearers.items())[0][1]==(cuup1_src,12000)
 
 
     print("#############################################################################")
@@ -1803,7 +4025,7 @@ if __name__ == "__main__":
         assert ctx is not None and ctx.du_index==UniqueIndex(du1_src,du_off+ue) and ctx.cucp_index==UniqueIndex(cucp1_src, cucp_off+ue) and ctx.cuup_index==UniqueIndex(cuup1_src,cuup_off+ue) \
                and ctx.ran_unique_ue_id==RanUniqueUeId(plmn=101, pci=400, crnti=crnti_off+ue) and ctx.nci==201 and ctx.tac==12 \
                and len(ctx.e1_bearers)==num_e1 and \
-               all(ctx.e1_bearers[i][0]==(cucp1_src, cucp_e1Off+(ue*num_e1)+i) and ctx.e1_bearers[i][1]==(cuup1_src, cuup_e1Off+(ue*num_e1)+i) for i in range(0, num_e1))
+               all(list(ctx.e1_bearers.items())[i][0]==(cucp1_src, cucp_e1Off+(ue*num_e1)+i) and list(ctx.e1_bearers.items())[i][1]==(cuup1_src, cuup_e1Off+(ue*num_e1)+i) for i in range(0, num_e1))
 
 
     print("#############################################################################")
@@ -1842,13 +4064,13 @@ if __name__ == "__main__":
     assert ctx is not None and ctx.du_index is None and ctx.cucp_index==UniqueIndex(cucp1_src, cucp_off+ue) and ctx.cuup_index==UniqueIndex(cuup1_src,cuup_off+ue) \
             and ctx.ran_unique_ue_id==RanUniqueUeId(plmn=101, pci=400, crnti=crnti_off+ue) and ctx.nci==201 and ctx.tac==12 \
             and len(ctx.e1_bearers)==num_e1 and \
-            all(ctx.e1_bearers[i][0]==(cucp1_src, cucp_e1Off+(ue*num_e1)+i) and ctx.e1_bearers[i][1]==(cuup1_src, cuup_e1Off+(ue*num_e1)+i) for i in range(0, num_e1))
+            all(list(ctx.e1_bearers.items())[i][0]==(cucp1_src, cucp_e1Off+(ue*num_e1)+i) and list(ctx.e1_bearers.items())[i][1]==(cuup1_src, cuup_e1Off+(ue*num_e1)+i) for i in range(0, num_e1))
     s.hook_cucp_uemgr_ue_remove(cucp1_src, cucp_off+ue)
     ctx = s.getue_by_id(ue)
     assert ctx is not None and ctx.du_index is None and ctx.cucp_index is None and ctx.cuup_index==UniqueIndex(cuup1_src,cuup_off+ue) \
             and ctx.ran_unique_ue_id==RanUniqueUeId(plmn=101, pci=400, crnti=crnti_off+ue) and ctx.nci==201 and ctx.tac==12 \
             and len(ctx.e1_bearers)==num_e1 and \
-            all(ctx.e1_bearers[i][0]==(cucp1_src, cucp_e1Off+(ue*num_e1)+i) and ctx.e1_bearers[i][1]==(cuup1_src, cuup_e1Off+(ue*num_e1)+i) for i in range(0, num_e1))
+            all(list(ctx.e1_bearers.items())[i][0]==(cucp1_src, cucp_e1Off+(ue*num_e1)+i) and list(ctx.e1_bearers.items())[i][1]==(cuup1_src, cuup_e1Off+(ue*num_e1)+i) for i in range(0, num_e1))
     for e1 in range(0, num_e1):
         e1off = (ue * num_e1) + e1
         s.hook_e1_cuup_bearer_context_release(cuup1_src, cuup_off+ue, cucp_e1Off+e1off, cuup_e1Off+e1off, True)
@@ -1971,19 +4193,19 @@ if __name__ == "__main__":
         ctx = s.getue_by_id(i)
         assert ctx.concise_dict() == expected_contexts[i]
 
-    contexts_by_du_index = {f"{k.src}::{k.idx}": v for k, v in s.contexts_by_du_index.items()}
+    contexts_by_du_index = {"{}::{}".format(*s.unpack_key(k)): v for k, v in s.contexts_by_du_index.items()}
     assert contexts_by_du_index == expected_contexts_by_du_index
 
-    contexts_by_cucp_index = {f"{k.src}::{k.idx}": v for k, v in s.contexts_by_cucp_index.items()}
+    contexts_by_cucp_index = {"{}::{}".format(*s.unpack_key(k)): v for k, v in s.contexts_by_cucp_index.items()}
     assert contexts_by_cucp_index == expected_contexts_by_cucp_index
 
-    contexts_by_cuup_index = {f"{k.src}::{k.idx}": v for k, v in s.contexts_by_cuup_index.items()}
+    contexts_by_cuup_index = {"{}::{}".format(*s.unpack_key(k)): v for k, v in s.contexts_by_cuup_index.items()}
     assert contexts_by_cuup_index == expected_contexts_by_cuup_index
 
-    contexts_by_cucp_ue_e1ap_id = {f"{k[0]}::{k[1]}": v for k, v in s.contexts_by_cucp_ue_e1ap_id.items()}
+    contexts_by_cucp_ue_e1ap_id = {"{}::{}".format(*s.unpack_key(k)): v for k, v in s.contexts_by_cucp_ue_e1ap_id.items()}
     assert contexts_by_cucp_ue_e1ap_id == expected_contexts_by_cucp_ue_e1ap_id
 
-    contexts_by_cuup_ue_e1ap_id = {f"{k[0]}::{k[1]}": v for k, v in s.contexts_by_cuup_ue_e1ap_id.items()}
+    contexts_by_cuup_ue_e1ap_id = {"{}::{}".format(*s.unpack_key(k)): v for k, v in s.contexts_by_cuup_ue_e1ap_id.items()}
     assert contexts_by_cuup_ue_e1ap_id == expected_contexts_by_cuup_ue_e1ap_id
 
     print("#############################################################################")
@@ -2065,14 +4287,14 @@ if __name__ == "__main__":
     assert ctx is not None and ctx.du_index is None and ctx.cucp_index==UniqueIndex('cucp0', 11) and ctx.cuup_index==UniqueIndex('cuup1', 5) \
             and ctx.ran_unique_ue_id==RanUniqueUeId(plmn=101, pci=402, crnti=30003) and ctx.nci==203 and ctx.tac==14 \
             and len(ctx.e1_bearers)==2 \
-            and ctx.e1_bearers[0][0]==('cucp0', 22) and ctx.e1_bearers[0][1]==('cuup1', 10) and ctx.e1_bearers[1][0]==('cucp0', 23) and ctx.e1_bearers[1][1]==('cuup1', 11)
+            and list(ctx.e1_bearers.items())[0][0]==('cucp0', 22) and list(ctx.e1_bearers.items())[0][1]==('cuup1', 10) and list(ctx.e1_bearers.items())[1][0]==('cucp0', 23) and list(ctx.e1_bearers.items())[1][1]==('cuup1', 11)
     
     s.hook_cucp_uemgr_ue_remove('cucp0', 11)
     ctx = s.getue_by_id(ue)
     assert ctx is not None and ctx.du_index is None and ctx.cucp_index is None and ctx.cuup_index==UniqueIndex('cuup1', 5) \
             and ctx.ran_unique_ue_id==RanUniqueUeId(plmn=101, pci=402, crnti=30003) and ctx.nci==203 and ctx.tac==14 \
             and len(ctx.e1_bearers)==2 \
-            and ctx.e1_bearers[0][0]==('cucp0', 22) and ctx.e1_bearers[0][1]==('cuup1', 10) and ctx.e1_bearers[1][0]==('cucp0', 23) and ctx.e1_bearers[1][1]==('cuup1', 11)
+            and list(ctx.e1_bearers.items())[0][0]==('cucp0', 22) and list(ctx.e1_bearers.items())[0][1]==('cuup1', 10) and list(ctx.e1_bearers.items())[1][0]==('cucp0', 23) and list(ctx.e1_bearers.items())[1][1]==('cuup1', 11)
    
     # try an e1ap_ids=22/13.   e1ap_id=13 is not known so nothing should happen
     s.hook_e1_cuup_bearer_context_release('cuup1', 5, 22, 13, True)
@@ -2080,7 +4302,7 @@ if __name__ == "__main__":
     assert ctx is not None and ctx.du_index is None and ctx.cucp_index is None and ctx.cuup_index==UniqueIndex('cuup1', 5) \
             and ctx.ran_unique_ue_id==RanUniqueUeId(plmn=101, pci=402, crnti=30003) and ctx.nci==203 and ctx.tac==14 \
             and len(ctx.e1_bearers)==2 \
-            and ctx.e1_bearers[0][0]==('cucp0', 22) and ctx.e1_bearers[0][1]==('cuup1', 10) and ctx.e1_bearers[1][0]==('cucp0', 23) and ctx.e1_bearers[1][1]==('cuup1', 11)
+            and list(ctx.e1_bearers.items())[0][0]==('cucp0', 22) and list(ctx.e1_bearers.items())[0][1]==('cuup1', 10) and list(ctx.e1_bearers.items())[1][0]==('cucp0', 23) and list(ctx.e1_bearers.items())[1][1]==('cuup1', 11)
 
     # delete 22/10. 
     s.hook_e1_cuup_bearer_context_release('cuup1', 5, 22, 10, True)
@@ -2088,7 +4310,7 @@ if __name__ == "__main__":
     assert ctx is not None and ctx.du_index is None and ctx.cucp_index is None and ctx.cuup_index==UniqueIndex('cuup1', 5) \
             and ctx.ran_unique_ue_id==RanUniqueUeId(plmn=101, pci=402, crnti=30003) and ctx.nci==203 and ctx.tac==14 \
             and len(ctx.e1_bearers)==1 \
-            and ctx.e1_bearers[0][0]==('cucp0', 23) and ctx.e1_bearers[0][1]==('cuup1', 11)
+            and list(ctx.e1_bearers.items())[0][0]==('cucp0', 23) and list(ctx.e1_bearers.items())[0][1]==('cuup1', 11)
 
     # delete 23/11 - this will delete the context
     s.hook_e1_cuup_bearer_context_release('cuup1', 5, 23, 11, True)
@@ -2106,7 +4328,7 @@ if __name__ == "__main__":
     assert ctx is not None and ctx.du_index==UniqueIndex('du1', 0) and ctx.cucp_index==UniqueIndex('cucp0', 4) and ctx.cuup_index==UniqueIndex('cuup0', 4) \
             and ctx.ran_unique_ue_id==RanUniqueUeId(plmn=101, pci=401, crnti=30000) and ctx.nci==202 and ctx.tac==13 \
             and len(ctx.e1_bearers)==1 \
-            and ctx.e1_bearers[0][0]==('cucp0', 8) and ctx.e1_bearers[0][1]==('cuup0', 8)
+            and list(ctx.e1_bearers.items())[0][0]==('cucp0', 8) and list(ctx.e1_bearers.items())[0][1]==('cuup0', 8)
 
     s.hook_e1_cuup_bearer_context_release('cuup0', 4, 8, 8, True)
     ctx = s.getue_by_id(ue)
@@ -2195,7 +4417,7 @@ if __name__ == "__main__":
     assert ctx is not None and ctx.du_index==UniqueIndex(du_src, du_index) and ctx.cucp_index==UniqueIndex(cucp_src, cucp_index) and ctx.cuup_index==UniqueIndex(cuup_src, cuup_index) \
         and ctx.ran_unique_ue_id==RanUniqueUeId(plmn=plmn, pci=pci, crnti=crnti) and ctx.nci==nci and ctx.tac==tac \
         and len(ctx.e1_bearers)==1 \
-        and ctx.e1_bearers[0][0]==(cucp_src, cucp_ue_e1ap_id) and ctx.e1_bearers[0][1]==(cuup_src, cuup_ue_e1ap_id) 
+        and list(ctx.e1_bearers.items())[0][0]==(cucp_src, cucp_ue_e1ap_id) and list(ctx.e1_bearers.items())[0][1]==(cuup_src, cuup_ue_e1ap_id) 
     assert s.get_num_contexts() == 1
 
     s.hook_e1_cuup_bearer_context_release(cuup_src, cuup_index, cucp_ue_e1ap_id, cuup_ue_e1ap_id, True)
@@ -2245,7 +4467,7 @@ if __name__ == "__main__":
     assert ctx is not None and ctx.du_index==UniqueIndex(du_src, du_index) and ctx.cucp_index==UniqueIndex(cucp_src, cucp_index) and ctx.cuup_index==UniqueIndex(cuup_src, cuup_index) \
         and ctx.ran_unique_ue_id==RanUniqueUeId(plmn=plmn, pci=pci, crnti=crnti) and ctx.nci==nci and ctx.tac==tac \
         and len(ctx.e1_bearers)==1 \
-        and ctx.e1_bearers[0][0]==(cucp_src, cucp_ue_e1ap_id) and ctx.e1_bearers[0][1]==(cuup_src, cuup_ue_e1ap_id) 
+        and list(ctx.e1_bearers.items())[0][0]==(cucp_src, cucp_ue_e1ap_id) and list(ctx.e1_bearers.items())[0][1]==(cuup_src, cuup_ue_e1ap_id) 
     assert s.get_num_contexts() == 1
 
     new_crnti = 40000
@@ -2256,7 +4478,7 @@ if __name__ == "__main__":
     assert ctx is not None and ctx.du_index==UniqueIndex(du_src, du_index) and ctx.cucp_index==UniqueIndex(cucp_src, cucp_index) and ctx.cuup_index==UniqueIndex(cuup_src, cuup_index) \
         and ctx.ran_unique_ue_id==RanUniqueUeId(plmn=plmn, pci=pci, crnti=crnti) and ctx.nci==nci and ctx.tac==tac \
         and len(ctx.e1_bearers)==1 \
-        and ctx.e1_bearers[0][0]==(cucp_src, cucp_ue_e1ap_id) and ctx.e1_bearers[0][1]==(cuup_src, cuup_ue_e1ap_id) 
+        and list(ctx.e1_bearers.items())[0][0]==(cucp_src, cucp_ue_e1ap_id) and list(ctx.e1_bearers.items())[0][1]==(cuup_src, cuup_ue_e1ap_id) 
     assert s.get_num_contexts() == 1
 
     # this one should change the crnti
@@ -2265,13 +4487,14 @@ if __name__ == "__main__":
     assert ctx is not None and ctx.du_index==UniqueIndex(du_src, du_index) and ctx.cucp_index==UniqueIndex(cucp_src, cucp_index) and ctx.cuup_index==UniqueIndex(cuup_src, cuup_index) \
         and ctx.ran_unique_ue_id==RanUniqueUeId(plmn=plmn, pci=pci, crnti=new_crnti) and ctx.nci==nci and ctx.tac==tac \
         and len(ctx.e1_bearers)==1 \
-        and ctx.e1_bearers[0][0]==(cucp_src, cucp_ue_e1ap_id) and ctx.e1_bearers[0][1]==(cuup_src, cuup_ue_e1ap_id) 
+        and list(ctx.e1_bearers.items())[0][0]==(cucp_src, cucp_ue_e1ap_id) and list(ctx.e1_bearers.items())[0][1]==(cuup_src, cuup_ue_e1ap_id) 
     assert s.get_num_contexts() == 1
 
     print("#############################################################################")
     print("# Test getid_by_pci_rnti")
     assert s.getid_by_pci_rnti(1, new_crnti) == 1
-    assert s.getid_by_pci_rnti(5, new_crnti) == 1           # incorrect pci.  just find on rnti
+    assert s.getid_by_pci_rnti(5, new_crnti) is None        # incorrect pci
+    assert s.getid_by_pci_rnti(None, new_crnti) == 1        # no pci.  just find on rnti
     assert s.getid_by_pci_rnti(1, new_crnti+1) is None      # incorrect rnti
 
     print("#############################################################################")
@@ -2751,7 +4974,7 @@ if __name__ == "__main__":
         cgi_cellid=a.get("nr_cgi", {}).get("cell_id", None)
     )
     uectx = s.getue_by_id(0)
-    assert uectx is not None and asdict(uectx) == {'du_index': {'src': 'du1', 'idx': 100}, 'cucp_index': {'src': 'cucp1', 'idx': 200}, 'cuup_index': None, 'ran_unique_ue_id': {'plmn': 101, 'pci': 400, 'crnti': 20000}, 'nci': 201, 'tac': 12, 'e1_bearers': [], 'tmsi': None, 'ngap_ids': {'ran_ue_ngap_id': 5000, 'amf_ue_ngap_id': 15000}, 'core_amf_context_index': 0, 'core_amf_info': {'suci': 'suci-0-001-01-0000-0-0-1230010004', 'supi': 'imsi-001011230010004', 'home_plmn_id': '001F01', 'current_guti': {'plmn_id': '999F99', 'amf_id': '20040', 'mtmsi': 3221226075}, 'next_guti': {'plmn_id': '999F99', 'amf_id': '20040', 'mtmsi': 3221225666}, 'tai': {'plmn_id': '00f110', 'tac': '1'}, 'cgi': {'plmn_id': '00f110', 'cell_id': '66c000'}, 'ngap_ids': {'ran_ue_ngap_id': 5000, 'amf_ue_ngap_id': 15000}}}
+    assert uectx is not None and asdict(uectx) == {'du_index': {'src': 'du1', 'idx': 100}, 'cucp_index': {'src': 'cucp1', 'idx': 200}, 'cuup_index': None, 'ran_unique_ue_id': {'plmn': 101, 'pci': 400, 'crnti': 20000}, 'nci': 201, 'tac': 12, 'e1_bearers': {}, 'tmsi': None, 'ngap_ids': {'ran_ue_ngap_id': 5000, 'amf_ue_ngap_id': 15000}, 'core_amf_context_index': 0, 'core_amf_info': {'suci': 'suci-0-001-01-0000-0-0-1230010004', 'supi': 'imsi-001011230010004', 'home_plmn_id': '001F01', 'current_guti': {'plmn_id': '999F99', 'amf_id': '20040', 'mtmsi': 3221226075}, 'next_guti': {'plmn_id': '999F99', 'amf_id': '20040', 'mtmsi': 3221225666}, 'tai': {'plmn_id': '00f110', 'tac': '1'}, 'cgi': {'plmn_id': '00f110', 'cell_id': '66c000'}, 'ngap_ids': {'ran_ue_ngap_id': 5000, 'amf_ue_ngap_id': 15000}}}
     assert len(s.amf_contexts) == 1
     
     s.hook_core_amf_info_remove_ran(
@@ -2772,7 +4995,7 @@ if __name__ == "__main__":
     assert uectx is not None and asdict(uectx) == {'du_index': {'src': 'du1', 'idx': 100}, 'cucp_index': {'src': 'cucp1', 'idx': 200}, 
                                                    'cuup_index': None, 
                                                    'ran_unique_ue_id': {'plmn': 101, 'pci': 400, 'crnti': 20000}, 'nci': 201, 'tac': 12, 
-                                                   'e1_bearers': [], 'tmsi': None, 'ngap_ids': {'ran_ue_ngap_id': 5000, 'amf_ue_ngap_id': 15000},
+                                                   'e1_bearers': {}, 'tmsi': None, 'ngap_ids': {'ran_ue_ngap_id': 5000, 'amf_ue_ngap_id': 15000},
                                                    'core_amf_context_index': None, 'core_amf_info': None}
     num_amf_contexts_associated_with_ue = sum(1 for v in s.amf_contexts.values() if v[0] is not None)
     
@@ -2796,7 +5019,7 @@ if __name__ == "__main__":
         cgi_cellid=a.get("nr_cgi", {}).get("cell_id", None)
     )
     uectx = s.getue_by_id(0)  
-    assert uectx is not None and asdict(uectx) == {'du_index': {'src': 'du1', 'idx': 100}, 'cucp_index': {'src': 'cucp1', 'idx': 200}, 'cuup_index': None, 'ran_unique_ue_id': {'plmn': 101, 'pci': 400, 'crnti': 20000}, 'nci': 201, 'tac': 12, 'e1_bearers': [], 'tmsi': None, 'ngap_ids': {'ran_ue_ngap_id': 5000, 'amf_ue_ngap_id': 15000}, 'core_amf_context_index': 0, 'core_amf_info': {'suci': 'suci-0-001-01-0000-0-0-1230010004', 'supi': 'imsi-001011230010004', 'home_plmn_id': '001F01', 'current_guti': {'plmn_id': '999F99', 'amf_id': '20040', 'mtmsi': 3221226075}, 'next_guti': {'plmn_id': '999F99', 'amf_id': '20040', 'mtmsi': 3221225666}, 'tai': {'plmn_id': '00f110', 'tac': '1'}, 'cgi': {'plmn_id': '00f110', 'cell_id': '66c000'}, 'ngap_ids': {'ran_ue_ngap_id': 5000, 'amf_ue_ngap_id': 15000}}}
+    assert uectx is not None and asdict(uectx) == {'du_index': {'src': 'du1', 'idx': 100}, 'cucp_index': {'src': 'cucp1', 'idx': 200}, 'cuup_index': None, 'ran_unique_ue_id': {'plmn': 101, 'pci': 400, 'crnti': 20000}, 'nci': 201, 'tac': 12, 'e1_bearers': {}, 'tmsi': None, 'ngap_ids': {'ran_ue_ngap_id': 5000, 'amf_ue_ngap_id': 15000}, 'core_amf_context_index': 0, 'core_amf_info': {'suci': 'suci-0-001-01-0000-0-0-1230010004', 'supi': 'imsi-001011230010004', 'home_plmn_id': '001F01', 'current_guti': {'plmn_id': '999F99', 'amf_id': '20040', 'mtmsi': 3221226075}, 'next_guti': {'plmn_id': '999F99', 'amf_id': '20040', 'mtmsi': 3221225666}, 'tai': {'plmn_id': '00f110', 'tac': '1'}, 'cgi': {'plmn_id': '00f110', 'cell_id': '66c000'}, 'ngap_ids': {'ran_ue_ngap_id': 5000, 'amf_ue_ngap_id': 15000}}}
     assert len(s.amf_contexts) == 1
     num_amf_contexts_associated_with_ue = sum(1 for v in s.amf_contexts.values() if v[0] is not None)
     assert num_amf_contexts_associated_with_ue == 1
@@ -2916,15 +5139,904 @@ if __name__ == "__main__":
     assert len(s.amf_contexts) == 1
     assert num_amf_contexts_disassociated_with_ue == 1
 
-    s.process_timeout(now=tnow+dt.timedelta(seconds=21599))
+    assert s.process_timeout(now=tnow+dt.timedelta(seconds=21599)) == 0
     num_amf_contexts_disassociated_with_ue = sum(1 for v in s.amf_contexts.values() if v[2] is not None)
     assert len(s.amf_contexts) == 1
     assert num_amf_contexts_disassociated_with_ue == 1
 
-    s.process_timeout(now=tnow+dt.timedelta(seconds=21600))
+    assert s.process_timeout(now=tnow+dt.timedelta(seconds=21600)) == 1
+    assert len(s.amf_expiry) == 0
     num_amf_contexts_disassociated_with_ue = sum(1 for v in s.amf_contexts.values() if v[2] is not None)
     assert len(s.amf_contexts) == 0
 
+    print("#############################################################################")
+    print("# Test the RanUniqueUeId index follows C-RNTI updates and detects duplicates")
+    s = UeContextsMap(dbg=dbg)
+    s.hook_du_ue_ctx_creation("du0", 0, 101, 400, 20000, 12, 201)
+    s.hook_du_ue_ctx_creation("du0", 1, 101, 400, 20001, 12, 201)
+    ue_id = s.getid_by_du_index("du0", 0)
+    assert s.getid_by_ran_unique_ue_id(RanUniqueUeId(101, 400, 20000)) == ue_id
+    s.hook_du_ue_ctx_update_crnti("du0", 0, 20002)
+    assert s.getid_by_ran_unique_ue_id(RanUniqueUeId(101, 400, 20000)) is None
+    assert s.getid_by_ran_unique_ue_id(RanUniqueUeId(101, 400, 20002)) == ue_id
+    # force two contexts onto the same (plmn, pci, crnti)
+    s.hook_du_ue_ctx_update_crnti("du0", 1, 20002)
+    try:
+        s.getid_by_ran_unique_ue_id(RanUniqueUeId(101, 400, 20002))
+        assert False, "expected ValueError for duplicate RanUniqueUeId"
+    except ValueError:
+        pass
+    s.hook_du_ue_ctx_deletion("du0", 1)
+    assert s.getid_by_ran_unique_ue_id(RanUniqueUeId(101, 400, 20002)) == ue_id
+    s.hook_du_ue_ctx_deletion("du0", 0)
+    assert len(s.contexts_by_ran_unique_ue_id) == 0
+
+    print("#############################################################################")
+    print("# Test (pci, rnti) lookups for FAPI across two cells")
+    s = UeContextsMap(dbg=dbg, fapi_cell_id_to_pci={0: 400})
+    s.set_fapi_cell_pci(1, 401)
+    s.hook_du_ue_ctx_creation("du0", 0, 101, 400, 20000, 12, 201)
+    s.hook_du_ue_ctx_creation("du1", 0, 101, 401, 20000, 13, 202)
+    ue0 = s.getid_by_du_index("du0", 0)
+    ue1 = s.getid_by_du_index("du1", 0)
+    assert s.getid_by_pci_rnti(400, 20000) == ue0
+    assert s.getid_by_pci_rnti(401, 20000) == ue1
+    assert s.getid_by_fapi_cell_rnti(0, 20000) == ue0
+    assert s.getid_by_fapi_cell_rnti(1, 20000) == ue1
+    # unmapped cell falls back to rnti only, which is ambiguous here
+    assert s.getid_by_fapi_cell_rnti(2, 20000) is None
+    s.hook_du_ue_ctx_update_crnti("du1", 0, 20001)
+    assert s.getid_by_fapi_cell_rnti(1, 20000) is None
+    assert s.getid_by_fapi_cell_rnti(1, 20001) == ue1
+    assert s.getid_by_fapi_cell_rnti(2, 20000) == ue0
+    s.hook_du_ue_ctx_deletion("du0", 0)
+    assert s.getid_by_fapi_cell_rnti(0, 20000) is None
+    assert (400, 20000) not in s.contexts_by_pci_crnti and 20000 not in s.contexts_by_crnti
+
+    print("#############################################################################")
+    print("# Test NGAP id lookups are scoped by cucp_src and follow resets and deletes")
+    s = UeContextsMap(dbg=dbg)
+    for n, cucp_src in enumerate(["cucp0", "cucp1"]):
+        s.hook_cucp_uemgr_ue_add(cucp_src, 0, 101, 400+n, 20000)
+        s.hook_ngap_procedure_started(cucp_src, 0, JbpfNgapProcedure.NGAP_PROCEDURE_INITIAL_CONTEXT_SETUP, 7)
+        s.hook_ngap_procedure_completed(cucp_src, 0, JbpfNgapProcedure.NGAP_PROCEDURE_INITIAL_CONTEXT_SETUP, True, 7, 70+n)
+    ue0 = s.getid_by_cucp_index("cucp0", 0)
+    ue1 = s.getid_by_cucp_index("cucp1", 0)
+    assert s.getid_by_ngap_ran_ue_id("cucp0", 7) == ue0
+    assert s.getid_by_ngap_ran_ue_id("cucp1", 7) == ue1
+    assert s.getid_by_ngap_amf_ue_id("cucp0", 70) == ue0
+    assert s.getid_by_ngap_amf_ue_id("cucp0", 71) is None
+    assert s.getid_by_ngap_ue_ids(7, 71) == ue1
+    s.hook_ngap_reset("cucp0")
+    assert s.getid_by_ngap_ran_ue_id("cucp0", 7) is None
+    assert s.getid_by_ngap_ue_ids(7, 70) is None
+    assert s.getid_by_ngap_ran_ue_id("cucp1", 7) == ue1
+    s.hook_cucp_uemgr_ue_remove("cucp1", 0)
+    assert s.getid_by_ngap_ran_ue_id("cucp1", 7) is None
+    assert len(s.contexts_by_ngap_ran_ue_id) == 0 and len(s.contexts_by_ngap_amf_ue_id) == 0 \
+        and len(s.contexts_by_ngap_ue_ids) == 0
+
+    print("#############################################################################")
+    print("# Test AMF context and TMSI indexes follow updates, association and deletes")
+    s = UeContextsMap(dbg=dbg)
+    s.hook_core_amf_info(suci="suci-1", current_guti_plmn="00101", current_guti_amf_id="1", current_guti_m_tmsi=0x100)
+    amf0 = s.get_amfid_by_core_amf_info(suci="suci-1")
+    assert s.get_amfid_by_tmsi(0x100) == amf0
+    assert s.get_amfid_by_core_amf_info(current_guti_plmn="00101", current_guti_amf_id="1", current_guti_m_tmsi=0x100) == amf0
+    # reallocation moves the current GUTI to the next GUTI slot
+    s.hook_core_amf_info(suci="suci-1", supi="imsi-1", current_guti_plmn="00101", current_guti_amf_id="1", current_guti_m_tmsi=0x100,
+                         next_guti_plmn="00101", next_guti_amf_id="1", next_guti_m_tmsi=0x200)
+    assert s.get_amfid_by_core_amf_info(supi="imsi-1") == amf0
+    assert s.get_amfid_by_tmsi(0x200) == amf0
+    assert len(s.amf_contexts) == 1 and s.amf_contexts_by_suci["suci-1"] == amf0
+    s.hook_cucp_uemgr_ue_add("cucp0", 0, 101, 400, 20000)
+    ue0 = s.getid_by_cucp_index("cucp0", 0)
+    s.add_tmsi("cucp0", 0, 0x200)
+    assert s.getid_by_tmsi(0x200) == ue0
+    assert s.getuectx(ue0).core_amf_context_index == amf0
+    s.add_tmsi("cucp0", 0, 0x300)
+    assert s.getid_by_tmsi(0x200) is None and s.getid_by_tmsi(0x300) == ue0
+    s.hook_cucp_uemgr_ue_remove("cucp0", 0)
+    assert len(s.contexts_by_tmsi) == 0
+    s.amf_context_delete(amf0)
+    assert s.get_amfid_by_tmsi(0x100) is None and s.get_amfid_by_core_amf_info(suci="suci-1") is None
+    assert len(s.amf_contexts_by_suci) == 0 and len(s.amf_contexts_by_supi) == 0 \
+        and len(s.amf_contexts_by_current_mtmsi) == 0 and len(s.amf_contexts_by_next_mtmsi) == 0
+
+    print("#############################################################################")
+    print("# Test the expiry scheduler handles rescheduling and cancellation")
+    x = ExpiryScheduler()
+    x.schedule("a", tnow + dt.timedelta(seconds=10))
+    x.schedule("b", tnow + dt.timedelta(seconds=20))
+    x.schedule("c", tnow + dt.timedelta(seconds=5))
+    x.schedule("a", tnow + dt.timedelta(seconds=30))
+    x.cancel("c")
+    assert x.pop_expired(tnow + dt.timedelta(seconds=25)) == ["b"] and x.last_expired == 1
+    assert x.pop_expired(tnow + dt.timedelta(seconds=25)) == [] and x.last_expired == 0
+    assert "a" in x and len(x) == 1
+    assert x.pop_expired(tnow + dt.timedelta(seconds=30)) == ["a"] and x.total_expired == 2
+    assert len(x.heap) == 0
+
+    print("#############################################################################")
+    print("# Test re-associating an AMF context cancels its expiry")
+    s = UeContextsMap(dbg=dbg)
+    s.hook_core_amf_info(suci="suci-1", current_guti_plmn="00101", current_guti_amf_id="1", current_guti_m_tmsi=0x100, now=tnow)
+    s.hook_cucp_uemgr_ue_add("cucp0", 0, 101, 400, 20000, now=tnow)
+    s.add_tmsi("cucp0", 0, 0x100, now=tnow)
+    s.hook_cucp_uemgr_ue_remove("cucp0", 0, now=tnow)
+    amf0 = s.get_amfid_by_tmsi(0x100)
+    assert amf0 in s.amf_expiry
+    s.hook_cucp_uemgr_ue_add("cucp0", 1, 101, 400, 20001, now=tnow)
+    s.add_tmsi("cucp0", 1, 0x100, now=tnow)
+    assert amf0 not in s.amf_expiry
+    assert s.process_timeout(now=tnow+dt.timedelta(days=1)) == 0 and len(s.amf_contexts) == 1
+
+    print("#############################################################################")
+    print("# Test the slotted key types hash like their fields and survive copies")
+    import copy
+    k = UniqueIndex("cucp0", 5)
+    assert not hasattr(k, "__dict__") and not hasattr(s.getuectx(s.getid_by_cucp_index("cucp0", 1)), "__dict__")
+    assert hash(k) == hash(("cucp0", 5)) and copy.deepcopy(k) == k and hash(copy.copy(k)) == hash(k)
+    assert {RanUniqueUeId(101, 400, 1): 7}[replace(RanUniqueUeId(101, 400, 2), crnti=1)] == 7
+    assert asdict(CoreGUTI("00101", "1", 5)) == {"plmn_id": "00101", "amf_id": "1", "mtmsi": 5}
+
+    print("#############################################################################")
+    print("# Test the cached concise dict / JSON follow changes to the context")
+    s = UeContextsMap(dbg=dbg)
+    s.hook_du_ue_ctx_creation("du0", 0, 101, 400, 20000, 12, 201)
+    s.hook_cucp_uemgr_ue_add("cucp0", 0, 101, 400, 20000)
+    u = s.getuectx(s.getid_by_du_index("du0", 0))
+    d = u.concise_dict()
+    assert u.concise_dict() is d and json.loads(u.concise_json()) == d
+    s.hook_du_ue_ctx_update_crnti("du0", 0, 20001)
+    assert u.concise_dict() is not d and u.concise_dict()["ran_unique_ue_id"]["crnti"] == 20001
+    s.hook_e1_cucp_bearer_context_setup("cucp0", 0, 5)
+    assert u.concise_dict()["e1_bearers"] == [(("cucp0", 5), None)]
+    s.hook_e1_cuup_bearer_context_setup("cuup0", 0, 5, 6, True)
+    assert json.loads(u.concise_json())["e1_bearers"] == [[["cucp0", 5], ["cuup0", 6]]]
+    j = UeCtxJson()
+    out = {"stats": [{"ueid": 0, "ue_ctx": j.ref(u)}, {"ueid": None, "ue_ctx": j.ref(None)}]}
+    assert json.loads(j.dumps(out)) == json.loads(json.dumps({"stats": [{"ueid": 0, "ue_ctx": u.concise_dict()}, {"ueid": None, "ue_ctx": None}]}))
+
+    print("#############################################################################")
+    print("# Test a batch of events gives the same state as the individual hooks")
+    proc = JbpfNgapProcedure.NGAP_PROCEDURE_INITIAL_CONTEXT_SETUP
+    s = UeContextsMap(dbg=dbg)
+    ue_ids = s.apply_events([
+        DuUeCtxCreationEvent("du0", 0, 101, 400, 20000, 12, 201),
+        CucpUeAddEvent("cucp0", 0, 101, 400, 20000),
+        E1CucpBearerSetupEvent("cucp0", 0, 5),
+        E1CuupBearerSetupEvent("cuup0", 0, 5, 6, True),
+        NgapProcedureStartedEvent("cucp0", 0, proc, 7),
+        NgapProcedureCompletedEvent("cucp0", 0, proc, True, 7, 70),
+        CoreAmfInfoEvent(ran_ue_ngap_id=7, amf_ue_ngap_id=70, suci="suci-1"),
+        CucpUeTmsiEvent("cucp0", 0, 0x100),
+        DuUeCtxUpdateCrntiEvent("du0", 0, 20001),
+        NgapResetEvent("cucp0", 7),
+        CoreAmfInfoEvent(suci="suci-1", remove_ran=True),
+    ], now=tnow)
+    assert ue_ids == [0, 0, 0, 0, 0, 0, 0, 0, 0, None, 0]
+    s2 = UeContextsMap(dbg=dbg)
+    s2.hook_du_ue_ctx_creation("du0", 0, 101, 400, 20000, 12, 201, now=tnow)
+    s2.hook_cucp_uemgr_ue_add("cucp0", 0, 101, 400, 20000, now=tnow)
+    s2.hook_e1_cucp_bearer_context_setup("cucp0", 0, 5, now=tnow)
+    s2.hook_e1_cuup_bearer_context_setup("cuup0", 0, 5, 6, True, now=tnow)
+    s2.hook_ngap_procedure_started("cucp0", 0, proc, 7, now=tnow)
+    s2.hook_ngap_procedure_completed("cucp0", 0, proc, True, 7, 70, now=tnow)
+    s2.hook_core_amf_info(ran_ue_ngap_id=7, amf_ue_ngap_id=70, suci="suci-1", now=tnow)
+    s2.add_tmsi("cucp0", 0, 0x100, now=tnow)
+    s2.hook_du_ue_ctx_update_crnti("du0", 0, 20001, now=tnow)
+    s2.hook_ngap_reset("cucp0", 7, now=tnow)
+    s2.hook_core_amf_info_remove_ran(suci="suci-1", now=tnow)
+    assert s.contexts == s2.contexts and s.amf_contexts == s2.amf_contexts
+    ue_ids = s.apply_events([
+        E1CuupBearerReleaseEvent("cuup0", 0, 5, 6, True),
+        DuUeCtxDeletionEvent("du0", 0),
+        CucpUeRemoveEvent("cucp0", 0),
+    ], now=tnow)
+    assert ue_ids == [0, 0, 0] and s.get_num_contexts() == 0
+
+    # the events return the ue_id resolved by their hook, so a batch does the lookups of the hooks only
+    def count_lookups(m, f):
+        n = [0]
+        for name in ("getid_by_du_index", "getid_by_cucp_index", "getid_by_ran_unique_ue_id"):
+            def counted(*args, _get=getattr(m, name), **kwargs):
+                n[0] += 1
+                return _get(*args, **kwargs)
+            setattr(m, name, counted)
+        f(m)
+        return n[0]
+    n_batch = count_lookups(UeContextsMap(dbg=dbg), lambda m: m.apply_events([
+        DuUeCtxCreationEvent("du0", 0, 101, 400, 20000, 12, 201), CucpUeAddEvent("cucp0", 0, 101, 400, 20000),
+        DuUeCtxDeletionEvent("du0", 0), CucpUeRemoveEvent("cucp0", 0)], now=tnow))
+    n_hooks = count_lookups(UeContextsMap(dbg=dbg), lambda m: (
+        m.hook_du_ue_ctx_creation("du0", 0, 101, 400, 20000, 12, 201, now=tnow), m.hook_cucp_uemgr_ue_add("cucp0", 0, 101, 400, 20000, now=tnow),
+        m.hook_du_ue_ctx_deletion("du0", 0, now=tnow), m.hook_cucp_uemgr_ue_remove("cucp0", 0, now=tnow)))
+    assert n_batch == n_hooks
+
+    ###################################
+    # snapshot save / load
+    print("\n\n------ Test: snapshot ---------")
+    import tempfile
+    s2.hook_du_ue_ctx_creation("du1", 3, 101, 400, 20002, 12, 201, now=tnow)
+    s2.hook_cucp_uemgr_ue_add("cucp1", 3, 101, 400, 20002, now=tnow)
+    s2.hook_e1_cucp_bearer_context_setup("cucp1", 3, 8, now=tnow)
+    s2.hook_ngap_procedure_started("cucp1", 3, proc, 9, now=tnow)
+    s2.hook_ngap_procedure_completed("cucp1", 3, proc, True, 9, 90, now=tnow)
+    s2.hook_core_amf_info(ran_ue_ngap_id=9, amf_ue_ngap_id=90, suci="suci-2", supi="imsi-2",
+                          current_guti_plmn="00101", current_guti_amf_id="20", current_guti_m_tmsi=0x1234,
+                          tai_plmn="00101", tai_tac="1", now=tnow)
+    s2.hook_core_amf_info(suci="suci-3", now=tnow)
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "uectx.snap")
+        size = s2.save_snapshot(path)
+        assert size == os.path.getsize(path) and s2.snapshot_exists(path)
+        s3 = UeContextsMap(dbg=dbg)
+        s3.load_snapshot(path)
+        for k, v in vars(s2).items():
+            if k not in ("amf_expiry", "now", "contexts_activity"):
+                assert vars(s3)[k] == v, k
+        assert list(s3.contexts_activity) == list(s2.contexts_activity)
+        assert len(s3.amf_expiry) == len(s2.amf_expiry)
+        assert all(k in s3.amf_expiry for k, _ in s2.amf_contexts.items() if k in s2.amf_expiry)
+        assert s3.getid_by_tmsi(0x100) == 0
+        assert s3.getid_by_ngap_ran_ue_id("cucp1", 9) == s2.getid_by_ngap_ran_ue_id("cucp1", 9) is not None
+        assert s3.get_amfid_by_tmsi(0x1234) == s2.get_amfid_by_tmsi(0x1234) is not None
+        assert s3.getid_by_core_amf_info(supi="imsi-2") == s2.getid_by_core_amf_info(supi="imsi-2")
+        try:
+            s3.load_snapshot(path)
+            assert False
+        except ValueError:
+            pass
+        with open(path, "r+b") as f:
+            f.write(b"XXXXXXXX")
+        try:
+            UeContextsMap(dbg=dbg).load_snapshot(path)
+            assert False
+        except ValueError:
+            pass
+        # a corrupted payload, rows of the wrong shape, or a snapshot of another Python version, are a ValueError
+        rows = marshal.dumps((0, 0, 0, (), (), (None,), (), (), (), ()), 4)
+        for offset, data in ((SNAPSHOT_HEADER.size, b"\xff"), (SNAPSHOT_HEADER.size + 2, b"\xff\xff"), (13, b"\x01"),
+                             (0, SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, sys.version_info[0], sys.version_info[1], len(rows)) + rows)):
+            s2.save_snapshot(path)
+            with open(path, "r+b") as f:
+                f.seek(offset)
+                f.write(data)
+                if offset == 0:
+                    f.truncate()
+            try:
+                UeContextsMap(dbg=dbg).load_snapshot(path)
+                assert False
+            except ValueError:
+                pass
+
+    ###################################
+    # idle and LRU eviction
+    print("\n\n------ Test: idle and LRU eviction ---------")
+    s = UeContextsMap(dbg=dbg)
+    s.context_idle_expiry_secs = dt.timedelta(seconds=60)
+    for n in range(4):
+        s.hook_du_ue_ctx_creation("du0", n, 101, 400, 20000 + n, 12, 201, now=tnow + dt.timedelta(seconds=n))
+    s.hook_cucp_uemgr_ue_add("cucp0", 0, 101, 400, 20000, now=tnow + dt.timedelta(seconds=10))
+    s.hook_core_amf_info(suci="suci-1", current_guti_plmn="00101", current_guti_amf_id="1", current_guti_m_tmsi=0x100,
+                         now=tnow + dt.timedelta(seconds=10))
+    s.add_tmsi("cucp0", 0, 0x100, now=tnow + dt.timedelta(seconds=10))
+    assert s.amf_contexts[0][0] == 0 and 0 not in s.amf_expiry
+    assert list(s.contexts_activity) == [1, 2, 3, 0]                 # the events of UE 0 at tnow+10s
+    assert s.getuectx(s.getid_by_du_index("du0", 0)) is not None    # activity of UE 0 at tnow+10s
+    assert s.getuectx(s.getid_by_du_index("du0", 2)) is not None    # activity of UE 2 at tnow+10s
+    assert list(s.contexts_activity) == [1, 3, 0, 2]
+    assert s.process_timeout(now=tnow + dt.timedelta(seconds=63)) == 0
+    assert sorted(s.contexts) == [0, 2] and s.get_eviction_counts() == {"idle": 2, "lru": 0}
+    assert s.getid_by_du_index("du0", 1) is None and s.getid_by_pci_rnti(400, 20001) is None
+    s.max_contexts = 1
+    s.process_timeout(now=tnow + dt.timedelta(seconds=64))
+    assert list(s.contexts) == [2] and s.get_eviction_counts() == {"idle": 2, "lru": 1}
+    # the AMF context of the evicted UE is unlinked and will expire as usual
+    assert s.amf_contexts[0][0] is None and 0 in s.amf_expiry
+    # the events of a UE without reports keep it active
+    s2 = UeContextsMap(dbg=dbg)
+    s2.context_idle_expiry_secs = dt.timedelta(seconds=60)
+    s2.hook_du_ue_ctx_creation("du0", 0, 101, 400, 20000, 12, 201, now=tnow)
+    s2.hook_du_ue_ctx_update_crnti("du0", 0, 20001, now=tnow + dt.timedelta(seconds=50))
+    s2.process_timeout(now=tnow + dt.timedelta(seconds=100))
+    assert s2.get_num_contexts() == 1
+    s2.process_timeout(now=tnow + dt.timedelta(seconds=110))
+    assert s2.get_num_contexts() == 0
+    s.process_timeout(now=tnow + dt.timedelta(seconds=71))
+    assert s.get_num_contexts() == 0 and len(s.contexts_activity) == 0 and len(s.contexts_by_du_index) == 0
+    assert s.get_eviction_counts() == {"idle": 3, "lru": 1}
+
+    ###################################
+    # sharded map
+    print("\n\n------ Test: sharded map ---------")
+    m = ShardedUeContextsMap(2, dbg=dbg, fapi_cell_id_to_pci={0: 400, 1: 401},
+                             shard_by_src={"du0": 0, "cucp0": 0, "du1": 1, "cucp1": 1, "cuup1": 1})
+    for n, (du, cucp) in enumerate((("du0", "cucp0"), ("du1", "cucp1"))):
+        m.hook_du_ue_ctx_creation(du, 0, 101, 400 + n, 20000, 12, 201, now=tnow)
+        m.hook_cucp_uemgr_ue_add(cucp, 0, 101, 400 + n, 20000, now=tnow)
+        m.hook_e1_cucp_bearer_context_setup(cucp, 0, 5 + 10 * n, now=tnow)
+        m.hook_ngap_procedure_started(cucp, 0, proc, 7 + n, now=tnow)
+        m.hook_ngap_procedure_completed(cucp, 0, proc, True, 7 + n, 70 + n, now=tnow)
+    assert m.get_num_contexts_per_shard() == [1, 1]
+    ue0 = m.getid_by_du_index("du0", 0)
+    ue1 = m.getid_by_du_index("du1", 0)
+    assert ue0 == 0 and ue1 == 1 << SHARD_ID_SHIFT
+    assert m.getid_by_cucp_index("cucp1", 0) == ue1 and m.getuectx(ue1).ran_unique_ue_id.pci == 401
+    # same rnti in both cells: the cell selects the shard, the rnti alone is ambiguous
+    assert m.getid_by_fapi_cell_rnti(0, 20000) == ue0 and m.getid_by_fapi_cell_rnti(1, 20000) == ue1
+    assert m.getid_by_pci_rnti(None, 20000) is None
+    # cuup0 is not in the shard of cucp0, the bearer is found in the shard of the CU-CP
+    m.hook_e1_cuup_bearer_context_setup("cuup0", 3, 5, 6, True, now=tnow)
+    assert m.get_shard_index("cuup0") == 1
+    assert m.getid_by_cuup_index("cuup0", 3) == ue0 and m.getid_by_cuup_ue_e1ap_id("cuup0", 6) == ue0
+    m.hook_e1_cuup_bearer_context_release("cuup0", 3, 5, 6, True, now=tnow)
+    # the AMF info is kept once, in the store, and linked to whichever shard has the UE
+    amf1 = m.hook_core_amf_info(ran_ue_ngap_id=8, amf_ue_ngap_id=71, suci="suci-1", now=tnow)
+    assert amf1 == ue1 and m.getid_by_core_amf_info(suci="suci-1") == ue1
+    assert m.getuectx(ue1).core_amf_info.suci == "suci-1" and m.getuectx(ue0).core_amf_info is None
+    assert len(m.amf.amf_contexts) == 1 and [len(sh.amf_contexts) for sh in m.shards] == [0, 0]
+    # an AMF info linked later, by the NGAP ids of a UE of a shard
+    m.hook_core_amf_info(ran_ue_ngap_id=9, amf_ue_ngap_id=72, suci="suci-2", now=tnow)
+    m.hook_du_ue_ctx_creation("du1", 1, 101, 401, 20001, 12, 201, now=tnow)
+    m.hook_cucp_uemgr_ue_add("cucp1", 1, 101, 401, 20001, now=tnow)
+    m.hook_ngap_procedure_started("cucp1", 1, proc, 9, now=tnow)
+    ue2 = m.hook_ngap_procedure_completed("cucp1", 1, proc, True, 9, 72, now=tnow)
+    assert m.getuectx(ue2).core_amf_info.suci == "suci-2" and m.getid_by_core_amf_info(suci="suci-2") == ue2
+    assert len(m.amf.amf_contexts) == 2 and [len(sh.amf_contexts) for sh in m.shards] == [0, 0]
+    # the deletion of the UE context unlinks its AMF context, which expires after amf_tmsi_expiry_secs
+    m.hook_du_ue_ctx_deletion("du1", 1, now=tnow)
+    m.hook_cucp_uemgr_ue_remove("cucp1", 1, now=tnow)
+    assert m.getid_by_core_amf_info(suci="suci-2") is None and len(m.amf.amf_expiry.expiries) == 1
+    # and the TMSI links it again, to a UE of another shard
+    m.hook_core_amf_info(suci="suci-2", next_guti_plmn="001F01", next_guti_amf_id="20040", next_guti_m_tmsi=1234, now=tnow)
+    assert m.add_tmsi("cucp0", 0, 1234, now=tnow) == ue0
+    assert m.getuectx(ue0).core_amf_info.suci == "suci-2" and m.getid_by_core_amf_info(suci="suci-2") == ue0
+    assert len(m.amf.amf_expiry.expiries) == 0
+    # the same PCI on DUs of both shards: the lookups by PCI and rnti search both shards
+    m.hook_du_ue_ctx_creation("du0", 1, 101, 402, 20002, 12, 201, now=tnow)
+    m.hook_du_ue_ctx_creation("du1", 2, 101, 402, 20003, 12, 201, now=tnow)
+    assert m.shards_by_pci[402] == (0, 1)
+    assert m.getid_by_pci_rnti(402, 20002) == m.getid_by_du_index("du0", 1)
+    assert m.getid_by_pci_rnti(402, 20003) == m.getid_by_du_index("du1", 2)
+    m.hook_du_ue_ctx_deletion("du0", 1, now=tnow)
+    m.hook_du_ue_ctx_deletion("du1", 2, now=tnow)
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "uectx.snap")
+        m.save_snapshot(path)
+        assert m.snapshot_exists(path) and not s2.snapshot_exists(path)
+        m2 = ShardedUeContextsMap(2, shard_by_src=m.shard_by_src)
+        m2.load_snapshot(path)
+        assert [sh.contexts for sh in m2.shards] == [sh.contexts for sh in m.shards]
+        # the UE contexts are relinked to the AMF contexts of the store
+        assert m2.getuectx(ue1).core_amf_info is m2.amf.amf_contexts[m2.getuectx(ue1).core_amf_context_index][1]
+        assert m2.getid_by_core_amf_info(suci="suci-1") == ue1 and m2.getid_by_core_amf_info(suci="suci-2") == ue0
+        # the shards of each PCI are learnt from the restored contexts
+        assert m2.shards_by_pci == {400: (0,), 401: (1,)} and m2.getid_by_pci_rnti(401, 20000) == ue1
+    m.hook_du_ue_ctx_deletion("du1", 0, now=tnow)
+    m.hook_cucp_uemgr_ue_remove("cucp1", 0, now=tnow)
+    assert m.get_num_contexts_per_shard() == [1, 0]
+    # m.max_contexts is spread over the shards
+    m.max_contexts = 10
+    assert [sh.max_contexts for sh in m.shards] == [5, 5] and m.max_contexts == 10
+    # the shards can be driven from parallel threads
+    m = ShardedUeContextsMap(4, dbg=dbg)
+    def worker(n):
+        for i in range(200):
+            m.hook_du_ue_ctx_creation(f"du{n}", i, 101, 400 + n, i, 12, 201, now=tnow)
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert m.get_num_contexts() == 800
+    assert all(m.getuectx(m.getid_by_du_index(f"du{n}", 199)) is not None for n in range(4))
+    # the AMF contexts are linked while the shards run their hooks, in either order
+    def amf_worker():
+        for i in range(200):
+            m.hook_core_amf_info(ran_ue_ngap_id=i, amf_ue_ngap_id=1000 + i, suci=f"suci-{i}", now=tnow)
+    def ngap_worker(n):
+        for i in range(n, 200, 4):
+            m.hook_cucp_uemgr_ue_add(f"du{n}", i, 101, 400 + n, i, now=tnow)
+            m.hook_ngap_procedure_started(f"du{n}", i, proc, i, now=tnow)
+            m.hook_ngap_procedure_completed(f"du{n}", i, proc, True, i, 1000 + i, now=tnow)
+    threads = [threading.Thread(target=amf_worker)] + [threading.Thread(target=ngap_worker, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(m.amf.amf_contexts) == 200
+    assert all(m.getuectx(m.getid_by_core_amf_info(suci=f"suci-{i}")).core_amf_info.suci == f"suci-{i}" for i in range(200))
+
+    ###################################
+    # concurrent mode: one thread runs the hooks, others do lock-free lookups
+    print("\n\n------ Test: concurrent mode ---------")
+    s = UeContextsMap(dbg=dbg, concurrent=True)
+    assert s.hook_du_ue_ctx_creation.__name__ == "hook_du_ue_ctx_creation" and s.lock is not None
+    errors = []
+    done = threading.Event()
+    def hooks():
+        for i in range(3000):
+            n = i % 50
+            s.hook_du_ue_ctx_creation("du0", n, 101, 400, n % 7, 12, 201, now=tnow)   # rnti collisions
+            s.hook_cucp_uemgr_ue_add("cucp0", n, 101, 400, n % 7, now=tnow)
+            s.hook_du_ue_ctx_update_crnti("du0", n, 100 + i % 3, now=tnow)
+            if i % 3 == 0:
+                s.hook_du_ue_ctx_deletion("du0", n, now=tnow)
+                s.hook_cucp_uemgr_ue_remove("cucp0", n, now=tnow)
+        done.set()
+    def lookups():
+        try:
+            while not done.is_set():
+                for n in range(50):
+                    uectx = s.getuectx(s.getid_by_du_index("du0", n))
+                    if uectx is not None:
+                        uectx.concise_json()
+                    s.getid_by_pci_rnti(400, n % 7)
+                    s.getid_by_fapi_cell_rnti(0, 100 + n % 3)
+        except Exception as e:
+            errors.append(e)
+    old_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    threads = [threading.Thread(target=hooks)] + [threading.Thread(target=lookups) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    sys.setswitchinterval(old_interval)
+    assert errors == []
+    # no cache survived a change made while it was being built
+    for uectx in s.contexts.values():
+        c = uectx.concise_dict()
+        uectx.invalidate()
+        assert c == uectx.concise_dict()
+    # a lookup racing a context_delete() leaves no activity of the deleted context, which the
+    # evictions would spin on, and the snapshots and evictions skip one left in between
+    s = UeContextsMap(dbg=dbg, concurrent=True)
+    s.context_idle_expiry_secs = dt.timedelta(seconds=1)
+    s.max_contexts = 20
+    done.clear()
+    with tempfile.TemporaryDirectory() as d:
+        spath = os.path.join(d, "uectx.snap")
+        def evicting_hooks():
+            for i in range(3000):
+                t = tnow + dt.timedelta(milliseconds=10 * i)
+                s.hook_du_ue_ctx_creation("du0", i, 101, 400, i, 12, 201, now=t)
+                if i % 2 == 0:
+                    s.hook_du_ue_ctx_deletion("du0", i - 1, now=t)
+                if i % 50 == 0:
+                    s.process_timeout(now=t)
+                    s.save_snapshot(spath)
+            done.set()
+        def racing_lookups():
+            try:
+                while not done.is_set():
+                    for ue_id in range(max(0, s.context_id - 30), s.context_id):
+                        s.getuectx(ue_id)
+            except Exception as e:
+                errors.append(e)
+        sys.setswitchinterval(1e-6)
+        threads = [threading.Thread(target=evicting_hooks)] + [threading.Thread(target=racing_lookups) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        sys.setswitchinterval(old_interval)
+        assert errors == []
+        assert set(s.contexts_activity) == set(s.contexts)
+        # an orphan, as left between the write and the check of a lookup
+        s.contexts_activity[10**6] = tnow
+        s.contexts_activity.move_to_end(10**6, last=False)
+        s.save_snapshot(spath)
+        s.max_contexts = 0
+        s.process_timeout(now=tnow)
+        assert len(s.contexts) == 0 and len(s.contexts_activity) == 0
+
+    ###################################
+    # journal and replay
+    print("\n\n------ Test: journal and replay ---------")
+    def attach_hooks(m, du, cucp, n, t):
+        m.hook_du_ue_ctx_creation(du, n, 101, 400, 20000 + n, 12, 201, now=t)
+        m.hook_cucp_uemgr_ue_add(cucp, n, 101, 400, 20000 + n, now=t)
+        m.hook_e1_cucp_bearer_context_setup(cucp, n, 5 + n, now=t)
+        m.hook_ngap_procedure_started(cucp, n, proc, 7 + n, now=t)
+        m.hook_ngap_procedure_completed(cucp, n, proc, True, 7 + n, 70 + n, now=t)
+        m.hook_core_amf_info(ran_ue_ngap_id=7 + n, amf_ue_ngap_id=70 + n, suci=f"suci-{n}",
+                             current_guti_plmn="00101", current_guti_amf_id="1", current_guti_m_tmsi=0x100 + n, now=t)
+    def same_maps(a, b):
+        return a.contexts == b.contexts and a.amf_contexts == b.amf_contexts and \
+               a.contexts_by_ngap_ue_ids == b.contexts_by_ngap_ue_ids and a.amf_contexts_by_suci == b.amf_contexts_by_suci and \
+               a.context_id == b.context_id and a.amf_context_id == b.amf_context_id
+    with tempfile.TemporaryDirectory() as d:
+        jpath = os.path.join(d, "uectx.jnl")
+        spath = os.path.join(d, "uectx.snap")
+        s = UeContextsMap(dbg=dbg, concurrent=True)
+        s.start_journal(jpath)
+        s.set_fapi_cell_pci(0, 400)
+        for n in range(3):
+            attach_hooks(s, "du0", "cucp0", n, tnow + dt.timedelta(seconds=n))
+        s.apply_events([DuUeCtxDeletionEvent("du0", 0), CucpUeRemoveEvent("cucp0", 0)], now=tnow + dt.timedelta(seconds=5))
+        s.process_timeout(now=tnow + dt.timedelta(seconds=6))
+        # one record per top-level call, the hooks called by other hooks are not journaled
+        assert s.journal_seq == 1 + 3 * 6 + 2 + 1
+        # replay from scratch
+        s2 = UeContextsMap(dbg=dbg)
+        assert s2.replay_journal(jpath) == s.journal_seq and s2.journal_seq == s.journal_seq
+        assert same_maps(s, s2) and s2.fapi_cell_id_to_pci == {0: 400}
+        assert s2.amf_contexts[0][2] == tnow + dt.timedelta(seconds=5)    # the original times are used
+        # the snapshot rotates the journal, recovery is the snapshot plus the newer records
+        s.save_snapshot(spath)
+        assert os.path.getsize(jpath) == JOURNAL_HEADER.size
+        attach_hooks(s, "du0", "cucp0", 3, tnow + dt.timedelta(seconds=7))
+        s.hook_du_ue_ctx_update_crnti("du0", 3, 30000, now=tnow + dt.timedelta(seconds=8))
+        s.process_timeout(now=tnow + dt.timedelta(seconds=9))
+        s3 = UeContextsMap(dbg=dbg)
+        s3.load_snapshot(spath)
+        assert s3.replay_journal(jpath) == 8 and same_maps(s, s3)
+        # replaying again skips the records already applied
+        assert s3.replay_journal(jpath) == 0
+        # a record cut by a crash is ignored
+        s.stop_journal()
+        with open(jpath, "r+b") as f:
+            f.truncate(os.path.getsize(jpath) - 3)
+        s4 = UeContextsMap(dbg=dbg)
+        s4.load_snapshot(spath)
+        assert s4.replay_journal(jpath) == 7 and s4.journal_seq == s.journal_seq - 1
+        # restarting the journal drops the cut record
+        s4.start_journal(jpath)
+        s4.process_timeout(now=tnow + dt.timedelta(seconds=10))
+        s4.stop_journal()
+        s5 = UeContextsMap(dbg=dbg)
+        s5.load_snapshot(spath)
+        assert s5.replay_journal(jpath) == 8 and same_maps(s4, s5)
+        assert "hook_du_ue_ctx_creation" in vars(s)       # still wrapped for the lock only
+        s = UeContextsMap(dbg=dbg)
+        s.start_journal(jpath)
+        s.stop_journal()
+        assert "hook_du_ue_ctx_creation" not in vars(s)
+        # the hook calls made while a snapshot is written, after the copy of its rows, stay in the journal
+        s = UeContextsMap(dbg=dbg, concurrent=True)
+        s.start_journal(jpath + "w")
+        attach_hooks(s, "du0", "cucp0", 0, tnow)
+        rows, journal_offset = s.snapshot_rows()
+        attach_hooks(s, "du0", "cucp0", 1, tnow)
+        _write_snapshot(spath, rows)
+        s.snapshot_written(journal_offset)
+        s.process_timeout(now=tnow)
+        s.stop_journal()
+        s6 = UeContextsMap(dbg=dbg)
+        s6.load_snapshot(spath)
+        assert s6.replay_journal(jpath + "w") == 6 + 1 and same_maps(s, s6)
+        # sharded map: one journal per shard, and one for the AMF store
+        m = ShardedUeContextsMap(2, dbg=dbg, shard_by_src={"du0": 0, "cucp0": 0, "du1": 1, "cucp1": 1})
+        m.start_journal(jpath + "s")
+        attach_hooks(m, "du0", "cucp0", 0, tnow)
+        attach_hooks(m, "du1", "cucp1", 1, tnow)
+        m.hook_du_ue_ctx_deletion("du1", 1, now=tnow)
+        m.hook_cucp_uemgr_ue_remove("cucp1", 1, now=tnow)
+        m.stop_journal()
+        m2 = ShardedUeContextsMap(2, dbg=dbg, shard_by_src=m.shard_by_src)
+        # the store journals its hooks, the links it made and the unlink of the deleted UE context
+        assert m2.replay_journal(jpath + "s") == 2 * 5 + 2 + 2 * 2 + 1
+        assert all(same_maps(a, b) for a, b in zip(m.shards, m2.shards)) and same_maps(m.amf, m2.amf)
+        assert m2.amf.amf_contexts[0][0] == 0 and m2.amf.amf_contexts[1][0] is None
+        assert m2.getuectx(0).core_amf_info is m2.amf.amf_contexts[0][1]
+        # the evictions are replayed from the journal, as the lookups keeping a UE active are not journaled
+        s = UeContextsMap(dbg=dbg)
+        s.context_idle_expiry_secs = dt.timedelta(seconds=10)
+        s.start_journal(jpath + "e")
+        for n in range(2):
+            s.hook_du_ue_ctx_creation("du0", n, 101, 400, 20000 + n, 12, 201, now=tnow)
+        s.process_timeout(now=tnow + dt.timedelta(seconds=8))
+        assert s.getuectx(1) is not None                            # activity of UE 1 at tnow+8s
+        s.process_timeout(now=tnow + dt.timedelta(seconds=12))
+        s.stop_journal()
+        assert list(s.contexts) == [1]
+        s2 = UeContextsMap(dbg=dbg)
+        s2.context_idle_expiry_secs = s.context_idle_expiry_secs
+        assert s2.replay_journal(jpath + "e") == 2 + 2 + 1
+        assert same_maps(s, s2) and s2.get_eviction_counts() == s.get_eviction_counts() == {"idle": 1, "lru": 0}
+
+    ###################################
+    # change notifications
+    print("\n\n------ Test: change notifications ---------")
+    s = UeContextsMap(dbg=dbg)
+    view = {}              # materialized view of the contexts, kept from the changes only
+    kinds = []
+    def on_change(c):
+        kinds.append((c.kind, c.ue_id))
+        if c.kind == UeContextChangeKind.DELETED:
+            view.pop(c.ue_id)
+        else:
+            view.setdefault(c.ue_id, {}).update({f: getattr(s.contexts[c.ue_id], f) for f in c.fields})
+    batches = []
+    s.subscribe(on_change)
+    s.subscribe(batches.append, coalesce=True)
+    for n in range(3):
+        attach_hooks(s, "du0", "cucp0", n, tnow)
+    assert (UeContextChangeKind.AMF_ASSOCIATED, 2) in kinds
+    for ue_id, uectx in s.contexts.items():
+        assert {k: v for k, v in view[ue_id].items() if v not in (None, {})} == \
+               {f.name: getattr(uectx, f.name) for f in fields(uectx) if getattr(uectx, f.name) not in (None, {})}
+    # the changes of the tick are coalesced, one per context
+    s.process_timeout(now=tnow)
+    assert len(batches) == 1 and sorted(c.ue_id for c in batches[0]) == [0, 1, 2]
+    assert all(c.kind == UeContextChangeKind.CREATED and "core_amf_info" in c.fields for c in batches[0])
+    s.hook_du_ue_ctx_update_crnti("du0", 1, 31000, now=tnow)
+    s.hook_du_ue_ctx_creation("du0", 9, 101, 400, 29000, 12, 201, now=tnow)
+    s.hook_du_ue_ctx_deletion("du0", 9, now=tnow)       # created and deleted within the tick
+    s.hook_du_ue_ctx_deletion("du0", 0, now=tnow)
+    s.hook_cucp_uemgr_ue_remove("cucp0", 0, now=tnow)
+    s.process_timeout(now=tnow)
+    assert {c.ue_id: (c.kind, c.fields) for c in batches[1]} == {
+        1: (UeContextChangeKind.UPDATED, frozenset({"ran_unique_ue_id"})),
+        0: (UeContextChangeKind.DELETED, frozenset())}
+    assert 0 not in view and view[1]["ran_unique_ue_id"].crnti == 31000
+    # nothing changed, nothing reported
+    s.process_timeout(now=tnow)
+    assert len(batches) == 2
+    s.unsubscribe(on_change)
+    s.unsubscribe(batches.append)
+    assert not s.observed
+    s.hook_du_ue_ctx_deletion("du0", 1, now=tnow)
+    assert 1 in view
+    # sharded map: one batch per tick for all the shards
+    m = ShardedUeContextsMap(2, dbg=dbg, shard_by_src={"du0": 0, "cucp0": 0, "du1": 1, "cucp1": 1})
+    batches = []
+    m.subscribe(batches.append, coalesce=True)
+    attach_hooks(m, "du0", "cucp0", 0, tnow)
+    attach_hooks(m, "du1", "cucp1", 1, tnow)
+    m.process_timeout(now=tnow)
+    assert len(batches) == 1 and sorted(c.ue_id for c in batches[0]) == [0, 1 << SHARD_ID_SHIFT]
+    m.unsubscribe(batches.append)
+    assert not any(shard.observed for shard in m.shards)
+
+    ###################################
+    # E1AP bearer lookups without the src of the CU-CP
+    print("\n\n------ Test: E1AP lookups without src ---------")
+    s = UeContextsMap(dbg=dbg)
+    for n, cucp in enumerate(["cucp0", "cucp1"]):
+        s.hook_du_ue_ctx_creation(f"du{n}", 0, 101, 400 + n, 20000, 12, 201, now=tnow)
+        s.hook_cucp_uemgr_ue_add(cucp, 0, 101, 400 + n, 20000, now=tnow)
+        s.hook_e1_cucp_bearer_context_setup(cucp, 0, 5, now=tnow)      # same id in both CU-CPs
+        s.hook_e1_cucp_bearer_context_setup(cucp, 0, 6 + n, now=tnow)
+    assert s.getids_by_cucp_ue_e1ap_id_NoSrcCheck(5) == [("cucp0", 0), ("cucp1", 1)]
+    assert s.getids_by_cucp_ue_e1ap_id_NoSrcCheck(7) == [("cucp1", 1)] and s.getids_by_cucp_ue_e1ap_id_NoSrcCheck(9) == []
+    assert s.get_e1_bearer_NoSrcCheck(7) == (1, (("cucp1", 7), None)) and s.num_ambiguous_e1ap_lookups == 0
+    assert s.getid_by_cucp_ue_e1ap_id_NoSrcCheck(5) == 0 and s.num_ambiguous_e1ap_lookups == 1
+    s.hook_e1_cuup_bearer_context_setup("cuup0", 0, 7, 70, True, now=tnow)
+    assert s.getuectx(1).e1_bearers == {("cucp1", 5): None, ("cucp1", 7): ("cuup0", 70)}
+    assert s.getuectx(1).concise_dict()["e1_bearers"] == [(("cucp1", 5), None), (("cucp1", 7), ("cuup0", 70))]
+    # the index follows the releases and the deletes
+    s.hook_e1_cuup_bearer_context_release("cuup0", 0, 7, 70, True, now=tnow)
+    assert s.getids_by_cucp_ue_e1ap_id_NoSrcCheck(7) == [] and s.getid_by_cuup_ue_e1ap_id("cuup0", 70) is None
+    s.hook_du_ue_ctx_deletion("du0", 0, now=tnow)
+    s.hook_cucp_uemgr_ue_remove("cucp0", 0, now=tnow)
+    assert s.getids_by_cucp_ue_e1ap_id_NoSrcCheck(5) == [("cucp1", 1)] and s.getid_by_cucp_ue_e1ap_id("cucp0", 6) is None
+    assert s.contexts_by_bare_cucp_ue_e1ap_id == {5: ("cucp1", 1)}
+
+    ###################################
+    # per source membership
+    print("\n\n------ Test: per source membership ---------")
+    def members_ok(m):
+        for role in ("du", "cucp", "cuup"):
+            brute = {}
+            for ue_id, uectx in m.contexts.items():
+                index = getattr(uectx, f"{role}_index")
+                if index is not None:
+                    brute.setdefault(index.src, set()).add(ue_id)
+            if getattr(m, f"contexts_by_{role}_src") != brute:
+                return False
+        return True
+    s = UeContextsMap(dbg=dbg)
+    for n in range(6):
+        attach_hooks(s, f"du{n % 2}", f"cucp{n % 2}", n, tnow)
+        s.hook_e1_cuup_bearer_context_setup(f"cuup{n % 3}", n, 5 + n, 50 + n, True, now=tnow)
+    assert members_ok(s)
+    assert s.get_num_contexts_per_src() == {"du": {"du0": 3, "du1": 3}, "cucp": {"cucp0": 3, "cucp1": 3},
+                                            "cuup": {"cuup0": 2, "cuup1": 2, "cuup2": 2}}
+    assert s.reset_ngap_for_source("cucp1", now=tnow) == 3
+    assert [s.contexts[ue_id].ngap_ids is None for ue_id in range(6)] == [False, True] * 3
+    s.hook_ngap_reset("cucp0", now=tnow)
+    assert all(uectx.ngap_ids is None for uectx in s.contexts.values()) and members_ok(s)
+    # the CU-UP goes away: its bearers are released, the contexts stay with their DU and CU-CP
+    assert s.purge_source("cuup0", now=tnow) == 0
+    assert s.contexts[0].cuup_index is None and s.contexts[0].e1_bearers == {} and members_ok(s)
+    assert s.getid_by_cuup_ue_e1ap_id("cuup0", 50) is None and "cuup0" not in s.get_num_contexts_per_src()["cuup"]
+    # the DU goes away, then its CU-CP: only the contexts without a bearer on a CU-UP are deleted
+    assert s.purge_source("du0", now=tnow) == 0 and members_ok(s)
+    assert s.purge_source("cucp0", now=tnow) == 1 and sorted(s.contexts) == [1, 2, 3, 4, 5] and members_ok(s)
+    assert s.getid_by_du_index("du0", 2) is None and s.getid_by_cucp_index("cucp0", 2) is None
+    assert s.getid_by_cucp_ue_e1ap_id_NoSrcCheck(7) == 2
+    # the membership is rebuilt by a snapshot restore
+    with tempfile.TemporaryDirectory() as d:
+        s.save_snapshot(os.path.join(d, "uectx.snap"))
+        s2 = UeContextsMap(dbg=dbg)
+        s2.load_snapshot(os.path.join(d, "uectx.snap"))
+        assert s2.contexts_by_du_src == s.contexts_by_du_src and s2.contexts_by_cuup_src == s.contexts_by_cuup_src
+    # sharded map
+    m = ShardedUeContextsMap(2, dbg=dbg, shard_by_src={"du0": 0, "cucp0": 0, "du1": 1, "cucp1": 1, "cuup0": 1})
+    for n in range(4):
+        attach_hooks(m, f"du{n % 2}", f"cucp{n % 2}", n, tnow)
+        m.hook_e1_cuup_bearer_context_setup("cuup0", n, 5 + n, 50 + n, True, now=tnow)
+    assert m.get_num_contexts_per_src()["cuup"] == {"cuup0": 4}
+    assert m.reset_ngap_for_source("cucp0", now=tnow) == 2
+    m.purge_source("cuup0", now=tnow)
+    assert m.get_num_contexts_per_src()["cuup"] == {} and all(members_ok(shard) for shard in m.shards)
+
+    ###################################
+    # trace
+    print("\n\n------ Test: trace ---------")
+    s = UeContextsMap(dbg=dbg, concurrent=True)
+    assert s.dump_trace() is None
+    s.start_trace(size=4, ue_size=3, max_deleted=1)
+    s.hook_du_ue_ctx_creation("du0", 0, 101, 1, 1000, 12, 201, now=tnow)
+    s.hook_cucp_uemgr_ue_add("cucp0", 0, 101, 1, 1000, now=tnow)
+    s.hook_du_ue_ctx_creation("du0", 1, 101, 1, 1001, 12, 201, now=tnow)
+    s.process_timeout(now=tnow)
+    calls = s.dump_trace()["calls"]
+    assert [c["hook"] for c in calls] == ["hook_du_ue_ctx_creation", "hook_cucp_uemgr_ue_add", "hook_du_ue_ctx_creation"]
+    assert calls[1]["args"] == ["cucp0", 0, 101, 1, 1000] and calls[1]["kwargs"] == {}
+    d = s.dump_trace(0)
+    assert d["ueid"] == 0 and not d["deleted"]
+    assert [(c["hook"], c["change"]) for c in d["changes"]] == [("hook_du_ue_ctx_creation", "CREATED"),
+                                                               ("hook_cucp_uemgr_ue_add", "UPDATED")]
+    assert d["changes"][0]["fields"] == ["du_index", "nci", "ran_unique_ue_id", "tac"] and d["changes"][1]["fields"] == ["cucp_index"]
+    json.dumps(s.dump_trace()), json.dumps(d)
+    # the rings wrap
+    for n in range(2, 6):
+        s.hook_du_ue_ctx_creation("du0", n, 101, 1, 1000 + n, 12, 201, now=tnow)
+    assert [c["args"][1] for c in s.dump_trace()["calls"]] == [2, 3, 4, 5]
+    s.hook_du_ue_ctx_update_crnti("du0", 0, 1010, now=tnow)
+    assert len(s.dump_trace(0)["changes"]) == 3 and s.dump_trace(0)["changes"][-1]["fields"] == ["ran_unique_ue_id"]
+    # the rings of the deleted contexts are kept, up to max_deleted
+    s.hook_du_ue_ctx_deletion("du0", 1, now=tnow)
+    assert s.dump_trace(1)["deleted"] and s.dump_trace(1)["changes"][-1]["change"] == "DELETED"
+    s.hook_du_ue_ctx_deletion("du0", 2, now=tnow)
+    assert s.dump_trace(1)["changes"] == [] and s.dump_trace(2)["deleted"]
+    # an eviction is reported with the timeout
+    s.max_contexts = 3
+    s.process_timeout(now=tnow)
+    evicted = [ue_id for ue_id in s.trace.deleted]
+    assert len(evicted) == 1 and s.dump_trace(evicted[0])["changes"][-1]["hook"] == "process_timeout"
+    s.stop_trace()
+    assert s.dump_trace() is None and s.observed is False
+    # in concurrent mode, starting a trace waits for the hook running in another thread, as it rewraps the hooks
+    assert all(name in vars(s) for name in ("start_trace", "stop_trace", "dump_trace"))     # wrapped for the lock
+    s.lock.acquire()
+    t = threading.Thread(target=s.start_trace)
+    t.start()
+    t.join(0.1)
+    assert t.is_alive() and s.trace is None
+    s.lock.release()
+    t.join()
+    assert s.trace is not None
+    s.stop_trace()
+    # sharded map
+    m = ShardedUeContextsMap(2, dbg=dbg, shard_by_src={"du0": 0, "du1": 1})
+    m.start_trace()
+    m.hook_du_ue_ctx_creation("du1", 0, 101, 1, 1000, 12, 201, now=tnow)
+    m.hook_du_ue_ctx_creation("du0", 0, 101, 2, 1000, 12, 202, now=tnow)
+    assert [c["args"][0] for c in m.dump_trace()["calls"]] == ["du1", "du0"]
+    assert m.dump_trace(1 << SHARD_ID_SHIFT)["changes"][0]["change"] == "CREATED"
+
+    ###################################
+    # rrc ue update context
+    print("\n\n------ Test: rrc ue update context ---------")
+    s = UeContextsMap(dbg=dbg)
+    changes = []
+    s.subscribe(changes.append)
+    attach_hooks(s, "du0", "cucp0", 0, tnow)
+    attach_hooks(s, "du0", "cucp0", 1, tnow)
+    # the UE re-establishes on a new cell: new DU UE and CU-CP UE, then the RRC context is transferred
+    s.hook_du_ue_ctx_creation("du0", 5, 101, 401, 30000, 13, 202, now=tnow)
+    s.hook_cucp_uemgr_ue_add("cucp0", 5, 101, 401, 30000, now=tnow)
+    s.add_tmsi("cucp0", 0, 0x100, now=tnow)
+    new_id = s.getid_by_cucp_index("cucp0", 5)
+    assert new_id not in (0, 1) and s.get_num_contexts() == 3
+    changes.clear()
+    s.hook_rrc_ue_update_context("cucp0", 0, 5, 101, 401, 30000, tac=13, nci=202, now=tnow)
+    assert s.get_num_contexts() == 2 and new_id not in s.contexts
+    assert s.getid_by_cucp_index("cucp0", 5) == 0 and s.getid_by_cucp_index("cucp0", 0) is None
+    assert s.getid_by_du_index("du0", 5) == 0 and s.getid_by_du_index("du0", 0) is None
+    assert s.getid_by_pci_rnti(401, 30000) == 0 and s.getid_by_pci_rnti(400, 20000) is None
+    ue = s.getue_by_id(0)
+    assert ue.nci == 202 and ue.tac == 13 and ue.ngap_ids is not None and ue.tmsi == 0x100
+    assert s.getid_by_tmsi(0x100) == 0 and s.getid_by_ngap_ue_ids(7, 70) == 0 and s.getid_by_cucp_ue_e1ap_id("cucp0", 5) == 0
+    assert (UeContextChangeKind.DELETED, new_id) in [(c.kind, c.ue_id) for c in changes]
+    assert set(f for c in changes if c.ue_id == 0 for f in c.fields) == {"du_index", "cucp_index", "ran_unique_ue_id", "nci", "tac"}
+    # the old DU and CU-CP UEs go away later, without touching the re-keyed context
+    s.hook_du_ue_ctx_deletion("du0", 0, now=tnow)
+    s.hook_cucp_uemgr_ue_remove("cucp0", 0, now=tnow)
+    assert s.getue_by_id(0).du_index == UniqueIndex("du0", 5) and s.getue_by_id(0).cucp_index == UniqueIndex("cucp0", 5)
+    # unknown old CU-CP UE
+    s.hook_rrc_ue_update_context("cucp0", 9, 10, 101, 401, 30001, now=tnow)
+    assert s.get_num_contexts() == 2 and s.getid_by_cucp_index("cucp0", 10) is None
+    # journaled and replayed like the other hooks
+    with tempfile.TemporaryDirectory() as d:
+        jpath = os.path.join(d, "uectx.jnl")
+        s = UeContextsMap(dbg=dbg)
+        s.start_journal(jpath)
+        attach_hooks(s, "du0", "cucp0", 0, tnow)
+        s.hook_du_ue_ctx_creation("du0", 5, 101, 401, 30000, 13, 202, now=tnow)
+        s.hook_cucp_uemgr_ue_add("cucp0", 5, 101, 401, 30000, now=tnow)
+        s.hook_rrc_ue_update_context("cucp0", 0, 5, 101, 401, 30000, now=tnow)
+        s.stop_journal()
+        s2 = UeContextsMap(dbg=dbg)
+        s2.replay_journal(jpath)
+        assert same_maps(s, s2)
+    # sharded map
+    m = ShardedUeContextsMap(2, dbg=dbg, shard_by_src={"du0": 1, "cucp0": 1})
+    attach_hooks(m, "du0", "cucp0", 0, tnow)
+    m.hook_du_ue_ctx_creation("du0", 5, 101, 401, 30000, 13, 202, now=tnow)
+    m.hook_cucp_uemgr_ue_add("cucp0", 5, 101, 401, 30000, now=tnow)
+    m.hook_rrc_ue_update_context("cucp0", 0, 5, 101, 401, 30000, now=tnow)
+    assert m.get_num_contexts() == 1 and m.getid_by_cucp_index("cucp0", 5) == 1 << SHARD_ID_SHIFT
+
+    ###################################
+    # tombstones
+    print("\n\n------ Test: tombstones ---------")
+    s = UeContextsMap(dbg=dbg)
+    attach_hooks(s, "du0", "cucp0", 0, tnow)
+    s.hook_e1_cuup_bearer_context_setup("cuup0", 0, 5, 50, True, now=tnow)
+    s.hook_du_ue_ctx_deletion("du0", 0, now=tnow)
+    # disabled by default
+    assert s.getid_by_du_index("du0", 0, tombstone=True) is None and len(s.tombstones) == 0
+    s.tombstone_expiry_secs = dt.timedelta(seconds=5)
+    attach_hooks(s, "du0", "cucp0", 1, tnow)
+    s.hook_e1_cuup_bearer_context_setup("cuup0", 1, 6, 51, True, now=tnow)
+    ue = s.getuectx(1)
+    # the DU UE goes away first: the reports of the DU still find the context, which is alive
+    s.hook_du_ue_ctx_deletion("du0", 1, now=tnow)
+    assert s.getid_by_du_index("du0", 1) is None and s.getid_by_du_index("du0", 1, tombstone=True) == 1
+    assert s.getuectx(1) is ue and s.num_tombstone_hits == 1
+    # then the CU-CP and CU-UP UEs: the context is deleted and still found
+    s.hook_e1_cuup_bearer_context_release("cuup0", 1, 6, 51, True, now=tnow)
+    s.hook_cucp_uemgr_ue_remove("cucp0", 1, now=tnow)
+    assert s.getue_by_id(1) is None and 1 not in s.contexts
+    assert s.getid_by_cucp_index("cucp0", 1, tombstone=True) == 1 and s.getid_by_cuup_index("cuup0", 1, tombstone=True) == 1
+    assert s.getid_by_pci_rnti(400, 20001, tombstone=True) == 1 and s.getid_by_pci_rnti(400, 20001) is None
+    assert s.getuectx(1) is ue and s.getuectx(1).ran_unique_ue_id.crnti == 20001
+    # a live context holding the key wins over the tombstone
+    s.hook_du_ue_ctx_creation("du0", 1, 101, 400, 20009, 12, 201, now=tnow)
+    assert s.getid_by_du_index("du0", 1, tombstone=True) == s.getid_by_du_index("du0", 1) != 1
+    # the hooks do not see the tombstones
+    s.hook_du_ue_ctx_deletion("du0", 1, now=tnow)
+    s.hook_du_ue_ctx_deletion("du0", 1, now=tnow)
+    assert s.getid_by_du_index("du0", 1, tombstone=True) not in (None, 1)
+    # evicted by age
+    s.process_timeout(now=tnow + dt.timedelta(seconds=4))
+    assert s.getid_by_cucp_index("cucp0", 1, tombstone=True) == 1
+    s.process_timeout(now=tnow + dt.timedelta(seconds=6))
+    assert len(s.tombstones) == 0 and len(s.tombstone_contexts) == 0
+    assert s.getid_by_cucp_index("cucp0", 1, tombstone=True) is None and s.getuectx(1) is None
+    # and by number
+    s.max_tombstones = 3
+    for n in range(2, 5):
+        attach_hooks(s, "du0", "cucp0", n, tnow)
+        s.hook_du_ue_ctx_deletion("du0", n, now=tnow)
+    assert len(s.tombstones) == 3 and [key[0] for key in s.tombstones] == ["du"] * 3
+    assert s.getid_by_du_index("du0", 1, tombstone=True) is None
+    assert [s.unpack_key(key[1]) for key in s.tombstones] == [("du0", 2), ("du0", 3), ("du0", 4)]
+    assert s.getid_by_du_index("du0", 4, tombstone=True) == s.getid_by_cucp_index("cucp0", 4)
+    # disabled again
+    s.tombstone_expiry_secs = None
+    s.process_timeout(now=tnow)
+    assert len(s.tombstones) == 0
+    # sharded map
+    m = ShardedUeContextsMap(2, dbg=dbg, shard_by_src={"du0": 1, "cucp0": 1, "cuup0": 1})
+    m.tombstone_expiry_secs = dt.timedelta(seconds=5)
+    attach_hooks(m, "du0", "cucp0", 0, tnow)
+    m.hook_du_ue_ctx_deletion("du0", 0, now=tnow)
+    m.hook_cucp_uemgr_ue_remove("cucp0", 0, now=tnow)
+    ue_id = 1 << SHARD_ID_SHIFT
+    assert m.get_num_contexts() == 0 and m.getid_by_du_index("du0", 0, tombstone=True) == ue_id
+    assert m.getid_by_pci_rnti(400, 20000, tombstone=True) == ue_id and m.getuectx(ue_id) is not None
+    assert m.num_tombstone_hits == 2
+    m.process_timeout(now=tnow + dt.timedelta(seconds=6))
+    assert m.getid_by_cucp_index("cucp0", 0, tombstone=True) is None
+
     print("\n\n------ All tests passed ---------")
 
     sys.exit(0)
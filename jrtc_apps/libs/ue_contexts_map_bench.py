@@ -0,0 +1,694 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+#
+# Benchmarks for UeContextsMap.
+#
+# Usage:
+#     python3 ue_contexts_map_bench.py [--sizes 100,1000,10000,50000] [--attaches 1000]
+#     python3 ue_contexts_map_bench.py --fixture uectx.snap --fixture-size 100000
+#     python3 ue_contexts_map_bench.py --churn 1000,10000,100000 [--dus 4] [--cucps 2] [--cycles 5000] [--json out.json]
+#
+# --fixture writes a snapshot of a populated map, to be restored with
+# UeContextsMap.load_snapshot() by load tests instead of replaying the attaches.
+#
+
+import os
+import gc
+import sys
+import time
+import json
+import tempfile
+import tracemalloc
+import argparse
+import threading
+import datetime as dt
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ue_contexts_map import UeContextsMap, ShardedUeContextsMap, UeCtxJson, JbpfNgapProcedure, \
+                            DuUeCtxCreationEvent, CucpUeAddEvent, DuUeCtxDeletionEvent, CucpUeRemoveEvent
+import ue_contexts_columns
+
+
+PLMN = 101
+TAC = 12
+NCI = 201
+
+
+##########################################################################
+def attach(s: UeContextsMap, n: int, now: dt.datetime) -> None:
+    # DU add followed by CU-CP add, which resolves the UE by (plmn, pci, crnti)
+    pci = 400 + (n >> 16)
+    crnti = n & 0xffff
+    s.hook_du_ue_ctx_creation("du0", n, PLMN, pci, crnti, TAC, NCI, now=now)
+    s.hook_cucp_uemgr_ue_add("cucp0", n, PLMN, pci, crnti, now=now)
+
+
+##########################################################################
+def detach(s: UeContextsMap, n: int, now: dt.datetime) -> None:
+    s.hook_du_ue_ctx_deletion("du0", n, now=now)
+    s.hook_cucp_uemgr_ue_remove("cucp0", n, now=now)
+
+
+##########################################################################
+def bench_attach(num_contexts: int, num_attaches: int) -> float:
+    """
+    Populate the map with num_contexts UEs, then measure the average cost of
+    attaching (and detaching again) num_attaches further UEs.
+    :return: average attach+detach cost in microseconds.
+    """
+    now = dt.datetime.now(dt.UTC)
+    s = UeContextsMap(dbg=False)
+    for n in range(num_contexts):
+        attach(s, n, now)
+    assert s.get_num_contexts() == num_contexts
+
+    start = time.perf_counter()
+    for n in range(num_contexts, num_contexts + num_attaches):
+        attach(s, n, now)
+        detach(s, n, now)
+    elapsed = time.perf_counter() - start
+
+    assert s.get_num_contexts() == num_contexts
+    return (elapsed / num_attaches) * 1e6
+
+
+##########################################################################
+def bench_fapi_report(num_contexts: int, num_reports: int, ues_per_report: int = 64) -> float:
+    """
+    Measure the cost of resolving the UEs of a FAPI report by (cell_id, rnti).
+    :return: average cost per report in microseconds.
+    """
+    now = dt.datetime.now(dt.UTC)
+    s = UeContextsMap(dbg=False)
+    num_cells = (num_contexts >> 16) + 1
+    for cell_id in range(num_cells):
+        s.set_fapi_cell_pci(cell_id, 400 + cell_id)
+    for n in range(num_contexts):
+        attach(s, n, now)
+
+    report = [((n >> 16), n & 0xffff) for n in range(min(ues_per_report, num_contexts))]
+    start = time.perf_counter()
+    for _ in range(num_reports):
+        for cell_id, rnti in report:
+            s.getuectx(s.getid_by_fapi_cell_rnti(cell_id, rnti))
+    elapsed = time.perf_counter() - start
+    return (elapsed / num_reports) * 1e6
+
+
+##########################################################################
+def bench_ngap(num_contexts: int, num_events: int) -> float:
+    """
+    Measure the cost of an NGAP procedure started/completed pair for UEs in a
+    map holding num_contexts UEs.
+    :return: average cost per started/completed pair in microseconds.
+    """
+    now = dt.datetime.now(dt.UTC)
+    s = UeContextsMap(dbg=False)
+    for n in range(num_contexts):
+        attach(s, n, now)
+
+    proc = JbpfNgapProcedure.NGAP_PROCEDURE_PDU_SESSION_SETUP
+    start = time.perf_counter()
+    for i in range(num_events):
+        n = i % num_contexts
+        s.hook_ngap_procedure_started("cucp0", n, proc, n, now=now)
+        s.hook_ngap_procedure_completed("cucp0", n, proc, True, n, n + 1000000, now=now)
+    elapsed = time.perf_counter() - start
+    return (elapsed / num_events) * 1e6
+
+
+##########################################################################
+def bench_core_amf_info(num_amf_contexts: int, num_events: int) -> float:
+    """
+    Measure the cost of a core AMF info update followed by a TMSI association
+    for a map holding num_amf_contexts AMF contexts.
+    :return: average cost per update+association in microseconds.
+    """
+    now = dt.datetime.now(dt.UTC)
+    s = UeContextsMap(dbg=False)
+    for n in range(num_amf_contexts):
+        s.hook_core_amf_info(suci=f"suci-{n}", supi=f"imsi-{n}",
+                             current_guti_plmn="00101", current_guti_amf_id="1", current_guti_m_tmsi=n, now=now)
+    assert len(s.amf_contexts) == num_amf_contexts
+    attach(s, 0, now)
+
+    start = time.perf_counter()
+    for i in range(num_events):
+        n = i % num_amf_contexts
+        s.hook_core_amf_info(suci=f"suci-{n}", supi=f"imsi-{n}",
+                             current_guti_plmn="00101", current_guti_amf_id="1", current_guti_m_tmsi=n, now=now)
+        s.add_tmsi("cucp0", 0, n, now=now)
+    elapsed = time.perf_counter() - start
+    return (elapsed / num_events) * 1e6
+
+
+##########################################################################
+def bench_timeout_tick(num_amf_contexts: int, num_ticks: int) -> float:
+    """
+    Measure the cost of a process_timeout() tick when num_amf_contexts unlinked
+    AMF contexts are pending expiry but none of them is due yet.
+    :return: average cost per tick in microseconds.
+    """
+    now = dt.datetime.now(dt.UTC)
+    s = UeContextsMap(dbg=False)
+    for n in range(num_amf_contexts):
+        s.hook_core_amf_info(suci=f"suci-{n}", current_guti_plmn="00101", current_guti_amf_id="1", current_guti_m_tmsi=n, now=now)
+        s.amf_context_set(n, None, s.amf_contexts[n][1], now)
+
+    start = time.perf_counter()
+    for i in range(num_ticks):
+        s.process_timeout(now=now + dt.timedelta(seconds=i))
+    elapsed = time.perf_counter() - start
+    assert len(s.amf_contexts) == num_amf_contexts
+    return (elapsed / num_ticks) * 1e6
+
+
+##########################################################################
+def bench_batch(num_attaches: int, batched: bool) -> float:
+    """
+    Measure attach+detach cycles applied either one hook call at a time, each
+    reading the clock and followed by the ue_id lookup done by the dashboard,
+    or as one apply_events() batch.
+    :return: average attach+detach cost in microseconds.
+    """
+    s = UeContextsMap(dbg=False)
+    events = []
+    for n in range(num_attaches):
+        pci = 400 + (n >> 16)
+        crnti = n & 0xffff
+        events += [DuUeCtxCreationEvent("du0", n, PLMN, pci, crnti, TAC, NCI),
+                   CucpUeAddEvent("cucp0", n, PLMN, pci, crnti),
+                   DuUeCtxDeletionEvent("du0", n),
+                   CucpUeRemoveEvent("cucp0", n)]
+
+    start = time.perf_counter()
+    if batched:
+        s.apply_events(events)
+    else:
+        for n in range(num_attaches):
+            pci = 400 + (n >> 16)
+            crnti = n & 0xffff
+            s.hook_du_ue_ctx_creation("du0", n, PLMN, pci, crnti, TAC, NCI)
+            s.getid_by_du_index("du0", n)
+            s.hook_cucp_uemgr_ue_add("cucp0", n, PLMN, pci, crnti)
+            s.getid_by_cucp_index("cucp0", n)
+            s.getid_by_du_index("du0", n)
+            s.hook_du_ue_ctx_deletion("du0", n)
+            s.getid_by_cucp_index("cucp0", n)
+            s.hook_cucp_uemgr_ue_remove("cucp0", n)
+    elapsed = time.perf_counter() - start
+    assert s.get_num_contexts() == 0
+    return (elapsed / num_attaches) * 1e6
+
+
+##########################################################################
+def bench_report_json(ues_per_report: int, num_reports: int, cached: bool) -> float:
+    """
+    Measure the cost of serializing a per-UE stats report embedding each UE's
+    concise context, either re-encoding the contexts (as done before they
+    were cached) or splicing the cached JSON fragments.
+    :return: average cost per report in microseconds.
+    """
+    now = dt.datetime.now(dt.UTC)
+    s = UeContextsMap(dbg=False)
+    for n in range(ues_per_report):
+        attach(s, n, now)
+    ues = [s.getuectx(s.getid_by_du_index("du0", n)) for n in range(ues_per_report)]
+
+    start = time.perf_counter()
+    for _ in range(num_reports):
+        ue_json = UeCtxJson()
+        output = {"stream_index": "MAC_STATS", "stats": []}
+        for n, uectx in enumerate(ues):
+            if cached:
+                ue_ctx = ue_json.ref(uectx)
+            else:
+                uectx.invalidate()
+                ue_ctx = uectx.concise_dict()
+            output["stats"].append({"ueid": n, "ue_ctx": ue_ctx, "cnt": n, "total": n * 100})
+        ue_json.dumps(output)
+    elapsed = time.perf_counter() - start
+    return (elapsed / num_reports) * 1e6
+
+
+##########################################################################
+def bench_memory(num_contexts: int) -> (float, float):
+    """
+    Measure the memory held by the map for num_contexts fully attached UEs
+    (DU, CU-CP, E1 bearer, NGAP ids and TMSI), and for as many AMF contexts.
+    :return: (bytes per UE context, bytes per AMF context), including the indexes.
+    """
+    now = dt.datetime.now(dt.UTC)
+    proc = JbpfNgapProcedure.NGAP_PROCEDURE_INITIAL_CONTEXT_SETUP
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    s = UeContextsMap(dbg=False)
+    for n in range(num_contexts):
+        attach(s, n, now)
+        s.hook_e1_cucp_bearer_context_setup("cucp0", n, n, now=now)
+        s.hook_e1_cuup_bearer_context_setup("cuup0", n, n, n, True, now=now)
+        s.hook_ngap_procedure_started("cucp0", n, proc, n, now=now)
+        s.hook_ngap_procedure_completed("cucp0", n, proc, True, n, n + 1000000, now=now)
+        s.add_tmsi("cucp0", n, 0x10000000 + n, now=now)
+    ue_bytes = tracemalloc.get_traced_memory()[0] - base
+
+    base = tracemalloc.get_traced_memory()[0]
+    for n in range(num_contexts):
+        s.hook_core_amf_info(suci=f"suci-{n}", supi=f"imsi-{n}",
+                             current_guti_plmn="00101", current_guti_amf_id="1", current_guti_m_tmsi=n,
+                             next_guti_plmn="00101", next_guti_amf_id="1", next_guti_m_tmsi=0x20000000 + n,
+                             tai_plmn="00101", tai_tac="1", cgi_plmn="00101", cgi_cellid="66c000", now=now)
+    amf_bytes = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+
+    assert s.get_num_contexts() == num_contexts and len(s.amf_contexts) == num_contexts
+    return ue_bytes / num_contexts, amf_bytes / num_contexts
+
+
+##########################################################################
+def bench_sharded(num_gnbs: int, num_shards: int, num_threads: int, num_attaches: int) -> float:
+    """
+    Attach and detach num_attaches UEs on each of num_gnbs gNBs, the gNBs being spread over
+    num_shards shards and driven by num_threads threads.
+    :return: throughput in attach+detach per second.
+    """
+    now = dt.datetime.now(dt.UTC)
+    shard_by_src = {}
+    for g in range(num_gnbs):
+        shard_by_src[f"du{g}"] = shard_by_src[f"cucp{g}"] = g % num_shards
+    m = ShardedUeContextsMap(num_shards, dbg=False, shard_by_src=shard_by_src)
+
+    def worker(gnbs):
+        for n in range(num_attaches):
+            for g in gnbs:
+                m.hook_du_ue_ctx_creation(f"du{g}", n, PLMN, 400 + g, n & 0xffff, TAC, NCI, now=now)
+                m.hook_cucp_uemgr_ue_add(f"cucp{g}", n, PLMN, 400 + g, n & 0xffff, now=now)
+                m.hook_du_ue_ctx_deletion(f"du{g}", n, now=now)
+                m.hook_cucp_uemgr_ue_remove(f"cucp{g}", n, now=now)
+
+    threads = [threading.Thread(target=worker, args=(range(t, num_gnbs, num_threads),)) for t in range(num_threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    assert m.get_num_contexts() == 0
+    return num_gnbs * num_attaches / elapsed
+
+
+##########################################################################
+def bench_journal(num_attaches: int) -> (float, float, float):
+    """
+    Attach and detach num_attaches UEs with and without a journal, then replay the journal.
+    :return: (attach+detach cost in us without journal, with journal, replay rate in hook calls/s)
+    """
+    now = dt.datetime.now(dt.UTC)
+    costs = []
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "uectx.jnl")
+        for journaled in (False, True):
+            s = UeContextsMap(dbg=False)
+            if journaled:
+                s.start_journal(path)
+            start = time.perf_counter()
+            for n in range(num_attaches):
+                attach(s, n, now)
+                detach(s, n, now)
+            costs.append((time.perf_counter() - start) / num_attaches * 1e6)
+            s.stop_journal()
+
+        s = UeContextsMap(dbg=False)
+        start = time.perf_counter()
+        count = s.replay_journal(path)
+        rate = count / (time.perf_counter() - start)
+
+    assert count == 4 * num_attaches
+    return costs[0], costs[1], rate
+
+
+##########################################################################
+def bench_columns(num_contexts: int, num_attaches: int, num_queries: int = 20) -> (float, float, float, float):
+    """
+    Attach and detach num_attaches UEs on a map of num_contexts UEs, with and without a
+    UeContextColumns, then count the UEs per PCI by iterating the contexts and with the columns.
+    :return: (attach+detach cost in us without columns, with columns,
+              count per PCI in ms by iterating the contexts, with the columns)
+    """
+    now = dt.datetime.now(dt.UTC)
+    costs = []
+    for with_columns in (False, True):
+        s = UeContextsMap(dbg=False)
+        c = ue_contexts_columns.UeContextColumns(s) if with_columns else None
+        for n in range(num_contexts):
+            attach(s, n, now)
+        start = time.perf_counter()
+        for n in range(num_contexts, num_contexts + num_attaches):
+            attach(s, n, now)
+            detach(s, n, now)
+        costs.append((time.perf_counter() - start) / num_attaches * 1e6)
+    # the rows of the attached UEs are written by the first query
+    assert c.get_num_ues() == num_contexts
+
+    start = time.perf_counter()
+    for _ in range(num_queries):
+        counts = {}
+        for ue in s.contexts.values():
+            pci = ue.ran_unique_ue_id.pci
+            counts[pci] = counts.get(pci, 0) + 1
+    iterated_ms = (time.perf_counter() - start) / num_queries * 1e3
+
+    start = time.perf_counter()
+    for _ in range(num_queries):
+        columns_counts = c.count_by("pci")
+    columns_ms = (time.perf_counter() - start) / num_queries * 1e3
+
+    assert counts == columns_counts
+    return costs[0], costs[1], iterated_ms, columns_ms
+
+
+##########################################################################
+# UE churn suite.
+# Drives full UE lifecycles over several DUs and CU-CPs:
+#   DU add -> CU-CP add -> E1 setup (CU-CP and CU-UP) -> NGAP -> TMSI -> Core AMF info
+# and the matching release:
+#   E1 release -> DU delete -> CU-CP remove -> Core AMF remove RAN
+# The map is first filled with num_ues live UEs, then each churn cycle releases the
+# oldest UE and attaches a new one, so the map stays at num_ues UEs.
+
+def percentiles(samples_ns: list) -> dict:
+    s = sorted(samples_ns)
+    n = len(s)
+    return {
+        "count": n,
+        "p50_us": s[n // 2] / 1e3,
+        "p90_us": s[(n * 9) // 10] / 1e3,
+        "p99_us": s[min(n - 1, (n * 99) // 100)] / 1e3,
+        "max_us": s[-1] / 1e3,
+    }
+
+
+class ChurnDriver:
+
+    def __init__(self, num_dus: int, num_cucps: int):
+        self.num_dus = num_dus
+        self.num_cucps = num_cucps
+        self.s = UeContextsMap(dbg=False)
+        for du in range(num_dus):
+            self.s.set_fapi_cell_pci(du, 400 + du)
+        self.now = dt.datetime(2025, 1, 1, tzinfo=dt.UTC)
+        self.latencies = None      # hook name -> list of ns, when measuring
+
+    def ue(self, i: int) -> tuple:
+        # du, cucp, cuup, pci, crnti of UE i
+        du = i % self.num_dus
+        cucp = du % self.num_cucps
+        return f"du{du}", f"cucp{cucp}", f"cuup{cucp}", 400 + du, 1 + (i // self.num_dus) % 65000
+
+    def call(self, name: str, *args, **kwargs) -> None:
+        hook = getattr(self.s, name)
+        if self.latencies is None:
+            hook(*args, now=self.now, **kwargs)
+            return
+        start = time.perf_counter_ns()
+        hook(*args, now=self.now, **kwargs)
+        self.latencies.setdefault(name, []).append(time.perf_counter_ns() - start)
+
+    def attach(self, i: int) -> None:
+        du, cucp, cuup, pci, crnti = self.ue(i)
+        proc = JbpfNgapProcedure.NGAP_PROCEDURE_INITIAL_CONTEXT_SETUP
+        self.now += dt.timedelta(milliseconds=1)
+        self.call("hook_du_ue_ctx_creation", du, i, PLMN, pci, crnti, TAC, NCI)
+        self.call("hook_cucp_uemgr_ue_add", cucp, i, PLMN, pci, crnti)
+        self.call("hook_e1_cucp_bearer_context_setup", cucp, i, i)
+        self.call("hook_e1_cuup_bearer_context_setup", cuup, i, i, i, True)
+        self.call("hook_ngap_procedure_started", cucp, i, proc, i)
+        self.call("hook_ngap_procedure_completed", cucp, i, proc, True, i, 1000000 + i)
+        self.call("add_tmsi", cucp, i, i & 0xffffffff)
+        self.call("hook_core_amf_info", ran_ue_ngap_id=i, amf_ue_ngap_id=1000000 + i, suci=f"suci-{i}", supi=f"imsi-{i}",
+                  current_guti_plmn="00101", current_guti_amf_id="1", current_guti_m_tmsi=i & 0xffffffff,
+                  tai_plmn="00101", tai_tac="1", cgi_plmn="00101", cgi_cellid="66c000")
+
+    def release(self, i: int) -> None:
+        du, cucp, cuup, pci, crnti = self.ue(i)
+        self.now += dt.timedelta(milliseconds=1)
+        self.call("hook_e1_cuup_bearer_context_release", cuup, i, i, i, True)
+        self.call("hook_du_ue_ctx_deletion", du, i)
+        self.call("hook_cucp_uemgr_ue_remove", cucp, i)
+        self.call("hook_core_amf_info_remove_ran", suci=f"suci-{i}")
+
+
+def bench_lookups(d: ChurnDriver, live: range, num_lookups: int) -> dict:
+    """
+    :return: lookups per second of each lookup path used by the dashboard handlers.
+    """
+    s = d.s
+    ues = [(i,) + d.ue(i) for i in live]
+    ues = (ues * (num_lookups // len(ues) + 1))[:num_lookups]
+    paths = {
+        "du_index+getuectx": lambda i, du, cucp, cuup, pci, crnti: s.getuectx(s.getid_by_du_index(du, i)),
+        "cucp_index+getuectx": lambda i, du, cucp, cuup, pci, crnti: s.getuectx(s.getid_by_cucp_index(cucp, i)),
+        "fapi_cell_rnti+getuectx": lambda i, du, cucp, cuup, pci, crnti: s.getuectx(s.getid_by_fapi_cell_rnti(pci - 400, crnti)),
+        "ngap_ue_ids": lambda i, du, cucp, cuup, pci, crnti: s.getid_by_ngap_ue_ids(i, 1000000 + i),
+        "tmsi": lambda i, du, cucp, cuup, pci, crnti: s.getid_by_tmsi(i),
+    }
+    rates = {}
+    for name, lookup in paths.items():
+        start = time.perf_counter()
+        for u in ues:
+            lookup(*u)
+        rates[name] = num_lookups / (time.perf_counter() - start)
+    return rates
+
+
+def bench_churn(num_ues: int, num_dus: int, num_cucps: int, num_cycles: int, num_ticks: int) -> dict:
+    """
+    Fill the map with num_ues UEs, then run num_cycles release+attach cycles.
+    :return: the results, as a JSON-serializable dict.
+    """
+    gc.collect()
+    d = ChurnDriver(num_dus, num_cucps)
+
+    # fill, measuring the memory
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    for i in range(num_ues):
+        d.attach(i)
+    fill_secs = time.perf_counter() - start
+    mem_bytes = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+
+    # churn, measuring each hook
+    d.latencies = {}
+    start = time.perf_counter()
+    for i in range(num_ues, num_ues + num_cycles):
+        d.release(i - num_ues)
+        d.attach(i)
+    churn_secs = time.perf_counter() - start
+    latencies = d.latencies
+    d.latencies = None
+    assert d.s.get_num_contexts() == num_ues
+
+    lookups = bench_lookups(d, range(num_cycles, num_ues + num_cycles), 20000)
+
+    # ticks with nothing to expire, then the tick expiring the AMF contexts of the released UEs
+    ticks = []
+    for _ in range(num_ticks):
+        start = time.perf_counter_ns()
+        d.s.process_timeout(now=d.now)
+        ticks.append(time.perf_counter_ns() - start)
+    start = time.perf_counter_ns()
+    expired = d.s.process_timeout(now=d.now + d.s.amf_tmsi_expiry_secs)
+    expiry_tick_us = (time.perf_counter_ns() - start) / 1e3
+    assert expired == num_cycles
+
+    return {
+        "ues": num_ues,
+        "dus": num_dus,
+        "cucps": num_cucps,
+        "cycles": num_cycles,
+        "fill_ues_per_sec": num_ues / fill_secs,
+        "churn_cycles_per_sec": num_cycles / churn_secs,
+        "hooks": {name: percentiles(samples) for name, samples in latencies.items()},
+        "lookups_per_sec": lookups,
+        "bytes_per_ue": mem_bytes / num_ues,      # UE context, AMF context and all their indexes
+        "tick": percentiles(ticks),
+        "expiry_tick_us": expiry_tick_us,
+        "expired_amf_contexts": expired,
+    }
+
+
+def print_churn(r: dict) -> None:
+    print(f"\n{r['ues']} UEs, {r['dus']} DUs, {r['cucps']} CU-CPs: "
+          f"fill {r['fill_ues_per_sec']:.0f} UEs/s, churn {r['churn_cycles_per_sec']:.0f} cycles/s, "
+          f"{r['bytes_per_ue']:.0f} bytes/UE")
+    print(f"  {'hook':<38} {'p50 (us)':>9} {'p90 (us)':>9} {'p99 (us)':>9} {'max (us)':>9}")
+    for name, p in r["hooks"].items():
+        print(f"  {name:<38} {p['p50_us']:>9.2f} {p['p90_us']:>9.2f} {p['p99_us']:>9.2f} {p['max_us']:>9.2f}")
+    for name, rate in r["lookups_per_sec"].items():
+        print(f"  lookup {name:<31} {rate:>12.0f} /s")
+    print(f"  timeout tick p50 {r['tick']['p50_us']:.2f} us, p99 {r['tick']['p99_us']:.2f} us; "
+          f"expiry of {r['expired_amf_contexts']} AMF contexts {r['expiry_tick_us']:.0f} us")
+
+
+##########################################################################
+def build_fixture(num_contexts: int) -> UeContextsMap:
+    """
+    Build a map with num_contexts attached UEs (DU, CU-CP, E1 bearer, NGAP ids and TMSI),
+    each linked to an AMF context, plus as many AMF contexts of idle UEs.
+    """
+    now = dt.datetime.now(dt.UTC)
+    proc = JbpfNgapProcedure.NGAP_PROCEDURE_INITIAL_CONTEXT_SETUP
+    s = UeContextsMap(dbg=False)
+    for n in range(num_contexts):
+        attach(s, n, now)
+        s.hook_e1_cucp_bearer_context_setup("cucp0", n, n, now=now)
+        s.hook_ngap_procedure_started("cucp0", n, proc, n, now=now)
+        s.hook_ngap_procedure_completed("cucp0", n, proc, True, n, n + 1000000, now=now)
+        s.hook_core_amf_info(ran_ue_ngap_id=n, amf_ue_ngap_id=n + 1000000, suci=f"suci-{n}", supi=f"imsi-{n}",
+                             current_guti_plmn="00101", current_guti_amf_id="1", current_guti_m_tmsi=n,
+                             tai_plmn="00101", tai_tac="1", now=now)
+        s.add_tmsi("cucp0", n, n, now=now)
+    for n in range(num_contexts, 2 * num_contexts):
+        s.hook_core_amf_info(suci=f"suci-{n}", supi=f"imsi-{n}",
+                             current_guti_plmn="00101", current_guti_amf_id="1", current_guti_m_tmsi=n, now=now)
+    return s
+
+
+##########################################################################
+def bench_snapshot(num_contexts: int) -> (float, float, int):
+    """
+    Save and restore a snapshot of build_fixture(num_contexts).
+    :return: (save time in ms, load time in ms, snapshot size in bytes)
+    """
+    s = build_fixture(num_contexts)
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "uectx.snap")
+
+        start = time.perf_counter()
+        size = s.save_snapshot(path)
+        save_ms = (time.perf_counter() - start) * 1e3
+
+        s2 = UeContextsMap(dbg=False)
+        start = time.perf_counter()
+        s2.load_snapshot(path)
+        load_ms = (time.perf_counter() - start) * 1e3
+
+    assert s2.get_num_contexts() == num_contexts and len(s2.amf_contexts) == 2 * num_contexts
+    return save_ms, load_ms, size
+
+
+##########################################################################
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="UeContextsMap benchmarks")
+    parser.add_argument("--sizes", default="100,1000,10000,50000",
+                        help="comma separated list of pre-populated context counts")
+    parser.add_argument("--attaches", type=int, default=1000,
+                        help="number of attach/detach cycles measured per size")
+    parser.add_argument("--fixture", default=None,
+                        help="only write a snapshot fixture of --fixture-size attached UEs to this path")
+    parser.add_argument("--fixture-size", type=int, default=100000,
+                        help="number of attached UEs in the snapshot fixture")
+    parser.add_argument("--churn", default=None,
+                        help="only run the UE churn suite, for this comma separated list of live UE counts")
+    parser.add_argument("--dus", type=int, default=4,
+                        help="number of DUs of the churn suite")
+    parser.add_argument("--cucps", type=int, default=2,
+                        help="number of CU-CPs of the churn suite")
+    parser.add_argument("--cycles", type=int, default=5000,
+                        help="number of release+attach cycles measured by the churn suite")
+    parser.add_argument("--json", default=None,
+                        help="write the churn suite results to this file")
+    args = parser.parse_args()
+
+    if args.churn is not None:
+        results = []
+        for num_ues in [int(x) for x in args.churn.split(",")]:
+            r = bench_churn(num_ues, args.dus, args.cucps, args.cycles, num_ticks=1000)
+            print_churn(r)
+            results.append(r)
+        if args.json is not None:
+            with open(args.json, "w") as f:
+                json.dump({"python": sys.version, "time": dt.datetime.now(dt.UTC).isoformat(), "results": results}, f, indent=2)
+        sys.exit(0)
+
+    if args.fixture is not None:
+        size = build_fixture(args.fixture_size).save_snapshot(args.fixture)
+        print(f"wrote {args.fixture}: {args.fixture_size} UE contexts, {size} bytes")
+        sys.exit(0)
+
+    sizes = [int(x) for x in args.sizes.split(",")]
+
+    print(f"{'contexts':>10} {'attach+detach (us)':>20}")
+    for size in sizes:
+        cost = bench_attach(size, args.attaches)
+        print(f"{size:>10} {cost:>20.2f}")
+
+    print()
+    print(f"{'contexts':>10} {'64-UE FAPI report (us)':>24}")
+    for size in sizes:
+        cost = bench_fapi_report(size, args.attaches)
+        print(f"{size:>10} {cost:>24.2f}")
+
+    print()
+    print(f"{'contexts':>10} {'NGAP started+completed (us)':>28}")
+    for size in sizes:
+        cost = bench_ngap(size, args.attaches)
+        print(f"{size:>10} {cost:>28.2f}")
+
+    print()
+    print(f"{'amf ctxs':>10} {'AMF info+TMSI assoc (us)':>28}")
+    for size in sizes:
+        cost = bench_core_amf_info(size, args.attaches)
+        print(f"{size:>10} {cost:>28.2f}")
+
+    print()
+    print(f"{'amf ctxs':>10} {'timeout tick (us)':>20}")
+    for size in sizes:
+        cost = bench_timeout_tick(size, args.attaches)
+        print(f"{size:>10} {cost:>20.2f}")
+
+    print()
+    print(f"{'hook calls (us)':>16} {'apply_events (us)':>18}")
+    print(f"{bench_batch(args.attaches, False):>16.2f} {bench_batch(args.attaches, True):>18.2f}")
+
+    print()
+    print(f"{'UEs/report':>10} {'re-encoded (us)':>16} {'cached (us)':>12}")
+    for ues in (1, 20, 64):
+        uncached = bench_report_json(ues, args.attaches, False)
+        cached = bench_report_json(ues, args.attaches, True)
+        print(f"{ues:>10} {uncached:>16.2f} {cached:>12.2f}")
+
+    print()
+    print(f"{'contexts':>10} {'bytes/UE':>12} {'bytes/AMF ctx':>14}")
+    for size in sizes:
+        ue_bytes, amf_bytes = bench_memory(size)
+        print(f"{size:>10} {ue_bytes:>12.0f} {amf_bytes:>14.0f}")
+
+    print()
+    print(f"{'shards':>8} {'threads':>8} {'8-gNB attach+detach/s':>22}")
+    for num_shards, num_threads in ((1, 1), (4, 1), (4, 4)):
+        rate = bench_sharded(8, num_shards, num_threads, args.attaches)
+        print(f"{num_shards:>8} {num_threads:>8} {rate:>22.0f}")
+
+    print()
+    print(f"{'no journal (us)':>16} {'journal (us)':>13} {'replay (calls/s)':>17}")
+    plain, journaled, rate = bench_journal(args.attaches)
+    print(f"{plain:>16.2f} {journaled:>13.2f} {rate:>17.0f}")
+
+    if ue_contexts_columns.available:
+        print()
+        print(f"{'contexts':>10} {'no columns (us)':>16} {'columns (us)':>13} {'per PCI, loop (ms)':>19} {'per PCI, columns (ms)':>22}")
+        for size in sizes:
+            plain, with_columns, iterated_ms, columns_ms = bench_columns(size, args.attaches)
+            print(f"{size:>10} {plain:>16.2f} {with_columns:>13.2f} {iterated_ms:>19.2f} {columns_ms:>22.2f}")
+
+    print()
+    print(f"{'contexts':>10} {'save (ms)':>10} {'load (ms)':>10} {'size (KB)':>10}")
+    for size in sizes:
+        save_ms, load_ms, nbytes = bench_snapshot(size)
+        print(f"{size:>10} {save_ms:>10.1f} {load_ms:>10.1f} {nbytes / 1024:>10.0f}")
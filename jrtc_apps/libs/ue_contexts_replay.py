@@ -0,0 +1,59 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+#
+# Rebuilds a UeContextsMap from a journal written by UeContextsMap.start_journal(),
+# optionally on top of the snapshot the journal follows.
+# Used to reproduce context mapping problems offline, and to time index changes
+# against recorded attach/detach traces.
+#
+# Usage:
+#     python3 ue_contexts_replay.py uectx.jnl [--snapshot uectx.snap] [--save-snapshot out.snap] [--dbg]
+#
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ue_contexts_map import UeContextsMap
+
+
+##########################################################################
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Replay a UeContextsMap journal")
+    parser.add_argument("journal", help="journal file")
+    parser.add_argument("--snapshot", default=None,
+                        help="snapshot to load before the journal")
+    parser.add_argument("--save-snapshot", default=None,
+                        help="write a snapshot of the resulting map")
+    parser.add_argument("--dump", action="store_true",
+                        help="print the resulting map")
+    parser.add_argument("--dbg", action="store_true",
+                        help="trace each replayed hook")
+    args = parser.parse_args()
+
+    # the evictions of the UE contexts are replayed from the journal, so they need no configuration
+    s = UeContextsMap(dbg=args.dbg)
+
+    if args.snapshot is not None:
+        start = time.perf_counter()
+        s.load_snapshot(args.snapshot)
+        print(f"loaded {args.snapshot}: {s.get_num_contexts()} UE contexts, {len(s.amf_contexts)} AMF contexts, "
+              f"journal_seq {s.journal_seq}, {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+    start = time.perf_counter()
+    count = s.replay_journal(args.journal)
+    elapsed = time.perf_counter() - start
+    print(f"replayed {args.journal}: {count} hook calls in {elapsed * 1e3:.1f} ms "
+          f"({count / elapsed if elapsed > 0 else 0:.0f} calls/s), journal_seq {s.journal_seq}")
+    print(f"result: {s.get_num_contexts()} UE contexts, {len(s.amf_contexts)} AMF contexts, "
+          f"evictions {s.get_eviction_counts()}")
+
+    if args.dump:
+        print(s)
+
+    if args.save_snapshot is not None:
+        size = s.save_snapshot(args.save_snapshot)
+        print(f"wrote {args.save_snapshot}: {size} bytes")
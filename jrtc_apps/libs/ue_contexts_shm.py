@@ -0,0 +1,568 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+#
+# Shared memory table of the UE contexts, so that several jrtc apps can look up the
+# identity of a UE without each subscribing to the ue_contexts streams and building
+# its own UeContextsMap.
+#
+# One owner process, which has the UeContextsMap, writes the table with UeContextsShmWriter,
+# and any number of processes read it with UeContextsShmReader.  The table is an mmap of a
+# file, by default in /dev/shm, laid out as:
+#
+#     header      magic, version, capacity, number of buckets, number of srcs, closed, index seq, number of UEs
+#     srcs        MAX_SRCS names of the DU / CU-CP / CU-UP srcs, a record refers to them by their number
+#     records     capacity records of a seq and a RECORD, one per UE context, ue_id -1 for a free record
+#     indexes     open addressing hash tables of (key, record) buckets, by du_index, by cucp_index
+#                 and by (pci, rnti), record -1 for an empty bucket.  Linear probing, with backward
+#                 shift deletion, so there are no tombstones.  A (pci, rnti) of several UEs (of
+#                 different PLMNs, or a reused PCI) has record -2, and is a miss, as for
+#                 UeContextsMap.getid_by_pci_rnti(), rather than the risk of the wrong UE.
+#
+# The indexes are keyed like those of UeContextsMap: src_id << 32 | idx, and pci << 32 | rnti.
+#
+# Consistency is by seqlocks: the writer makes the seq of a record odd while it changes the
+# record, and even again after, and does the same with the index seq of the header while it
+# changes the indexes.  A reader reads the record found by its lookup between two reads of the
+# record seq, and retries if the seq was odd or has changed.  As the indexes change at every
+# attach and detach, the lookup does not hold the index seq: a consistent record with the key
+# looked for is the answer, wherever the bucket pointing to it was read.  Only a miss is
+# checked against the index seq, and retried if the indexes changed meanwhile.
+# This relies on the stores of the writer being seen in order by the readers, as they are on x86.
+#
+# The writer replaces the file when it starts, so a reader started before it keeps reading the
+# table of the previous writer, which is marked closed.  reopen_if_replaced() re-attaches the reader.
+#
+
+import os
+import mmap
+import struct
+import threading
+from dataclasses import dataclass
+from typing import Tuple
+
+from ue_contexts_map import UeContext, UeContextChange, UeContextChangeKind
+
+SHM_MAGIC = b"UECTXSHM"
+SHM_VERSION = 1
+DEFAULT_SHM_PATH = "/dev/shm/jrtc_ue_contexts"
+
+# magic, version, capacity, num_buckets, num_srcs, closed, index seq, num_ues
+SHM_HEADER = struct.Struct("<8sIIIIIIQQ")
+SHM_NUM_SRCS_OFFSET = 20
+SHM_NUM_SRCS = struct.Struct("<I")
+SHM_SEQ_OFFSET = 32
+SHM_NUM_UES_OFFSET = 40
+SHM_SEQ = struct.Struct("<Q")
+
+MAX_SRCS = 256
+SRC_NAME_LEN = 64
+
+# ue_id, du_src_id, du_index, cucp_src_id, cucp_index, cuup_src_id, cuup_index, plmn, pci, crnti,
+# nci, tac, tmsi, ran_ue_ngap_id, amf_ue_ngap_id, core_amf_context_index.  -1 for None.
+# Each record follows its seq.
+RECORD = struct.Struct("<16q")
+RECORD_SIZE = SHM_SEQ.size + RECORD.size
+FREE_RECORD = (-1,) * 16
+BUCKET = struct.Struct("<qq")       # key, record
+
+INDEXES = ("du", "cucp", "pci_rnti")
+
+MAX_READ_RETRIES = 1000
+
+NONE = -1
+AMBIGUOUS = -2      # record of a bucket whose key is held by several records
+
+
+##########################################################################
+@dataclass(frozen=True, slots=True)
+class ShmUeContext:
+    ue_id: int
+    du_src: str
+    du_index: int
+    cucp_src: str
+    cucp_index: int
+    cuup_src: str
+    cuup_index: int
+    plmn: int
+    pci: int
+    crnti: int
+    nci: int
+    tac: int
+    tmsi: int
+    ran_ue_ngap_id: int
+    amf_ue_ngap_id: int
+    core_amf_context_index: int
+
+
+##########################################################################
+def _hash_bucket(key: int, mask: int) -> int:
+    # Fibonacci hashing of the 64 bit key
+    return ((key * 0x9E3779B97F4A7C15) >> 32) & mask
+
+def _record_key(index: int, rec: Tuple) -> int:
+    # key of a record in an index, None if it is not in the index
+    if index == 0:
+        return None if rec[1] == NONE else (rec[1] << 32) | rec[2]
+    if index == 1:
+        return None if rec[3] == NONE else (rec[3] << 32) | rec[4]
+    return None if rec[8] == NONE or rec[9] == NONE else (rec[8] << 32) | rec[9]
+
+def _layout(capacity: int, num_buckets: int) -> Tuple[int, int, int]:
+    # offsets of the srcs, records and indexes, and the size of the file
+    srcs = SHM_HEADER.size
+    records = srcs + MAX_SRCS * SRC_NAME_LEN
+    indexes = records + capacity * RECORD_SIZE
+    size = indexes + len(INDEXES) * num_buckets * BUCKET.size
+    return records, indexes, size
+
+
+##########################################################################
+class UeContextsShmWriter:
+    """
+    Writes the UE contexts of a UeContextsMap or ShardedUeContextsMap to the shared memory table,
+    following the changes of the map (UeContextsMap.subscribe()).
+    The table is written under the lock of the writer, see ShardedUeContextsMap.subscribe().
+    """
+
+    ####################################################################
+    def __init__(self, m, path: str = DEFAULT_SHM_PATH, capacity: int = 100000):
+        self.m = m
+        self.path = path
+        self.capacity = capacity
+        self.num_buckets = 1 << (2 * capacity - 1).bit_length()     # at most half full
+        self.mask = self.num_buckets - 1
+        self.records_offset, self.indexes_offset, size = _layout(capacity, self.num_buckets)
+        self.lock = threading.Lock()
+        self.src_ids = {}           # src -> src_id
+        self.rows = {}              # ue_id -> (record, values of the record)
+        self.free_records = list(range(capacity - 1, -1, -1))
+        # key -> records with the key, of each index.  The table holds the record of a key with a single
+        # holder, AMBIGUOUS for more.  Only (pci, rnti) can be shared, by UEs of different PLMNs or cells.
+        self.holders = [{} for _ in INDEXES]
+        self.seq = 0                # index seq
+        self.record_seqs = [0] * capacity
+        self.num_dropped = 0        # contexts not written, as the table was full or their src had no src_id left
+
+        # the file is built aside and then renamed, so the readers never see it half initialized
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w+b") as f:
+            f.truncate(size)
+            self.buf = mmap.mmap(f.fileno(), size)
+        for record in range(capacity):
+            RECORD.pack_into(self.buf, self.records_offset + record * RECORD_SIZE + SHM_SEQ.size, *FREE_RECORD)
+        self.buf[self.indexes_offset:size] = b"\xff" * (size - self.indexes_offset)
+        self.write_header(closed=False)
+        os.replace(tmp, path)
+        m.subscribe(self.on_change)
+
+    ####################################################################
+    def write_header(self, closed: bool) -> None:
+        SHM_HEADER.pack_into(self.buf, 0, SHM_MAGIC, SHM_VERSION, self.capacity, self.num_buckets,
+                             len(self.src_ids), int(closed), 0, self.seq, len(self.rows))
+
+    ####################################################################
+    def close(self) -> None:
+        """
+        Stop following the map and mark the table closed, for the readers.  The file is left,
+        so that the readers can still read the last state of the table.
+        """
+        self.m.unsubscribe(self.on_change)
+        with self.lock:
+            self.write_header(closed=True)
+            self.buf.close()
+
+    ####################################################################
+    def get_src_id(self, src: str) -> int:
+        # None beyond MAX_SRCS srcs
+        src_id = self.src_ids.get(src, None)
+        if src_id is None:
+            if len(self.src_ids) == MAX_SRCS:
+                return None
+            src_id = len(self.src_ids)
+            name = src.encode()[:SRC_NAME_LEN]
+            offset = SHM_HEADER.size + src_id * SRC_NAME_LEN
+            self.buf[offset:offset + len(name)] = name
+            self.src_ids[src] = src_id
+            SHM_NUM_SRCS.pack_into(self.buf, SHM_NUM_SRCS_OFFSET, len(self.src_ids))
+        return src_id
+
+    ####################################################################
+    def index_insert(self, index: int, key: int, record: int) -> None:
+        base = self.indexes_offset + index * self.num_buckets * BUCKET.size
+        i = _hash_bucket(key, self.mask)
+        while True:
+            k, r = BUCKET.unpack_from(self.buf, base + i * BUCKET.size)
+            if r == NONE or k == key:
+                BUCKET.pack_into(self.buf, base + i * BUCKET.size, key, record)
+                return
+            i = (i + 1) & self.mask
+
+    ####################################################################
+    def index_remove(self, index: int, key: int) -> None:
+        base = self.indexes_offset + index * self.num_buckets * BUCKET.size
+        i = _hash_bucket(key, self.mask)
+        while True:
+            k, r = BUCKET.unpack_from(self.buf, base + i * BUCKET.size)
+            if r == NONE:
+                return
+            if k == key:
+                break
+            i = (i + 1) & self.mask
+        # backward shift the buckets which follow, so that their probe sequences have no hole
+        j = i
+        while True:
+            j = (j + 1) & self.mask
+            k, r = BUCKET.unpack_from(self.buf, base + j * BUCKET.size)
+            if r == NONE:
+                break
+            home = _hash_bucket(k, self.mask)
+            if (i < j and (home <= i or home > j)) or (i > j and home <= i and home > j):
+                BUCKET.pack_into(self.buf, base + i * BUCKET.size, k, r)
+                i = j
+        BUCKET.pack_into(self.buf, base + i * BUCKET.size, NONE, NONE)
+
+    ####################################################################
+    def hold(self, index: int, key: int, record: int) -> None:
+        holders = self.holders[index].setdefault(key, [])
+        holders.append(record)
+        if len(holders) <= 2:
+            self.index_insert(index, key, record if len(holders) == 1 else AMBIGUOUS)
+
+    ####################################################################
+    def release(self, index: int, key: int, record: int) -> None:
+        holders = self.holders[index][key]
+        holders.remove(record)
+        if len(holders) == 0:
+            del self.holders[index][key]
+            self.index_remove(index, key)
+        elif len(holders) == 1:
+            self.index_insert(index, key, holders[0])
+
+    ####################################################################
+    def on_change(self, change: UeContextChange) -> None:
+        with self.lock:
+            self.write_change(change)
+
+    ####################################################################
+    def write_record(self, record: int, values) -> None:
+        offset = self.records_offset + record * RECORD_SIZE
+        seq = self.record_seqs[record]
+        SHM_SEQ.pack_into(self.buf, offset, seq + 1)
+        RECORD.pack_into(self.buf, offset + SHM_SEQ.size, *values)
+        SHM_SEQ.pack_into(self.buf, offset, seq + 2)
+        self.record_seqs[record] = seq + 2
+
+    ####################################################################
+    def write_change(self, change: UeContextChange) -> None:
+        row = self.rows.get(change.ue_id, None)
+        ue = None if change.kind == UeContextChangeKind.DELETED else self.m.getue_by_id(change.ue_id)
+        values = FREE_RECORD if ue is None else self.ue_record(change.ue_id, ue)
+        if values is None:
+            # called from the hooks of the map, so the context is dropped from the table rather than raising
+            self.num_dropped += 1
+            ue = None
+            values = FREE_RECORD
+
+        if row is None:
+            if ue is None:
+                return
+            if len(self.free_records) == 0:
+                self.num_dropped += 1
+                return
+            record = self.free_records.pop()
+            old_values = FREE_RECORD
+        else:
+            record, old_values = row
+            if values == old_values:
+                # a change of the fields which are not in the table, such as the E1 bearers
+                return
+        keys = (_record_key(0, values), _record_key(1, values), _record_key(2, values))
+        old_keys = (_record_key(0, old_values), _record_key(1, old_values), _record_key(2, old_values))
+
+        # the record is written before a new key points to it, and freed after the keys which
+        # pointed to it are gone, so that a reader finding it by a key can trust its content
+        if ue is not None:
+            self.write_record(record, values)
+        if old_keys != keys:
+            self.seq += 1
+            SHM_SEQ.pack_into(self.buf, SHM_SEQ_OFFSET, self.seq)
+            for index in range(len(INDEXES)):
+                if old_keys[index] != keys[index]:
+                    if old_keys[index] is not None:
+                        self.release(index, old_keys[index], record)
+                    if keys[index] is not None:
+                        self.hold(index, keys[index], record)
+            self.seq += 1
+            SHM_SEQ.pack_into(self.buf, SHM_SEQ_OFFSET, self.seq)
+        if ue is None:
+            self.write_record(record, FREE_RECORD)
+            del self.rows[change.ue_id]
+            self.free_records.append(record)
+            SHM_SEQ.pack_into(self.buf, SHM_NUM_UES_OFFSET, len(self.rows))
+        elif row is None:
+            self.rows[change.ue_id] = (record, values)
+            SHM_SEQ.pack_into(self.buf, SHM_NUM_UES_OFFSET, len(self.rows))
+        else:
+            self.rows[change.ue_id] = (record, values)
+
+    ####################################################################
+    def ue_record(self, ue_id: int, ue: UeContext) -> Tuple:
+        # None if a src of the context has no src_id left
+        du, cucp, cuup, r, ngap = ue.du_index, ue.cucp_index, ue.cuup_index, ue.ran_unique_ue_id, ue.ngap_ids
+        src_ids = [NONE if index is None else self.get_src_id(index.src) for index in (du, cucp, cuup)]
+        if None in src_ids:
+            return None
+        return (ue_id,
+                src_ids[0], NONE if du is None else du.idx,
+                src_ids[1], NONE if cucp is None else cucp.idx,
+                src_ids[2], NONE if cuup is None else cuup.idx,
+                NONE if r is None or r.plmn is None else r.plmn,
+                NONE if r is None or r.pci is None else r.pci,
+                NONE if r is None or r.crnti is None else r.crnti,
+                NONE if ue.nci is None else ue.nci,
+                NONE if ue.tac is None else ue.tac,
+                NONE if ue.tmsi is None else ue.tmsi,
+                NONE if ngap is None or ngap.ran_ue_ngap_id is None else ngap.ran_ue_ngap_id,
+                NONE if ngap is None or ngap.amf_ue_ngap_id is None else ngap.amf_ue_ngap_id,
+                NONE if ue.core_amf_context_index is None else ue.core_amf_context_index)
+
+
+##########################################################################
+class UeContextsShmReader:
+    """
+    Lookups of the UE contexts in the shared memory table written by a UeContextsShmWriter.
+    The lookups return a ShmUeContext, a copy of the record taken under the seqlock, or None.
+    """
+
+    ####################################################################
+    def __init__(self, path: str = DEFAULT_SHM_PATH):
+        self.path = path
+        self.buf = None
+        self.num_retries = 0        # lookups retried as the writer was changing the table
+        self.open()
+
+    ####################################################################
+    def open(self) -> None:
+        with open(self.path, "rb") as f:
+            self.ino = os.fstat(f.fileno()).st_ino
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.capacity, self.num_buckets, _, _, _, _, _ = SHM_HEADER.unpack_from(self.buf, 0)
+        if magic != SHM_MAGIC or version != SHM_VERSION:
+            self.buf.close()
+            raise ValueError(f"{self.path} is not a version {SHM_VERSION} UE contexts shared memory table")
+        self.mask = self.num_buckets - 1
+        self.records_offset, self.indexes_offset, _ = _layout(self.capacity, self.num_buckets)
+        self.src_ids = {}
+        self.srcs = []
+
+    ####################################################################
+    def close(self) -> None:
+        self.buf.close()
+
+    ####################################################################
+    def closed(self) -> bool:
+        # the writer is gone, the table is not updated anymore
+        return SHM_HEADER.unpack_from(self.buf, 0)[5] != 0
+
+    ####################################################################
+    def reopen_if_replaced(self) -> bool:
+        """
+        Attach to the table of a new writer, if one has replaced the file.
+        :return: True if the reader was re-attached.
+        """
+        try:
+            if os.stat(self.path).st_ino == self.ino:
+                return False
+        except FileNotFoundError:
+            return False
+        self.close()
+        self.open()
+        return True
+
+    ####################################################################
+    def get_num_contexts(self) -> int:
+        return SHM_HEADER.unpack_from(self.buf, 0)[8]
+
+    ####################################################################
+    def load_srcs(self) -> None:
+        # the srcs are only ever appended, so the known ones stay valid
+        num_srcs = SHM_HEADER.unpack_from(self.buf, 0)[4]
+        for src_id in range(len(self.srcs), num_srcs):
+            offset = SHM_HEADER.size + src_id * SRC_NAME_LEN
+            src = bytes(self.buf[offset:offset + SRC_NAME_LEN]).rstrip(b"\0").decode()
+            self.srcs.append(src)
+            self.src_ids[src] = src_id
+
+    ####################################################################
+    def src_key(self, src: str, idx: int) -> int:
+        src_id = self.src_ids.get(src, None)
+        if src_id is None:
+            self.load_srcs()
+            src_id = self.src_ids.get(src, None)
+            if src_id is None:
+                return None
+        return (src_id << 32) | idx
+
+    ####################################################################
+    def read_record(self, record: int) -> Tuple:
+        buf = self.buf
+        offset = self.records_offset + record * RECORD_SIZE
+        for _ in range(MAX_READ_RETRIES):
+            (seq,) = SHM_SEQ.unpack_from(buf, offset)
+            if seq & 1 == 0:
+                rec = RECORD.unpack_from(buf, offset + SHM_SEQ.size)
+                if SHM_SEQ.unpack_from(buf, offset)[0] == seq:
+                    return rec
+            self.num_retries += 1
+        return None
+
+    ####################################################################
+    def lookup(self, index: int, key: int) -> ShmUeContext:
+        if key is None:
+            return None
+        buf = self.buf
+        base = self.indexes_offset + index * self.num_buckets * BUCKET.size
+        for _ in range(MAX_READ_RETRIES):
+            (seq,) = SHM_SEQ.unpack_from(buf, SHM_SEQ_OFFSET)
+            i = _hash_bucket(key, self.mask)
+            for _ in range(self.num_buckets):
+                k, r = BUCKET.unpack_from(buf, base + i * BUCKET.size)
+                if r == NONE or (k == key and r == AMBIGUOUS):
+                    break
+                if k == key and 0 <= r < self.capacity:
+                    rec = self.read_record(r)
+                    if rec is not None and _record_key(index, rec) == key:
+                        return self.to_context(rec)
+                    break
+                i = (i + 1) & self.mask
+            # a miss, unless the indexes changed meanwhile
+            if seq & 1 == 0 and SHM_SEQ.unpack_from(buf, SHM_SEQ_OFFSET)[0] == seq:
+                return None
+            self.num_retries += 1
+        return None
+
+    ####################################################################
+    def to_context(self, rec: Tuple) -> ShmUeContext:
+        if max(rec[1], rec[3], rec[5]) >= len(self.srcs):
+            self.load_srcs()
+        def v(x):
+            return None if x == NONE else x
+        def src(src_id):
+            return None if src_id == NONE else self.srcs[src_id]
+        return ShmUeContext(rec[0], src(rec[1]), v(rec[2]), src(rec[3]), v(rec[4]), src(rec[5]), v(rec[6]),
+                            *[v(x) for x in rec[7:]])
+
+    ####################################################################
+    def getue_by_du_index(self, du_src: str, du_index: int) -> ShmUeContext:
+        return self.lookup(0, self.src_key(du_src, du_index))
+
+    def getue_by_cucp_index(self, cucp_src: str, cucp_index: int) -> ShmUeContext:
+        return self.lookup(1, self.src_key(cucp_src, cucp_index))
+
+    def getue_by_pci_rnti(self, pci: int, rnti: int) -> ShmUeContext:
+        return self.lookup(2, (pci << 32) | rnti)
+
+
+##########################################################################
+if __name__ == "__main__":
+
+    import sys
+    import tempfile
+    import datetime as dt
+    from ue_contexts_map import UeContextsMap, ShardedUeContextsMap, JbpfNgapProcedure
+
+    now = dt.datetime.now(dt.UTC)
+    d = tempfile.mkdtemp()
+    path = os.path.join(d, "uectx.shm")
+
+    print("\n\n------ Test: UE contexts shared memory table ---------")
+    s = UeContextsMap(dbg=False)
+    w = UeContextsShmWriter(s, path, capacity=8)
+    r = UeContextsShmReader(path)
+    assert r.getue_by_du_index("du0", 0) is None and r.get_num_contexts() == 0
+
+    s.hook_du_ue_ctx_creation("du0", 0, 101, 1, 1000, 12, 201, now=now)
+    s.hook_cucp_uemgr_ue_add("cucp0", 7, 101, 1, 1000, now=now)
+    s.add_tmsi("cucp0", 7, 0x1234, now=now)
+    proc = JbpfNgapProcedure.NGAP_PROCEDURE_INITIAL_CONTEXT_SETUP
+    s.hook_ngap_procedure_started("cucp0", 7, proc, 3, now=now)
+    s.hook_ngap_procedure_completed("cucp0", 7, proc, True, 3, 33, now=now)
+    ue = r.getue_by_du_index("du0", 0)
+    assert ue == ShmUeContext(0, "du0", 0, "cucp0", 7, None, None, 101, 1, 1000, 201, 12, 0x1234, 3, 33, None)
+    assert r.getue_by_cucp_index("cucp0", 7) == ue and r.getue_by_pci_rnti(1, 1000) == ue
+    assert r.getue_by_du_index("du1", 0) is None and r.getue_by_cucp_index("cucp0", 0) is None
+    assert r.get_num_contexts() == 1
+
+    # the crnti update moves the (pci, rnti) key
+    s.hook_du_ue_ctx_update_crnti("du0", 0, 1001, now=now)
+    assert r.getue_by_pci_rnti(1, 1000) is None and r.getue_by_pci_rnti(1, 1001).ue_id == 0
+
+    # the same (pci, rnti) in two PLMNs is ambiguous, as in the map, until one of the UEs goes
+    s.hook_du_ue_ctx_creation("du1", 0, 202, 1, 1001, 12, 201, now=now)
+    assert r.getue_by_pci_rnti(1, 1001) is None and s.getid_by_pci_rnti(1, 1001) is None
+    assert r.getue_by_du_index("du1", 0).ue_id == 1 and r.getue_by_du_index("du0", 0).ue_id == 0
+    s.hook_du_ue_ctx_deletion("du0", 0, now=now)
+    s.hook_cucp_uemgr_ue_remove("cucp0", 7, now=now)
+    assert r.getue_by_pci_rnti(1, 1001).ue_id == 1 and r.getue_by_du_index("du0", 0) is None
+    assert r.getue_by_du_index("du1", 0).plmn == 202 and r.get_num_contexts() == 1
+
+    # the records are reused, the indexes stay consistent through the backward shift deletions
+    for n in range(100):
+        s.hook_du_ue_ctx_creation("du0", n, 101, 2, n, 12, 201, now=now)
+        if n >= 4:
+            s.hook_du_ue_ctx_deletion("du0", n - 4, now=now)
+        assert all(r.getue_by_du_index("du0", k).crnti == k for k in range(max(0, n - 3), n + 1))
+        assert r.getue_by_du_index("du0", n - 4) is None
+    assert r.get_num_contexts() == 5 and w.num_dropped == 0
+
+    # a full table drops the contexts
+    for n in range(100, 110):
+        s.hook_du_ue_ctx_creation("du0", n, 101, 2, n, 12, 201, now=now)
+    assert r.get_num_contexts() == 8 and w.num_dropped == 7
+
+    # a key of three UEs stays ambiguous until a single one holds it
+    for n in range(100, 110):
+        s.hook_du_ue_ctx_deletion("du0", n, now=now)
+    for n in range(3):
+        s.hook_du_ue_ctx_creation("du2", n, 101 + n, 5, 500, 12, 201, now=now)
+    assert r.getue_by_pci_rnti(5, 500) is None
+    s.hook_du_ue_ctx_deletion("du2", 0, now=now)
+    assert r.getue_by_pci_rnti(5, 500) is None
+    s.hook_du_ue_ctx_deletion("du2", 2, now=now)
+    assert r.getue_by_pci_rnti(5, 500).du_index == 1 and s.getid_by_pci_rnti(5, 500) == r.getue_by_pci_rnti(5, 500).ue_id
+    s.hook_du_ue_ctx_deletion("du2", 1, now=now)
+    assert r.getue_by_pci_rnti(5, 500) is None
+
+    # the contexts of the srcs beyond MAX_SRCS are dropped, and the hooks go on
+    for n in range(100, 110):
+        s.hook_du_ue_ctx_deletion("du0", n, now=now)
+    w.num_dropped = 0
+    for n in range(MAX_SRCS):
+        w.get_src_id(f"du-extra{n}")
+    s.hook_du_ue_ctx_creation("du-last", 0, 101, 3, 3000, 12, 201, now=now)
+    s.hook_cucp_uemgr_ue_add("cucp0", 0, 101, 3, 3000, now=now)
+    assert s.getuectx(s.getid_by_du_index("du-last", 0)).cucp_index is not None
+    assert w.num_dropped == 2 and r.getue_by_pci_rnti(3, 3000) is None
+    # as is an existing context moving to such a src
+    s.hook_du_ue_ctx_creation("du1", 1, 101, 4, 4000, 12, 201, now=now)
+    assert r.getue_by_pci_rnti(4, 4000) is not None
+    s.hook_cucp_uemgr_ue_add("cucp-last", 0, 101, 4, 4000, now=now)
+    assert r.getue_by_pci_rnti(4, 4000) is None and w.num_dropped == 3
+
+    # a new writer replaces the table
+    w.close()
+    assert r.closed()
+    s2 = ShardedUeContextsMap(2, shard_by_src={"du0": 0, "du1": 1})
+    w2 = UeContextsShmWriter(s2, path, capacity=8)
+    assert r.reopen_if_replaced() and not r.closed() and r.get_num_contexts() == 0
+    s2.hook_du_ue_ctx_creation("du1", 0, 101, 1, 1000, 12, 201, now=now)
+    s2.hook_du_ue_ctx_creation("du0", 0, 101, 2, 1000, 12, 201, now=now)
+    assert r.getue_by_du_index("du1", 0).ue_id == 1 << 40 and r.getue_by_du_index("du0", 0).ue_id == 0
+
+    r.close()
+    w2.close()
+    os.remove(path)
+    os.rmdir(d)
+
+    print("\n\n------ All tests passed ---------")
+    sys.exit(0)
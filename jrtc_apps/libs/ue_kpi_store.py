@@ -0,0 +1,354 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+#
+# Rolling per-UE KPI history, for the recent trend of the figures computed by the dashboard
+# from the MAC, RLC, PDCP and FAPI reports (e.g. "succ_rate", "avg_sinr", "l1_mcs_avg").
+#
+# Each KPI has a NumPy ring buffer of the last "size" reports of each UE: the UEs have a row
+# in a (capacity, size) array of values and of timestamps, and the next slot to write in each
+# row.  An append writes one slot, and the min/max/mean/percentiles are computed on the rows,
+# or on all the rows of a KPI at once.  A row fills from its first slot, so the values of a
+# UE are the first "count" slots of its row, the others hold NaN.
+# The rows (ue_rows.UeRows) are reclaimed from the change notifications of the map (UeContextsMap.subscribe())
+# when a UE context is deleted, so the memory is bounded by the number of UEs.  With the tombstones
+# of the map enabled, the row of a deleted UE is kept while the map keeps its context, as the reports
+# of its last period arrive after its delete events, and reclaimed once the tombstone is gone.
+# Requires NumPy, see ue_rows.available.
+#
+
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Sequence, Tuple
+
+from ue_rows import UeRows, np, available
+from ue_contexts_map import UeContextChange, UeContextChangeKind
+
+
+##########################################################################
+class UeKpiRing:
+    """
+    The ring buffers of one KPI, one row per UE.
+    """
+
+    ####################################################################
+    def __init__(self, capacity: int, size: int):
+        self.values = np.full((capacity, size), np.nan, dtype=np.float64)
+        self.times = np.zeros((capacity, size), dtype=np.int64)
+        self.heads = np.zeros(capacity, dtype=np.int32)      # next slot to write
+        self.counts = np.zeros(capacity, dtype=np.int32)     # slots written, up to size
+
+    ####################################################################
+    def grow(self) -> None:
+        # doubles the rows
+        capacity, size = self.values.shape
+        self.values = np.concatenate((self.values, np.full((capacity, size), np.nan, dtype=np.float64)))
+        self.times = np.concatenate((self.times, np.zeros((capacity, size), dtype=np.int64)))
+        self.heads = np.concatenate((self.heads, np.zeros(capacity, dtype=np.int32)))
+        self.counts = np.concatenate((self.counts, np.zeros(capacity, dtype=np.int32)))
+
+    ####################################################################
+    def clear(self, row: int) -> None:
+        self.values[row] = np.nan
+        self.heads[row] = 0
+        self.counts[row] = 0
+
+    ####################################################################
+    def append(self, row: int, value: float, timestamp: int) -> None:
+        head = int(self.heads[row])
+        self.values[row, head] = value
+        self.times[row, head] = timestamp
+        self.heads[row] = (head + 1) % self.values.shape[1]
+        if self.counts[row] < self.values.shape[1]:
+            self.counts[row] += 1
+
+    ####################################################################
+    def stats(self, rows: "np.ndarray", percentiles: Sequence[float]) -> Dict[str, "np.ndarray"]:
+        # min/max/mean/percentiles of rows with values, the NaN sorted after the values of each row
+        counts = self.counts[rows]
+        values = np.sort(self.values[rows], axis=1)
+        stats = {
+            "min": values[:, 0],
+            "max": np.take_along_axis(values, (counts - 1)[:, None], axis=1)[:, 0],
+            "mean": np.nansum(values, axis=1) / counts,
+        }
+        # linear interpolation between the closest ranks, as np.percentile
+        for p in percentiles:
+            pos = (counts - 1) * (p / 100)
+            lo = np.floor(pos).astype(np.int64)
+            hi = np.minimum(lo + 1, counts - 1)
+            vlo = np.take_along_axis(values, lo[:, None], axis=1)[:, 0]
+            vhi = np.take_along_axis(values, hi[:, None], axis=1)[:, 0]
+            stats[f"p{p:g}"] = vlo + (vhi - vlo) * (pos - lo)
+        return stats
+
+    ####################################################################
+    def ordered(self, row: int) -> Tuple["np.ndarray", "np.ndarray"]:
+        # the timestamps and values of a row, oldest first
+        count = int(self.counts[row])
+        head = int(self.heads[row])
+        order = (np.arange(head - count, head)) % self.values.shape[1]
+        return self.times[row, order], self.values[row, order]
+
+
+##########################################################################
+class UeKpiStore:
+    """
+    Per-UE ring buffers of the last reports of each KPI, for the UE contexts of a UeContextsMap
+    or ShardedUeContextsMap.  The KPIs are created by their first append.
+    The appends and the queries are done under the lock of the UeKpiStore, see ShardedUeContextsMap.subscribe().
+    """
+
+    ####################################################################
+    def __init__(self, m, size: int = 64, capacity: int = 1024):
+        if np is None:
+            raise ImportError("UeKpiStore requires numpy")
+        self.m = m
+        self.size = size
+        self.lock = threading.Lock()
+        self.kpis: Dict[str, UeKpiRing] = {}
+        self.rows = UeRows(capacity, self.grow)
+        self.tombstoned = OrderedDict()     # ue_id -> row of the deleted contexts with a tombstone, oldest first
+        m.subscribe(self.on_change)
+
+    ####################################################################
+    def close(self) -> None:
+        self.m.unsubscribe(self.on_change)
+
+    ####################################################################
+    def grow(self, capacity: int) -> None:
+        for ring in self.kpis.values():
+            ring.grow()
+
+    ####################################################################
+    def on_change(self, change: UeContextChange) -> None:
+        if change.kind != UeContextChangeKind.DELETED:
+            return
+        with self.lock:
+            row = self.rows.get(change.ue_id)
+            if row is None:
+                return
+            if self.m.has_tombstone(change.ue_id):
+                self.tombstoned[change.ue_id] = row
+            else:
+                self.free_row(change.ue_id)
+
+    ####################################################################
+    def free_row(self, ue_id: int) -> None:
+        # called with the lock held
+        row = self.rows.free(ue_id)
+        for ring in self.kpis.values():
+            ring.clear(row)
+
+    ####################################################################
+    def get_row(self, ue_id: int) -> int:
+        # called with the lock held
+        row = self.rows.get(ue_id)
+        if row is not None:
+            if len(self.tombstoned) == 0 or ue_id not in self.tombstoned or self.m.has_tombstone(ue_id):
+                return row
+            # the tombstone expired since the last report of the UE
+            del self.tombstoned[ue_id]
+            self.free_row(ue_id)
+            return None
+        # no row for a context which is already deleted, unless its tombstone is kept, as it would never be reclaimed
+        tombstoned = False
+        if self.m.getue_by_id(ue_id) is None:
+            if not self.m.has_tombstone(ue_id):
+                return None
+            tombstoned = True
+        # the tombstones expire without a notification, so their rows are reclaimed here
+        while len(self.tombstoned) > 0:
+            old_ue_id = next(iter(self.tombstoned))
+            if self.m.has_tombstone(old_ue_id):
+                break
+            del self.tombstoned[old_ue_id]
+            self.free_row(old_ue_id)
+        row = self.rows.alloc(ue_id)
+        if tombstoned:
+            self.tombstoned[ue_id] = row
+        return row
+
+    ####################################################################
+    def append(self, ue_id: int, kpi: str, value: float, timestamp: int = 0) -> None:
+        """
+        Add the value of a KPI for a UE, overwriting its oldest value once the ring is full.
+        The values of the unknown UEs (ue_id None, or a deleted context without a tombstone) are dropped.
+        """
+        if ue_id is None or value is None:
+            return
+        with self.lock:
+            row = self.get_row(ue_id)
+            if row is None:
+                return
+            ring = self.kpis.get(kpi, None)
+            if ring is None:
+                ring = self.kpis[kpi] = UeKpiRing(self.rows.capacity(), self.size)
+            ring.append(row, value, timestamp)
+
+    ####################################################################
+    def get_num_ues(self) -> int:
+        with self.lock:
+            return len(self.rows)
+
+    ####################################################################
+    def get_kpis(self) -> List[str]:
+        with self.lock:
+            return sorted(self.kpis)
+
+    ####################################################################
+    def series(self, ue_id: int, kpi: str) -> Tuple[List[int], List[float]]:
+        """
+        :return: the timestamps and values of a KPI of a UE, oldest first.
+        """
+        with self.lock:
+            row = self.rows.get(ue_id)
+            ring = self.kpis.get(kpi, None)
+            if row is None or ring is None:
+                return [], []
+            times, values = ring.ordered(row)
+            return times.tolist(), values.tolist()
+
+    ####################################################################
+    def summary(self, ue_id: int, kpis: Sequence[str] = None, percentiles: Sequence[float] = (50, 90)) -> Dict[str, Dict]:
+        """
+        :param kpis: the KPIs to summarize, all of them by default.
+        :return: kpi -> {"count", "last", "min", "max", "mean", "p50", ...} over the values of a UE,
+                 for the KPIs with values.
+        """
+        out = {}
+        with self.lock:
+            row = self.rows.get(ue_id)
+            if row is None:
+                return out
+            for kpi in (sorted(self.kpis) if kpis is None else kpis):
+                ring = self.kpis.get(kpi, None)
+                if ring is None or ring.counts[row] == 0:
+                    continue
+                s = {
+                    "count": int(ring.counts[row]),
+                    "last": float(ring.values[row, (ring.heads[row] - 1) % self.size]),
+                }
+                s.update({k: float(v[0]) for k, v in ring.stats(np.array([row]), percentiles).items()})
+                out[kpi] = s
+        return out
+
+    ####################################################################
+    def summaries(self, kpi: str, percentiles: Sequence[float] = ()) -> Dict[int, Dict]:
+        """
+        Summarize a KPI for all the UEs at once.
+        :return: ue_id -> {"count", "min", "max", "mean", "p50", ...}, for the UEs with values.
+        """
+        with self.lock:
+            ring = self.kpis.get(kpi, None)
+            if ring is None:
+                return {}
+            rows = np.flatnonzero(ring.counts[:self.rows.num_rows] > 0)
+            ue_ids = self.rows.ue_id[rows]
+            counts = ring.counts[rows]
+            stats = ring.stats(rows, percentiles)
+        return {int(ue_id): dict({"count": int(counts[i])}, **{k: float(v[i]) for k, v in stats.items()})
+                for i, ue_id in enumerate(ue_ids)}
+
+
+##########################################################################
+if __name__ == "__main__":
+
+    import sys
+    import datetime as dt
+    from ue_contexts_map import UeContextsMap, ShardedUeContextsMap, SHARD_ID_SHIFT
+
+    if not available:
+        print("numpy is not installed")
+        sys.exit(0)
+
+    now = dt.datetime.now(dt.UTC)
+
+    print("\n\n------ Test: UE KPI store ---------")
+    s = UeContextsMap(dbg=False)
+    k = UeKpiStore(s, size=4, capacity=2)
+    for n in range(3):
+        s.hook_du_ue_ctx_creation("du0", n, 101, 400, 1000 + n, 12, 201, now=now)
+    for t in range(6):
+        for n in range(3):
+            k.append(n, "succ_rate", (t + n) / 10, timestamp=t)
+    k.append(0, "avg_sinr", 20.0, timestamp=5)
+    assert k.get_num_ues() == 3 and k.rows.capacity() == 4 and k.get_kpis() == ["avg_sinr", "succ_rate"]
+
+    # the rings keep the last 4 values
+    times, values = k.series(0, "succ_rate")
+    assert times == [2, 3, 4, 5] and np.allclose(values, [0.2, 0.3, 0.4, 0.5])
+    d = k.summary(0)
+    assert d["succ_rate"]["count"] == 4 and d["succ_rate"]["last"] == 0.5
+    assert np.isclose(d["succ_rate"]["min"], 0.2) and np.isclose(d["succ_rate"]["mean"], 0.35)
+    assert np.isclose(d["succ_rate"]["p50"], 0.35) and d["avg_sinr"] == {"count": 1, "last": 20.0, "min": 20.0, "max": 20.0,
+                                                                           "mean": 20.0, "p50": 20.0, "p90": 20.0}
+    assert k.summary(1, ["avg_sinr"]) == {} and k.series(1, "avg_sinr") == ([], [])
+    d = k.summaries("succ_rate", percentiles=(90,))
+    assert sorted(d) == [0, 1, 2] and np.isclose(d[2]["max"], 0.7) and "p90" in d[2]
+    assert list(k.summaries("avg_sinr")) == [0]
+    for row in range(3):
+        values = k.kpis["succ_rate"].values[row]
+        for p in (0, 25, 50, 90, 100):
+            assert np.isclose(k.kpis["succ_rate"].stats(np.array([row]), (p,))[f"p{p}"][0], np.percentile(values, p))
+    k.append(1, "avg_sinr", 3.0)
+    k.append(1, "avg_sinr", 1.0)
+    k.append(1, "avg_sinr", 2.0)
+    assert k.summaries("avg_sinr", (50, 75))[1] == {"count": 3, "min": 1.0, "max": 3.0, "mean": 2.0, "p50": 2.0, "p75": 2.5}
+
+    # the values of the unknown and deleted UEs are dropped
+    k.append(None, "succ_rate", 1.0)
+    k.append(99, "succ_rate", 1.0)
+    assert k.get_num_ues() == 3
+
+    # the rows of the deleted contexts are cleared and reused
+    s.hook_du_ue_ctx_deletion("du0", 0, now=now)
+    assert k.get_num_ues() == 2 and k.summary(0) == {} and k.rows.free_rows == [0]
+    s.hook_du_ue_ctx_creation("du0", 5, 101, 400, 1005, 12, 201, now=now)
+    ue_id = s.getid_by_du_index("du0", 5)
+    k.append(ue_id, "succ_rate", 1.0, timestamp=7)
+    assert k.rows.get(ue_id) == 0 and k.rows.num_rows == 3
+    assert k.series(ue_id, "succ_rate") == ([7], [1.0]) and k.summary(ue_id)["succ_rate"]["count"] == 1
+    assert "avg_sinr" not in k.summary(ue_id)
+
+    k.close()
+    s.hook_du_ue_ctx_deletion("du0", 1, now=now)
+    assert k.get_num_ues() == 3
+
+    print("\n\n------ Test: UE KPI store with tombstones ---------")
+    s = UeContextsMap(dbg=False)
+    s.tombstone_expiry_secs = dt.timedelta(seconds=5)
+    k = UeKpiStore(s, size=4, capacity=2)
+    for n in range(2):
+        s.hook_du_ue_ctx_creation("du0", n, 101, 400, 1000 + n, 12, 201, now=now)
+    k.append(0, "succ_rate", 0.5, timestamp=1)
+    s.hook_du_ue_ctx_deletion("du0", 0, now=now)
+    s.hook_du_ue_ctx_deletion("du0", 1, now=now)
+    # the reports of the last period of a deleted UE, found through its tombstone, are kept
+    assert s.getid_by_du_index("du0", 0, tombstone=True) == 0
+    k.append(0, "succ_rate", 0.7, timestamp=2)
+    k.append(1, "succ_rate", 0.9, timestamp=2)
+    assert k.series(0, "succ_rate") == ([1, 2], [0.5, 0.7]) and k.series(1, "succ_rate") == ([2], [0.9])
+    assert list(k.tombstoned) == [0, 1] and k.get_num_ues() == 2
+    # and their rows are reclaimed for the next UEs once the tombstones expire
+    s.process_timeout(now=now + dt.timedelta(seconds=6))
+    k.append(0, "succ_rate", 1.0)
+    assert k.series(0, "succ_rate") == ([], []) and list(k.tombstoned) == [1]
+    s.hook_du_ue_ctx_creation("du0", 2, 101, 400, 1002, 12, 201, now=now + dt.timedelta(seconds=6))
+    k.append(2, "succ_rate", 0.1, timestamp=3)
+    assert k.get_num_ues() == 1 and k.rows.num_rows == 2 and len(k.tombstoned) == 0
+    assert k.series(2, "succ_rate") == ([3], [0.1]) and k.summary(0) == {}
+    k.close()
+
+    print("\n\n------ Test: UE KPI store of a sharded map ---------")
+    s = ShardedUeContextsMap(2, shard_by_src={"du0": 0, "du1": 1})
+    k = UeKpiStore(s)
+    s.hook_du_ue_ctx_creation("du0", 0, 101, 400, 1000, 12, 201, now=now)
+    s.hook_du_ue_ctx_creation("du1", 0, 101, 401, 1000, 12, 202, now=now)
+    k.append(0, "l1_mcs_avg", 27)
+    k.append(1 << SHARD_ID_SHIFT, "l1_mcs_avg", 15)
+    assert sorted(k.summaries("l1_mcs_avg")) == [0, 1 << SHARD_ID_SHIFT]
+    s.hook_du_ue_ctx_deletion("du1", 0, now=now)
+    assert list(k.summaries("l1_mcs_avg")) == [0]
+
+    print("\n\n------ All tests passed ---------")
+    sys.exit(0)
@@ -0,0 +1,116 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+#
+# Rows of NumPy arrays allocated to the UE contexts of a UeContextsMap, shared by the per-UE
+# arrays of ue_contexts_columns and ue_kpi_store.
+#
+# A UE context gets a row the first time its owner writes it, and gives it back when the owner
+# frees it, usually on the deletion of the context (UeContextsMap.subscribe()).  The freed rows
+# are reused before new ones, so the arrays are bounded by the number of UEs, and the owner
+# grows its arrays with the rows, doubling them when they are full.
+#
+# NumPy is optional.  Without it, this module and its users still import, "available" is False
+# and UeRows and its users cannot be created.
+#
+
+from typing import Callable
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+available = np is not None
+
+NONE = -1
+
+
+##########################################################################
+class UeRows:
+    """
+    The rows of the UE contexts in arrays of capacity rows.  ue_id holds the ue_id of each row,
+    NONE for a free row.  grow(capacity) is called before the capacity doubles, for the owner to
+    double its arrays.
+    Not thread-safe: the owners use it under their own lock.
+    """
+
+    ####################################################################
+    def __init__(self, capacity: int, grow: Callable[[int], None]):
+        if np is None:
+            raise ImportError("UeRows requires numpy")
+        self.ue_id = np.full(capacity, NONE, dtype=np.int64)
+        self.grow = grow
+        self.rows = {}          # ue_id -> row
+        self.free_rows = []     # rows of the freed contexts, reused before the rows above num_rows
+        self.num_rows = 0       # rows used so far, free or not
+
+    ####################################################################
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    ####################################################################
+    def __contains__(self, ue_id: int) -> bool:
+        return ue_id in self.rows
+
+    ####################################################################
+    def capacity(self) -> int:
+        return len(self.ue_id)
+
+    ####################################################################
+    def get(self, ue_id: int) -> int:
+        return self.rows.get(ue_id, None)
+
+    ####################################################################
+    def alloc(self, ue_id: int) -> int:
+        row = self.rows.get(ue_id, None)
+        if row is not None:
+            return row
+        if len(self.free_rows) > 0:
+            row = self.free_rows.pop()
+        else:
+            if self.num_rows == len(self.ue_id):
+                capacity = len(self.ue_id)
+                self.grow(capacity)
+                self.ue_id = np.concatenate((self.ue_id, np.full(capacity, NONE, dtype=np.int64)))
+            row = self.num_rows
+            self.num_rows += 1
+        self.ue_id[row] = ue_id
+        self.rows[ue_id] = row
+        return row
+
+    ####################################################################
+    def free(self, ue_id: int) -> int:
+        # :return: the freed row, for the owner to clear, None if the UE had none
+        row = self.rows.pop(ue_id, None)
+        if row is not None:
+            self.ue_id[row] = NONE
+            self.free_rows.append(row)
+        return row
+
+    ####################################################################
+    def used(self):
+        # mask of the used rows among the first num_rows
+        return self.ue_id[:self.num_rows] != NONE
+
+
+##########################################################################
+if __name__ == "__main__":
+
+    import sys
+
+    if not available:
+        print("numpy is not installed")
+        sys.exit(0)
+
+    print("\n\n------ Test: UE rows ---------")
+    grown = []
+    r = UeRows(2, grown.append)
+    assert [r.alloc(ue_id) for ue_id in (10, 11, 12)] == [0, 1, 2]
+    assert grown == [2] and r.capacity() == 4 and r.alloc(11) == 1 and len(r) == 3
+    assert r.free(10) == 0 and r.free(10) is None and 10 not in r and r.get(10) is None
+    assert r.used().tolist() == [False, True, True]
+    # the freed rows are reused first
+    assert r.alloc(13) == 0 and r.num_rows == 3 and r.ue_id[:3].tolist() == [13, 11, 12]
+
+    print("\n\n------ All tests passed ---------")
+    sys.exit(0)